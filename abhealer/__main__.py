@@ -1,33 +1,53 @@
 # -*- coding: utf-8 -*-
 
 import os
-import sys
 import os.path
 import click
-import six
-import io
-import tempfile
 import pathlib
-import glob
-import shutil
-import fnmatch
-import yaml
-import zipfile
-import gzip
-import stat
-import copy
-from .pathutils import (
-    get_path_owner,
-    get_path_group,
-    chown,
-    compute_related_path,
-)
-from whichcraft import which
+from .listing import get_listing, invalidate as invalidate_listing
+from .journal import RecoverJournal
+from .profiling import span
+
+# Heavy modules (yaml, jinja2, arrow, asyncio, zipfile ...) are imported
+# where they are used, so commands like --help start fast.
 
 
 class UserData(object):
     def __init__(self):
-        pass
+        self.mode = "auto"
+        self.verbose = False
+        self.lock_timeout = None
+        self._is_dockerized = None
+
+    @property
+    def is_dockerized(self):
+        """
+        Detected on first use, commands that never run Areca don't pay for
+        the detection.
+        """
+
+        if self._is_dockerized is None:
+            self._is_dockerized = detect_dockerized(self.mode)
+
+        return self._is_dockerized
+
+
+def detect_dockerized(mode):
+    if mode != "auto":
+        return mode == "docker"
+
+    from .environment import find_areca_cl
+
+    with span("detect_areca"):
+        areca_cl_path = find_areca_cl()
+    if areca_cl_path is None:
+        click.echo(
+            "Can't found areca console script, use dockerized areca ..."
+        )
+        return True
+
+    click.echo("Found areca at : %s" % areca_cl_path)
+    return False
 
 
 # WARNING! When using zip compress (file_compression=True), we got this error
@@ -37,85 +57,103 @@ class UserData(object):
 # mode on a compressed FileSystem.
 
 
-def get_project_template():
-    from jinja2 import Environment, PackageLoader
+def find_data_dirs(proj_dir):
+    listing = get_listing(proj_dir)
 
-    loader = PackageLoader("abhealer", "templates")
+    return [(listing.name_of(num) + "_data") for num in listing.archives]
 
-    env = Environment(loader=loader)
 
-    return env.get_template("project.bcfg")
+# (project directory, data directories) and trace infos of the last call
+_last_trace_infos = [None, None]
 
 
-def folder_to_int(name):
-    parts = name.split("_")
-    first_part = int(parts[0])
-    if len(parts) < 2:
-        second_part = 0
-    else:
-        second_part = int(parts[1])
+def get_trace_infos(proj_dir, jobs=None):
+    """
+    Get merged traces of all archives, decoded by a process pool for long
+    histories (see traceload).
 
-    return first_part * 1000 + second_part
+    The result of the last call is reused while the project has the same
+    archives, they never change once written. Callers must not modify it.
+    """
+    from .traceload import load_trace_infos
 
+    data_dirs = [
+        os.path.join(str(proj_dir), adir) for adir in find_data_dirs(proj_dir)
+    ]
+    key = (os.path.realpath(str(proj_dir)), tuple(data_dirs))
+    last_key, trace_infos = _last_trace_infos
+    if key == last_key:
+        return trace_infos
 
-def int_to_folder(aint):
-    first_part = aint // 1000
-    second_part = aint % 1000
+    with span("load_traces", lane=os.path.basename(str(proj_dir))):
+        trace_infos = load_trace_infos(data_dirs, jobs)
 
-    second_part_text = ""
-    if second_part > 0:
-        second_part_text = "_%s" % second_part
+    _last_trace_infos[:] = [key, trace_infos]
+    return trace_infos
 
-    return str(first_part) + second_part_text
 
+def get_archive_trace_infos(proj_dir, date=None):
+    """
+    Get the trace of the newest archive at date (YYYY-MM-DD), the newest
+    archive if date is None. None if there's no such archive.
+    """
+    from .traceload import load_trace_infos
 
-def find_data_dirs(proj_dir):
-    data_dirs = []
-    proj_dir = os.path.realpath(str(proj_dir))
-    for afolder in os.listdir(proj_dir):
-        if afolder.endswith("_data"):
-            continue
+    listing = get_listing(proj_dir)
+    limit = None if date is None else date.replace("-", "")
 
-        if afolder.lower() == "history":
-            continue
+    found = None
+    for num in listing.data_archives:
+        if (limit is None) or (listing.name_of(num)[:8] <= limit):
+            found = num
 
-        data_dirs.append(afolder)
+    if found is None:
+        return None
 
-    data_dirs = sorted(data_dirs, key=lambda x: folder_to_int(x))
-    data_dirs = [(adir + "_data") for adir in data_dirs]
+    return load_trace_infos([listing.data_path(found)])
 
-    return data_dirs
 
+def verify_recovered(is_dockerized, vars, date=None):
+    """
+    Compare a recovered project with the trace of the recovered archive.
 
-def get_trace_infos(proj_dir):
-    data_dirs = find_data_dirs(proj_dir)
+    :return: Count of mismatches
+    """
+    from .treecheck import check_tree
 
-    trace_infos = dict()
-    for adir in data_dirs:
-        info_zip_path = os.path.join(str(proj_dir), adir, "trace")
-        with zipfile.ZipFile(info_zip_path) as info_zip_file:
-            trace_file = io.BytesIO(info_zip_file.read("trace"))
+    project_name = vars["project_name"]
+    dest_dir = os.path.join(str(vars["repository"]), project_name)
+    trace_infos = get_archive_trace_infos(dest_dir, date)
+    if trace_infos is None:
+        click.echo("%s : no archive to verify against!" % project_name)
+        return 1
 
-        with gzip.GzipFile(fileobj=trace_file) as trace_zip_file:
-            trace_info = trace_zip_file.read().decode()
+    if is_dockerized:
+        client_source_dir = "/opt/source"
+    else:
+        client_source_dir = vars["orig_path"]
 
-        # Parse trace info
-        lines = trace_info.splitlines()
-        for aline in lines:
-            aline = aline.strip()
-            if not aline:
-                continue
+    # Owners are only restored by root
+    owners = (not hasattr(os, "geteuid")) or (os.geteuid() == 0)
 
-            if aline.startswith("#"):
-                continue
+    count = 0
+    with span("verify", lane=project_name):
+        for mismatch in check_tree(
+            vars["src_path"], trace_infos, client_source_dir, owners=owners
+        ):
+            click.echo("%s : %s" % (project_name, mismatch))
+            count += 1
 
-            infos = aline.split(";")
-            trace_infos[infos[0]] = infos
+    if count:
+        click.echo("%s : %s mismatches" % (project_name, count))
+    else:
+        click.echo("%s : verified" % project_name)
 
-    return trace_infos
+    return count
 
 
-def recover_dirs(is_dockerized, orig_dir, source_dir, dest_dir):
+def make_recover_pipeline(is_dockerized, orig_dir, source_dir, dest_dir):
+    from .restore import RecoverPipeline
 
     source_dir = os.path.realpath(str(source_dir))
     dest_dir = os.path.realpath(str(dest_dir))
@@ -125,89 +163,66 @@ def recover_dirs(is_dockerized, orig_dir, source_dir, dest_dir):
     else:
         client_source_dir = orig_dir
 
-    trace_infos = get_trace_infos(dest_dir)
-
-    for k, v in trace_infos.items():
-        # Only process directories
-        if not k.startswith("d") and not k.startswith("s"):
-            continue
-
-        source_path = pathlib.Path(source_dir) / k[1:]
-        client_source_path = pathlib.Path(client_source_dir) / k[1:]
+    return RecoverPipeline(
+        get_trace_infos(dest_dir), source_dir, client_source_dir
+    )
 
-        if k.startswith("d"):
-            mode_index = 2
-            owner_index = 3
-            group_index = 4
-        elif k.startswith("s"):
-            mode_index = 3
-            owner_index = 4
-            group_index = 5
 
-        required_mode = int(v[mode_index]) & 0o777
+def recover_dirs(
+    is_dockerized, orig_dir, source_dir, dest_dir, lock_timeout=None
+):
+    """
+    Recover directories and symbolic links after Areca finished, see
+    RecoverPipeline.
+    """
+    from .locking import ProjectLock
 
-        if k.startswith("d"):
+    with ProjectLock(dest_dir, exclusive=False, timeout=lock_timeout):
+        make_recover_pipeline(
+            is_dockerized, orig_dir, source_dir, dest_dir
+        ).finish()
 
-            if source_path.exists():
-                if (source_path.stat()[stat.ST_MODE] & 0o777) != required_mode:
-                    source_path.chmod(required_mode)
-            else:
-                source_path.mkdir(mode=required_mode)
+    print("Recover directories permissions completed!")
 
-        elif k.startswith("s"):
-            client_link_path = v[1][1:]
 
-            if client_link_path.startswith(client_source_dir):
-                source_path.unlink()
-                target = compute_related_path(
-                    client_source_path, client_link_path
-                )
-                source_path.symlink_to(target)
-            else:
-                source_path.unlink()
-                source_path.symlink_to(client_link_path)
+def clear_dirs(dest_dir, lock_timeout=None):
+    """
+    Remove damaged archives, the exclusive lock of the project guarantees
+    that no Areca process is still writing them.
+    """
+    from .locking import ProjectLock
 
-        if sys.platform != "win32":
-            import pwd
-            import grp
+    with span("clear_dirs", lane=os.path.basename(str(dest_dir))):
+        with ProjectLock(dest_dir, exclusive=True, timeout=lock_timeout):
+            _clear_dirs(dest_dir)
 
-            if (get_path_owner(source_path) != v[owner_index]) or (
-                get_path_group(source_path) != v[group_index]
-            ):
-                try:
-                    chown(
-                        str(source_path),
-                        pwd.getpwnam(v[owner_index]).pw_uid,
-                        grp.getgrnam(v[group_index]).gr_gid,
-                    )
-                except KeyError:
-                    # No such a group or owner name
-                    click.echo(
-                        'No such owner or group : ("%s", "%s") !'
-                        % (v[owner_index], v[group_index])
-                    )
-                    pass
 
-    print("Recover directories permissions completed!")
+async def clear_dirs_async(dest_dir, lock_timeout=None):
+    """
+    clear_dirs() for event loops, other jobs keep running while it waits for
+    the lock or the disk.
+    """
+    from .locking import ProjectLock
+    from .runner import run_blocking
 
+    with span("clear_dirs", lane=os.path.basename(str(dest_dir))):
+        async with ProjectLock(dest_dir, exclusive=True, timeout=lock_timeout):
+            await run_blocking(_clear_dirs, dest_dir)
 
-def clear_dirs(dest_dir):
-    # Clear empty backups that only have
-    dirs = glob.glob(os.path.join(str(dest_dir), "*"))
-    for adir in dirs:
-        if not os.path.isdir(adir):
-            continue
 
-        adir = pathlib.Path(adir)
-        data_dir = adir.parent / (adir.stem + "_data" + adir.suffix)
+def _clear_dirs(dest_dir):
+    from .tiering import recover_interrupted, remove_archive_dir
 
-        if fnmatch.fnmatch(adir.stem, "*_data"):
-            continue
+    # An interrupted tiering must not look like damaged archives
+    recover_interrupted(dest_dir)
 
-        if not data_dir.exists():
-            print("Removed damaged empty backup directory : %s" % adir)
-            shutil.rmtree(str(adir), ignore_errors=True)
-            continue
+    # Clear empty backups that only have
+    listing = get_listing(dest_dir)
+    for num in listing.damaged_archives:
+        adir = listing.archive_path(num)
+        print("Removed damaged empty backup directory : %s" % adir)
+        remove_archive_dir(adir)
+        listing.discard(num)
 
         # files = os.listdir(str(adir))
 
@@ -227,12 +242,142 @@ def clear_dirs(dest_dir):
         #     shutil.rmtree(str(adir), ignore_errors=True)
 
 
-def exec_(is_backup, is_dockerized, vars):
-    vars = copy.deepcopy(vars)
+def get_backup_tool(is_dockerized):
+    from .arecabackup import DockerizedArecaBackup, LocalArecaBackup
+
+    if is_dockerized:
+        return DockerizedArecaBackup()
+
+    return LocalArecaBackup()
 
-    temp_dir = tempfile.TemporaryDirectory(prefix="abhealer")
 
-    template = get_project_template()
+def get_container_name(project_name):
+    """
+    Get a Docker container name for a project, project names could contain
+    characters Docker refuses.
+    """
+    import re
+
+    name = "abhealer-%s-%s" % (project_name, os.getpid())
+    return re.sub(r"[^a-zA-Z0-9_.-]", "_", name)
+
+
+def get_expected_entries(proj_dir):
+    """
+    Get scanned entries count of the newest archive, None if unknown.
+    """
+    import zipfile
+    import xml.etree.ElementTree as etree
+    from .arecabackup import DataInfo
+    from .progress import SCANNED_ENTRIES_KEY
+
+    listing = get_listing(proj_dir)
+    if not listing.data_archives:
+        return None
+
+    info = DataInfo(pathlib.Path(listing.data_path(listing.data_archives[-1])))
+    try:
+        return info.get_int_property(SCANNED_ENTRIES_KEY)
+    except (OSError, zipfile.BadZipfile, etree.ParseError):
+        return None
+
+
+def exec_(is_backup, is_dockerized, vars, **kwargs):
+    """
+    Synchronous version of exec_async()
+    """
+    from .runner import run_sync
+
+    return run_sync(exec_async(is_backup, is_dockerized, vars, **kwargs))
+
+
+async def exec_async(
+    is_backup, is_dockerized, vars, *args, lock_timeout=None, **kwargs
+):
+    """
+    Backup or recover one project under its lock, see _exec_async()
+
+    :param lock_timeout: Seconds to wait for the project lock, None waits
+    forever.
+    """
+    from .locking import ProjectLock, LockTimeoutError
+
+    project_name = vars["project_name"]
+    dest_dir = pathlib.Path(vars["repository"]) / project_name
+    if not dest_dir.exists():
+        dest_dir.mkdir(parents=True)
+
+    with span("backup" if is_backup else "recover", lane=project_name):
+        # Recoveries share the lock, they can't remove damaged archives
+        # while holding it.
+        if not is_backup:
+            await clear_dirs_async(dest_dir, lock_timeout)
+
+        lock = ProjectLock(dest_dir, exclusive=is_backup, timeout=lock_timeout)
+        try:
+            with span("lock", lane=project_name):
+                await lock.acquire_async()
+        except LockTimeoutError as e:
+            click.echo("%s : %s" % (project_name, e), err=True)
+            return 1
+
+        try:
+            ret = await _exec_async(
+                is_backup, is_dockerized, vars, *args, **kwargs
+            )
+        finally:
+            lock.release()
+
+        if not is_backup:
+            await clear_dirs_async(dest_dir, lock_timeout)
+
+    return ret
+
+
+async def _exec_async(
+    is_backup,
+    is_dockerized,
+    vars,
+    timeout=None,
+    progress=None,
+    journal=None,
+    workspace=None,
+    verbose=False,
+    throttle=None,
+):
+    """
+    Backup or recover one project
+
+    :param journal: A RecoverJournal, recovering of the project resumes from
+    its recorded state.
+    :param workspace: A ConfigWorkspace that keeps the rendered project
+    config, default to a temporary one.
+    :param verbose: Print the generated script and project config.
+    :param throttle: A Throttle shared by the processes of this run, the
+    project's own limits are taken from vars["limits"].
+    """
+    import time
+    import tempfile
+    from .runner import run_blocking, run_process
+    from .config import ConfigWorkspace
+    from .arecabackup import DockerizedArecaBackup
+    from .environment import find_areca_cl
+    from .throttle import Limits, Throttle
+    from .filters import gen_areca_filters
+    from .profiling import add_span
+    from .tiering import gen_docker_cold_options
+
+    # Only top level values are changed
+    vars = dict(vars)
+    project_name = vars["project_name"]
+
+    resume_state = None
+    if journal is not None:
+        resume_state = journal.state_of(project_name)
+
+    temp_dir = tempfile.TemporaryDirectory(prefix="abhealer")
+    if workspace is None:
+        workspace = ConfigWorkspace(temp_dir.name)
 
     source_dir = str(vars["src_path"])
 
@@ -248,9 +393,14 @@ def exec_(is_backup, is_dockerized, vars):
         if not os.path.exists(source_dir):
             os.makedirs(source_dir, exist_ok=True)
 
-        if os.listdir(source_dir):
+        # An interrupted recovery left files behind, Areca will overwrite
+        # them.
+        if os.listdir(source_dir) and (resume_state is None):
             raise click.UsageError("Destination must be empty directory!")
 
+        if (journal is not None) and (resume_state is None):
+            journal.mark(project_name, RecoverJournal.STARTED)
+
     if is_dockerized:
         source_client_dir = "/opt/source"
         dest_client_dir = "/opt/backup"
@@ -261,16 +411,13 @@ def exec_(is_backup, is_dockerized, vars):
         workspace_client_dir = os.path.abspath(temp_dir.name)
 
     fixed_config_file_name = vars["project_name"] + ".bcfg"
-    fixed_config_file_path = os.path.join(
-        temp_dir.name, fixed_config_file_name
-    )
-    # fixed_config_file_client_path = os.path.join(
-    #     workspace_client_dir, fixed_config_file_name
-    # )
 
     # Change paths
     vars["src_path"] = source_client_dir
     vars["dst_path"] = dest_client_dir
+    vars["filter_rules"] = gen_areca_filters(
+        vars.get("filters", None), source_client_dir
+    )
 
     docker_image = "starofrainnight/areca-backup"
 
@@ -283,18 +430,28 @@ def exec_(is_backup, is_dockerized, vars):
         temp_dir.name, backup_script_file_name
     )
 
-    config_file_client_path = os.path.join(
-        workspace_client_dir, fixed_config_file_name
-    )
     backup_script_file_client_path = os.path.join(
         workspace_client_dir, backup_script_file_name
     )
 
     with temp_dir:
+        # Write fixed config file
+        with span("render", lane=project_name):
+            fixed_config_file_path, rendered = workspace.render(
+                project_name, vars
+            )
+
+        if is_dockerized:
+            config_file_client_path = os.path.join(
+                DockerizedArecaBackup.CFG_DIR, fixed_config_file_name
+            )
+        else:
+            config_file_client_path = fixed_config_file_path
+
         if is_dockerized:
             areca_cl_script_dir = "/usr/local/bin"
         else:
-            areca_cl_script_dir = which("areca_cl.sh")
+            areca_cl_script_dir = find_areca_cl()
             areca_cl_script_dir = os.path.dirname(areca_cl_script_dir)
 
         with open(backup_script_file_path, "w") as f:
@@ -318,24 +475,41 @@ def exec_(is_backup, is_dockerized, vars):
                     % (config_file_client_path, source_client_dir, date_str)
                 )
             f.write("\n")
-        os.system("chmod +x %s" % backup_script_file_path)
+        os.chmod(backup_script_file_path, 0o755)
 
-        print("===== script begin =====")
-        with open(backup_script_file_path, "rb") as f:
-            print(f.read().decode("utf-8"))
-        print("===== script end =====")
+        print(
+            "Project config : %s (%s)"
+            % (fixed_config_file_path, "rendered" if rendered else "cached")
+        )
 
-        # Write fixed config file
-        xml_content = template.render(vars)
-        with open(fixed_config_file_path, "wb") as f:
-            f.write(xml_content.encode("utf-8"))
+        if verbose:
+            print("===== script begin =====")
+            with open(backup_script_file_path, "rb") as f:
+                print(f.read().decode("utf-8"))
+            print("===== script end =====")
 
-        print("===== xml begin =====")
-        print(xml_content)
-        print("===== xml end =====")
+            print("===== xml begin =====")
+            with open(fixed_config_file_path, "rb") as f:
+                print(f.read().decode("utf-8"))
+            print("===== xml end =====")
 
         run_client_cmd = backup_script_file_client_path
 
+        if throttle is None:
+            throttle = Throttle()
+
+        (
+            throttle_prefix,
+            throttle_docker_options,
+            process_options,
+            throttle_cleanup,
+        ) = throttle.prepare(
+            project_name,
+            Limits(vars.get("limits", None)),
+            [source_dir, str(dest_dir)],
+            is_dockerized,
+        )
+
         if is_dockerized:
             volume_options = ""
             # Map users and groups
@@ -345,6 +519,10 @@ def exec_(is_backup, is_dockerized, vars):
                 os.path.abspath(temp_dir.name),
                 workspace_client_dir,
             )
+            volume_options += " -v %s:%s " % (
+                os.path.abspath(workspace.base_dir),
+                DockerizedArecaBackup.CFG_DIR,
+            )
             volume_options += " -v %s:%s " % (
                 os.path.abspath(source_dir),
                 source_client_dir,
@@ -353,28 +531,123 @@ def exec_(is_backup, is_dockerized, vars):
                 dest_dir.resolve(),
                 dest_client_dir,
             )
-
-            backup_cmd = "docker run -t --rm %s %s %s" % (
+            # Links of cold archives point to host paths
+            volume_options += gen_docker_cold_options(dest_dir)
+
+            # Named container, so it could be killed on timeout
+            container_name = get_container_name(vars["project_name"])
+            backup_cmd = "docker run -t --rm --name %s %s %s %s %s" % (
+                container_name,
+                throttle_docker_options,
                 volume_options,
                 docker_image,
                 run_client_cmd,
             )
+            kill_cmd = ["docker", "kill", container_name]
         else:
-            backup_cmd = run_client_cmd
+            backup_cmd = throttle_prefix + run_client_cmd
+            kill_cmd = None
 
-        clear_dirs(dest_dir)
+        if is_backup:
+            await clear_dirs_async(dest_dir)
 
-        print("Executing : %s" % backup_cmd)
+        pipeline = None
+        if resume_state == RecoverJournal.ARECA_DONE:
+            print("Areca already recovered %s, skipped" % project_name)
+        else:
+            if not is_backup:
+                # Create directories before Areca extracts
+                with span("recover_skeleton", lane=project_name):
+                    # Traces are decoded off the event loop
+                    pipeline = await run_blocking(
+                        make_recover_pipeline,
+                        is_dockerized,
+                        vars["orig_path"],
+                        source_dir,
+                        dest_dir,
+                    )
+                    pipeline.start()
+
+            print("Executing : %s" % backup_cmd)
+
+            on_line = None
+            if progress is not None:
+                project_progress = progress.track(
+                    vars["project_name"],
+                    get_expected_entries(dest_dir),
+                    source_dir=source_dir,
+                    client_source_dir=source_client_dir,
+                )
+                on_line = project_progress.feed
+
+            # Time until the first output is Docker and JVM startup
+            started = time.perf_counter()
+            first_output = []
+
+            def on_areca_line(line):
+                if not first_output:
+                    first_output.append(time.perf_counter())
+                    add_span("startup", started, first_output[0], project_name)
+
+                if on_line is not None:
+                    on_line(line)
+
+            try:
+                with span("areca", lane=project_name):
+                    result = await run_process(
+                        backup_cmd,
+                        name=vars["project_name"],
+                        timeout=timeout,
+                        on_line=on_areca_line,
+                        kill_cmd=kill_cmd,
+                        **process_options
+                    )
+            finally:
+                if throttle_cleanup is not None:
+                    throttle_cleanup()
+
+            if progress is not None:
+                await project_progress.finish_async(result.returncode == 0)
+
+            # Areca changed the project directory, list it again next time
+            invalidate_listing(dest_dir)
+
+            if result.returncode:
+                click.echo(
+                    "Areca failed on %s with exit code %s%s"
+                    % (
+                        vars["project_name"],
+                        result.returncode,
+                        " (timeout)" if result.timed_out else "",
+                    ),
+                    err=True,
+                )
+                if is_backup:
+                    await clear_dirs_async(dest_dir)
+                return result.returncode
 
-        os.system(backup_cmd)
+            if journal is not None:
+                journal.mark(project_name, RecoverJournal.ARECA_DONE)
 
         if not is_backup:
-            recover_dirs(
-                is_dockerized, vars["orig_path"], source_dir, dest_dir
-            )
+            if pipeline is None:
+                pipeline = await run_blocking(
+                    make_recover_pipeline,
+                    is_dockerized,
+                    vars["orig_path"],
+                    source_dir,
+                    dest_dir,
+                )
+            with span("recover_dirs", lane=project_name):
+                await run_blocking(pipeline.finish)
+            print("Recover directories permissions completed!")
+
+            if journal is not None:
+                journal.mark(project_name, RecoverJournal.DONE)
 
         # Don't remove empty dirs, they are valid either !
-        clear_dirs(dest_dir)
+        if is_backup:
+            await clear_dirs_async(dest_dir)
 
     return 0
 
@@ -388,8 +661,34 @@ def exec_(is_backup, is_dockerized, vars):
 use docker version if mode=docker.""",
     default="auto",
 )
+@click.option(
+    "-v",
+    "--verbose",
+    is_flag=True,
+    default=False,
+    help="Print generated scripts and project configs.",
+)
+@click.option(
+    "--lock-timeout",
+    type=float,
+    default=None,
+    help="Seconds to wait for a project locked by another abhealer process, "
+    "wait forever by default.",
+)
+@click.option(
+    "--profile",
+    default=None,
+    help="Write timing spans of every phase to this file (Chrome trace "
+    "format).",
+)
+@click.option(
+    "--profile-python",
+    is_flag=True,
+    default=False,
+    help="Also run cProfile, stats are written to <profile file>.prof.",
+)
 @click.pass_context
-def main(ctx, mode):
+def main(ctx, mode, verbose, lock_timeout, profile, profile_python):
     """
     This program is a helper for dockerred Areca Backup.
 
@@ -400,46 +699,208 @@ def main(ctx, mode):
     """
 
     ctx.obj = UserData()
+    ctx.obj.mode = mode
+    ctx.obj.verbose = verbose
+    ctx.obj.lock_timeout = lock_timeout
 
-    if mode == "auto":
-        areca_cl_path = which("areca_cl.sh")
-        ctx.obj.is_dockerized = areca_cl_path is None
+    if profile is not None:
+        from .profiling import start_tracing, stop_tracing
 
-        if areca_cl_path is None:
-            click.echo(
-                "Can't found areca console script, use dockerized areca ..."
-            )
-        else:
-            click.echo("Found areca at : %s" % areca_cl_path)
-    else:
-        ctx.obj.is_dockerized = mode == "docker"
+        start_tracing(profile, profile_python)
+
+        def save_profile():
+            profiler = stop_tracing()
+            click.echo("Profile written : %s" % profiler.path, err=True)
+
+        ctx.call_on_close(save_profile)
+    elif profile_python:
+        raise click.UsageError("--profile-python requires --profile!")
 
 
 @main.command()
+@click.option(
+    "-j",
+    "--jobs",
+    type=int,
+    default=1,
+    help="How many projects are backed up at the same time.",
+)
+@click.option(
+    "--timeout",
+    type=float,
+    default=None,
+    help="Seconds before an Areca process be terminated.",
+)
+@click.option(
+    "--progress/--no-progress",
+    default=True,
+    help="Show progress, rate and ETA parsed from Areca output.",
+)
+@click.option(
+    "--window",
+    type=float,
+    default=None,
+    metavar="HOURS",
+    help="Schedule the stalest projects that fit into this window on the "
+    "jobs, defer the rest.",
+)
 @click.argument("config", type=click.File())
 @click.pass_context
-def backup(ctx, config):
+def backup(ctx, jobs, timeout, progress, window, config):
     """
     Backup a series projects to repository.
 
-    Project and repository paths are defined in config file.
+    Project and repository paths are defined in config file, they are
+    backed up in that order unless --window is given.
 
     \b
     CONFIG: The config file (in YAML format) path.
     """
+    from .config import ConfigWorkspace, iter_project_vars, load_config
+    from .progress import ProgressBoard
+    from .runner import run_jobs, run_sync
+    from .throttle import Limits, Throttle
+
+    vars = load_config(config)
+    workspace = ConfigWorkspace.for_config(config.name, "backup")
+    throttle = Throttle(Limits(vars.get("total_limits", None)), jobs)
+
+    board = ProgressBoard() if progress else None
+
+    def make_job(project_vars):
+        return lambda: exec_async(
+            True,
+            ctx.obj.is_dockerized,
+            project_vars,
+            timeout,
+            board,
+            workspace=workspace,
+            verbose=ctx.obj.verbose,
+            lock_timeout=ctx.obj.lock_timeout,
+            throttle=throttle,
+        )
+
+    project_vars_list = []
+    for project_vars, _ in iter_project_vars(vars):
+        # Report bad limits before any backup started
+        Limits(project_vars["limits"])
+
+        project_vars_list.append(project_vars)
+
+    if window is not None:
+        try:
+            return backup_window(
+                vars["repository"], project_vars_list, make_job, jobs, window
+            )
+        finally:
+            throttle.close()
+
+    project_jobs = [make_job(v) for v in project_vars_list]
+    try:
+        rets = run_sync(run_jobs(project_jobs, jobs))
+    finally:
+        throttle.close()
+
+    for ret in rets:
+        if ret:
+            return ret
+
+    return 0
+
+
+def backup_window(repository, project_vars_list, make_job, jobs, window):
+    """
+    Back up the projects that fit into a window of hours, see schedule.
+    """
+    import time
+    from .coordinator import predict_duration
+    from .progress import format_eta
+    from .runner import run_jobs, run_sync
+    from .schedule import (
+        ScheduleItem,
+        WindowClock,
+        plan_window,
+        get_staleness,
+        load_report,
+        save_report,
+    )
 
-    vars = yaml.load(config)
-    for source in vars["sources"]:
-        # Support path only source
-        if isinstance(source, six.string_types):
-            source = [source]
+    items = []
+    for project_vars in project_vars_list:
+        proj_dir = os.path.join(str(repository), project_vars["project_name"])
+        items.append(
+            ScheduleItem(
+                project_vars["project_name"],
+                get_staleness(proj_dir),
+                predict_duration(proj_dir),
+                project_vars,
+            )
+        )
+
+    schedule = plan_window(items, window * 3600, jobs)
+    for item in schedule.scheduled:
+        click.echo(
+            "Scheduled %s : start +%s, predicted %s, stale %s"
+            % (
+                item.name,
+                format_eta(item.start),
+                format_eta(item.predicted),
+                format_eta(item.staleness),
+            )
+        )
+    for item in schedule.deferred:
+        click.echo(
+            "Deferred %s : predicted %s does not fit"
+            % (item.name, format_eta(item.predicted))
+        )
+
+    clock = WindowClock(window * 3600)
+    finished = []
+    deferred = [item.name for item in schedule.deferred]
+
+    def make_scheduled_job(item):
+        job = make_job(item.payload)
+
+        async def run():
+            # Earlier projects may have taken longer than predicted
+            if not clock.fits(item):
+                click.echo("Deferred %s : window closing" % item.name)
+                deferred.append(item.name)
+                return 0
+
+            ret = await job()
+            if not ret:
+                finished.append(item.name)
+            return ret
 
-        vars["src_path"] = source[0]
-        vars["project_name"] = os.path.splitext(os.path.basename(source[0]))[0]
-        if (len(source) > 1) and (len(source[1].strip()) > 0):
-            vars["project_name"] = source[1].strip()
+        return run
 
-        ret = exec_(True, ctx.obj.is_dockerized, vars)
+    rets = run_sync(
+        run_jobs([make_scheduled_job(i) for i in schedule.scheduled], jobs)
+    )
+    for item, ret in zip(schedule.scheduled, rets):
+        if ret is None:
+            # Not started since an earlier project failed
+            click.echo("Deferred %s : stopped after a failure" % item.name)
+            deferred.append(item.name)
+
+    previous = load_report(repository).get("deferred", dict())
+    report = save_report(repository, schedule, finished, deferred)
+    for name, since in sorted(report["deferred"].items()):
+        if name in previous:
+            click.echo(
+                "%s : deferred again, first deferred at %s"
+                % (
+                    name,
+                    time.strftime("%Y-%m-%d %H:%M", time.localtime(since)),
+                )
+            )
+    click.echo(
+        "Window report : %s backed up, %s deferred"
+        % (len(finished), len(report["deferred"]))
+    )
+
+    for ret in rets:
         if ret:
             return ret
 
@@ -462,11 +923,30 @@ def recover(ctx):
     required=False,
     help="Recovery date, format as YYYY-MM-DD",
 )
+@click.option(
+    "--verify",
+    is_flag=True,
+    default=False,
+    help="Compare the recovered tree with the trace afterwards.",
+)
+@click.option(
+    "--to-tar",
+    default=None,
+    metavar="FILE",
+    help="Write the project as a tar stream to FILE ('-' for stdout) "
+    "instead of TO_PATH.",
+)
+@click.option(
+    "--stage-dir",
+    default=None,
+    help="Where the project is extracted before --to-tar streams it, "
+    "defaults to the temporary directory.",
+)
 @click.argument("config", type=click.File())
 @click.argument("name")
-@click.argument("to_path")
+@click.argument("to_path", required=False)
 @click.pass_context
-def proj(ctx, date, config, name, to_path):
+def proj(ctx, date, verify, to_tar, stage_dir, config, name, to_path):
     """
     Only recover specific project
 
@@ -475,31 +955,45 @@ def proj(ctx, date, config, name, to_path):
     NAME    : Project name
     TO_PATH : Where you store the recovered project
     """
+    if (to_path is None) == (to_tar is None):
+        raise click.UsageError("Either TO_PATH or --to-tar is required!")
 
-    vars = yaml.load(config)
+    if to_tar is not None:
+        return recover_to_tar(
+            ctx, date, config, name, to_tar, stage_dir=stage_dir
+        )
 
-    for source in vars["sources"]:
-        # Support path only source
-        if isinstance(source, six.string_types):
-            source = [source]
+    from .config import ConfigWorkspace, iter_project_vars, load_config
 
-        vars["project_name"] = os.path.splitext(os.path.basename(source[0]))[0]
-
-        if (len(source) > 1) and (len(source[1].strip()) > 0):
-            vars["project_name"] = source[1].strip()
+    workspace = ConfigWorkspace.for_config(config.name, "recover")
 
+    # The tuned archive format is fixed once a project has archives, so
+    # recoveries use tuned settings too
+    for vars, _ in iter_project_vars(load_config(config)):
         click.echo("%s to %s" % (vars["project_name"], name))
         if vars["project_name"] != name:
             continue
 
+        vars["orig_path"] = os.path.realpath(
+            os.path.normpath(vars["src_path"])
+        )
         vars["src_path"] = to_path
-        vars["orig_path"] = os.path.realpath(os.path.normpath(source[0]))
         vars["date"] = date
 
-        ret = exec_(False, ctx.obj.is_dockerized, vars)
+        ret = exec_(
+            False,
+            ctx.obj.is_dockerized,
+            vars,
+            workspace=workspace,
+            verbose=ctx.obj.verbose,
+            lock_timeout=ctx.obj.lock_timeout,
+        )
         if ret:
             return ret
 
+        if verify and verify_recovered(ctx.obj.is_dockerized, vars, date):
+            return 1
+
         # Only exactly one project with spectific name.
         return 0
 
@@ -507,11 +1001,101 @@ def proj(ctx, date, config, name, to_path):
     raise click.BadArgumentUsage('Project "%s" not found!' % name)
 
 
+def recover_to_tar(ctx, date, config, name, to_tar, stage_dir=None):
+    """
+    Recover a project into a staging directory and stream it as a tar.
+    """
+    import sys
+    import tempfile
+    import contextlib
+    from .tarstream import write_tar, remove_staging
+    from .config import iter_sources, load_config
+
+    vars = load_config(config)
+    orig_path = None
+    for src_path, project_name, _ in iter_sources(vars):
+        if project_name == name:
+            orig_path = os.path.realpath(os.path.normpath(src_path))
+            break
+
+    if orig_path is None:
+        raise click.BadArgumentUsage('Project "%s" not found!' % name)
+
+    if to_tar == "-":
+        # Progress must not be mixed into the tar stream
+        redirect = contextlib.redirect_stdout(sys.stderr)
+    else:
+        # Nothing to redirect, ExitStack is a no-op context manager
+        redirect = contextlib.ExitStack()
+
+    staging = tempfile.mkdtemp(prefix="abhealer-tar-", dir=stage_dir)
+    try:
+        with redirect:
+            config.seek(0)
+            ret = ctx.invoke(
+                proj, date=date, config=config, name=name, to_path=staging
+            )
+        if ret:
+            return ret
+
+        dest_dir = os.path.join(vars["repository"], name)
+        if ctx.obj.is_dockerized:
+            client_source_dir = "/opt/source"
+        else:
+            client_source_dir = orig_path
+
+        # Decoded by the recovery already
+        trace_infos = get_trace_infos(dest_dir)
+        if to_tar == "-":
+            with span("tar", lane=name):
+                stats = write_tar(
+                    sys.stdout.buffer,
+                    staging,
+                    trace_infos,
+                    client_source_dir,
+                    root=name,
+                )
+            sys.stdout.buffer.flush()
+        else:
+            # A failed run must not leave a truncated tar behind
+            temp_path = "%s.%s.tmp" % (to_tar, os.getpid())
+            try:
+                with open(temp_path, "wb") as out:
+                    with span("tar", lane=name):
+                        stats = write_tar(
+                            out,
+                            staging,
+                            trace_infos,
+                            client_source_dir,
+                            root=name,
+                        )
+                os.replace(temp_path, to_tar)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+    finally:
+        remove_staging(staging)
+
+    click.echo(
+        "%s : %s files, %s bytes written to %s"
+        % (name, stats.files, stats.bytes, to_tar),
+        err=True,
+    )
+    return 0
+
+
 @recover.command()
+@click.option(
+    "--verify",
+    is_flag=True,
+    default=False,
+    help="Compare recovered trees with their traces afterwards.",
+)
 @click.argument("config", type=click.File())
 @click.argument("to_path")
 @click.pass_context
-def repo(ctx, config, to_path):
+def repo(ctx, verify, config, to_path):
     """
     Recover whole repository
 
@@ -519,24 +1103,737 @@ def repo(ctx, config, to_path):
     CONFIG  : The config file (in YAML format) path
     TO_PATH : Where you store the recovered project
     """
+    from .config import ConfigWorkspace, iter_project_vars, load_config
+
+    config_vars = load_config(config)
+    workspace = ConfigWorkspace.for_config(config.name, "recover")
+    journal = RecoverJournal(to_path, config_vars["repository"])
+    failed = 0
+    # Tuned settings are used as in "recover proj"
+    for vars, _ in iter_project_vars(config_vars):
+        if journal.state_of(vars["project_name"]) == RecoverJournal.DONE:
+            click.echo("%s already recovered, skipped" % vars["project_name"])
+            continue
 
-    vars = yaml.load(config)
-    for source in vars["sources"]:
-        # Support path only source
-        if isinstance(source, six.string_types):
-            source = [source]
+        vars["orig_path"] = os.path.realpath(
+            os.path.normpath(vars["src_path"])
+        )
+        vars["src_path"] = os.path.join(to_path, vars["project_name"])
 
-        vars["project_name"] = os.path.splitext(os.path.basename(source[0]))[0]
+        if exec_(
+            False,
+            ctx.obj.is_dockerized,
+            vars,
+            journal=journal,
+            workspace=workspace,
+            verbose=ctx.obj.verbose,
+            lock_timeout=ctx.obj.lock_timeout,
+        ):
+            break
 
-        if (len(source) > 1) and (len(source[1].strip()) > 0):
-            vars["project_name"] = source[1].strip()
+        if verify and verify_recovered(ctx.obj.is_dockerized, vars):
+            failed += 1
 
-        vars["src_path"] = os.path.join(to_path, vars["project_name"])
+    return 1 if failed else 0
 
-        vars["orig_path"] = os.path.realpath(os.path.normpath(source[0]))
 
-        if exec_(False, ctx.obj.is_dockerized, vars):
-            break
+@main.command("plan-merge")
+@click.option(
+    "--daily",
+    type=int,
+    default=7,
+    help="Keep one archive per day for these recent days.",
+)
+@click.option(
+    "--weekly",
+    type=int,
+    default=8,
+    help="Keep one archive per week for these weeks after the daily ones.",
+)
+@click.option(
+    "--archive-overhead",
+    type=float,
+    default=2.0,
+    help="Estimated recovery seconds spent on every archive.",
+)
+@click.option(
+    "--apply",
+    is_flag=True,
+    default=False,
+    help="Run Areca merge for the planned ranges.",
+)
+@click.argument("repository")
+@click.pass_context
+def plan_merge(ctx, daily, weekly, archive_overhead, apply, repository):
+    """
+    Plan (and apply) archive merges that bound incremental chains.
+
+    \b
+    REPOSITORY: The Areca Backup repository path.
+    """
+    from .arecabackup import Repository
+    from .merge import MergePolicy, plan_project
+    from .progress import format_eta
+
+    policy = MergePolicy(daily, weekly)
+    plans = [plan_project(p, policy) for p in Repository(repository).projects]
+
+    total_savings = 0.0
+    for plan in plans:
+        savings = plan.estimate_savings(archive_overhead)
+        total_savings += savings
+        click.echo(
+            "%s : chain %s -> %s, saves about %s"
+            % (
+                plan.project.name,
+                plan.chain_length,
+                plan.merged_chain_length,
+                format_eta(savings),
+            )
+        )
+
+        for arange in plan.ranges:
+            click.echo(
+                "  merge %s archives (%s bytes) %s .. %s (-from %s -to %s)"
+                % (
+                    len(arange.infos),
+                    arange.size,
+                    arange.first.datetime.strftime("%Y-%m-%d %H:%M"),
+                    arange.last.datetime.strftime("%Y-%m-%d %H:%M"),
+                    arange.from_days,
+                    arange.to_days,
+                )
+            )
+
+    click.echo(
+        "Estimated recovery time savings : %s" % format_eta(total_savings)
+    )
+
+    if not apply:
+        return 0
+
+    from .locking import ProjectLock
+
+    tool = get_backup_tool(ctx.obj.is_dockerized)
+    for plan in plans:
+        for arange in plan.ranges:
+            with ProjectLock(
+                plan.project.base_dir, timeout=ctx.obj.lock_timeout
+            ):
+                ret = tool.merge(
+                    plan.project.cfg_path,
+                    plan.project.base_dir,
+                    arange.from_days,
+                    arange.to_days,
+                )
+
+            invalidate_listing(plan.project.base_dir)
+            if ret:
+                return ret
+
+    return 0
+
+
+@main.command()
+@click.option(
+    "-j",
+    "--jobs",
+    type=int,
+    default=None,
+    help="Worker processes, default to the CPU count.",
+)
+@click.option(
+    "--state",
+    default=None,
+    help="Progress state file, default to .abhealer/verify.json inside the "
+    "repository.",
+)
+@click.option(
+    "--restart",
+    is_flag=True,
+    default=False,
+    help="Forget the progress state and verify everything again.",
+)
+@click.argument("repository")
+@click.pass_context
+def verify(ctx, jobs, state, restart, repository):
+    """
+    Verify integrity of all archives in a repository.
+
+    \b
+    REPOSITORY: The Areca Backup repository path.
+    """
+    from .arecabackup import Repository
+    from .verify import VerifyState, verify_repository
+
+    arepository = Repository(repository)
+    if state is None:
+        state = arepository.state_dir / "verify.json"
+
+    if restart and os.path.exists(str(state)):
+        os.remove(str(state))
+
+    verify_state = VerifyState(state)
+
+    for key, result in verify_repository(arepository, verify_state, jobs):
+        if result["errors"]:
+            click.echo("%s : FAILED" % key)
+            for error in result["errors"]:
+                click.echo("  %s" % error)
+        else:
+            click.echo("%s : OK %s" % (key, result["sha256"]))
+
+    failed = len([r for r in verify_state.archives.values() if r["errors"]])
+
+    click.echo(
+        "Verified %s archives, %s failed"
+        % (len(verify_state.archives), failed)
+    )
+    if failed:
+        ctx.exit(1)
+
+    return 0
+
+
+@main.command("dedup-report")
+@click.option(
+    "-j",
+    "--jobs",
+    type=int,
+    default=None,
+    help="Hashing processes, default to the CPU count.",
+)
+@click.option(
+    "--sources",
+    type=click.File(),
+    default=None,
+    help="Hash source trees of this config instead of archives.",
+)
+@click.option(
+    "--index",
+    default=None,
+    help="Hash index file, default to .abhealer/dedup.sqlite (or "
+    "dedup-sources.sqlite) inside the repository.",
+)
+@click.option(
+    "--top",
+    type=int,
+    default=20,
+    help="How many project pairs are reported.",
+)
+@click.argument("repository")
+@click.pass_context
+def dedup_report(ctx, jobs, sources, index, top, repository):
+    """
+    Report duplicated contents across projects.
+
+    \b
+    REPOSITORY: The Areca Backup repository path.
+    """
+    from .arecabackup import Repository
+    from .dedup import HashIndex, format_size, index_archives, index_sources
+
+    arepository = Repository(repository)
+    if index is None:
+        index = arepository.state_dir / (
+            "dedup-sources.sqlite" if sources else "dedup.sqlite"
+        )
+
+    hash_index = HashIndex(index)
+    try:
+        if sources is None:
+            for project, unit, count in index_archives(
+                arepository, hash_index, jobs
+            ):
+                click.echo("%s/%s : %s files" % (project, unit, count))
+        else:
+            from .config import iter_sources, load_config
+
+            vars = load_config(sources)
+            items = [(n, p) for p, n, _ in iter_sources(vars)]
+            for project, count, hashed in index_sources(
+                items, hash_index, jobs
+            ):
+                click.echo(
+                    "%s : %s files, %s hashed" % (project, count, hashed)
+                )
+
+        project_bytes = hash_index.project_bytes()
+        total_bytes = hash_index.total_bytes()
+        pairs = hash_index.pair_bytes()
+    finally:
+        hash_index.close()
+
+    click.echo("Duplicated bytes by project pair :")
+    for a, b, size in pairs[:top]:
+        click.echo("  %s <-> %s : %s" % (a, b, format_size(size)))
+
+    separated_bytes = sum(project_bytes.values())
+    click.echo(
+        "Distinct contents : %s in projects, %s across projects"
+        % (format_size(separated_bytes), format_size(total_bytes))
+    )
+    click.echo(
+        "A cross-project dedup store would save : %s"
+        % format_size(separated_bytes - total_bytes)
+    )
+
+    return 0
+
+
+@main.command()
+@click.option(
+    "--limit",
+    type=int,
+    default=1000,
+    help="Maximum matched paths to list.",
+)
+@click.argument("config", type=click.File())
+@click.argument("name")
+@click.argument("pattern")
+@click.pass_context
+def find(ctx, limit, config, name, pattern):
+    """
+    Find restore points that contain matched paths.
+
+    PATTERN is a glob (*, ? and [...]) of paths inside the project, a
+    pattern without wildcards matches that path and everything below it.
+
+    \b
+    CONFIG  : The config file (in YAML format) path
+    NAME    : Project name
+    PATTERN : Path pattern
+    """
+    from .catalog import PathCatalog, format_archive_name, get_catalog_path
+    from .config import iter_sources, load_config
+    from .locking import ProjectLock
+
+    vars = load_config(config)
+    if name not in [n for _, n, _ in iter_sources(vars)]:
+        raise click.BadArgumentUsage('Project "%s" not found!' % name)
+
+    proj_dir = pathlib.Path(vars["repository"]) / name
+    if not proj_dir.is_dir():
+        raise click.UsageError("Project never backed up : %s" % name)
+
+    catalog = PathCatalog(get_catalog_path(proj_dir))
+    try:
+        with ProjectLock(
+            proj_dir, exclusive=False, timeout=ctx.obj.lock_timeout
+        ):
+            catalog.update(
+                proj_dir,
+                lambda x: click.echo("Cataloged archive %s" % x, err=True),
+            )
+
+        found = 0
+        for path, atype, runs in catalog.find(pattern, limit):
+            found += 1
+            click.echo("%s %s" % (atype, path))
+            for first, last, count in runs:
+                click.echo(
+                    "  %s .. %s (%s archives)"
+                    % (
+                        format_archive_name(first),
+                        format_archive_name(last),
+                        count,
+                    )
+                )
+    finally:
+        catalog.close()
+
+    if not found:
+        click.echo("No path matched : %s" % pattern)
+        ctx.exit(1)
+
+    return 0
+
+
+@main.command()
+@click.option(
+    "-j",
+    "--jobs",
+    type=int,
+    default=None,
+    help="Probing processes, default to the CPU count.",
+)
+@click.option(
+    "--samples",
+    type=int,
+    default=200,
+    help="Files probed in every source.",
+)
+@click.option(
+    "--dry-run",
+    is_flag=True,
+    default=False,
+    help="Only print the chosen settings.",
+)
+@click.argument("config", type=click.File())
+@click.pass_context
+def tune(ctx, jobs, samples, dry_run, config):
+    """
+    Choose compression and transaction settings of every project.
+
+    Sources are probed for compressibility and previous manifests are
+    consulted, the settings are saved in the repository and used by later
+    backups and recoveries. Compression is only chosen for projects without
+    archives. Values set in the config always win.
+
+    \b
+    CONFIG: The config file (in YAML format) path.
+    """
+    from .config import (
+        MEDIUM_DEFAULTS,
+        iter_sources,
+        load_config,
+        merge_medium_options,
+    )
+    from .tuning import load_tuning, save_tuning, tune_projects
+
+    vars = load_config(config)
+    sources = [(n, p) for p, n, _ in iter_sources(vars)]
+    options = dict((n, o) for _, n, o in iter_sources(vars))
+
+    tuning = load_tuning(vars["repository"])
+    for name, settings, probe in tune_projects(
+        vars["repository"], sources, samples, jobs
+    ):
+        tuning[name] = settings
+
+        overridden = [
+            k for k in MEDIUM_DEFAULTS if (k in options[name]) or (k in vars)
+        ]
+        # Kept format keys could be unset, show the effective values
+        medium = merge_medium_options(vars, options[name], settings)
+        click.echo(
+            "%s : %s files probed, ratio %.2f, file_compression=%s "
+            "zip_level=%s transaction_size=%s%s"
+            % (
+                name,
+                probe.files,
+                settings["ratio"],
+                "true" if medium["file_compression"] else "false",
+                medium["zip_level"],
+                medium["transaction_size"],
+                (
+                    (" (config overrides %s)" % ", ".join(overridden))
+                    if overridden
+                    else ""
+                ),
+            )
+        )
+
+    if not dry_run:
+        save_tuning(vars["repository"], tuning)
+
+    return 0
+
+
+@main.command()
+@click.option(
+    "--preview",
+    is_flag=True,
+    default=False,
+    help="Walk sources and report files and bytes removed by every rule.",
+)
+@click.argument("config", type=click.File())
+@click.argument("name", required=False)
+@click.pass_context
+def filters(ctx, preview, config, name):
+    """
+    Show include/exclude filters of projects.
+
+    \b
+    CONFIG : The config file (in YAML format) path.
+    NAME   : Only show this project.
+    """
+    from .config import iter_sources, load_config
+    from .dedup import format_size
+    from .filters import FilterMatcher, merge_filters
+
+    vars = load_config(config)
+
+    found = False
+    for src_path, project_name, options in iter_sources(vars):
+        if (name is not None) and (project_name != name):
+            continue
+
+        found = True
+        matcher = FilterMatcher(merge_filters(vars, options))
+        click.echo("%s (%s) :" % (project_name, src_path))
+
+        if not preview:
+            for rule in matcher.rules:
+                click.echo("  %s" % rule)
+            continue
+
+        result = matcher.preview(src_path)
+        for rule in matcher.rules:
+            files, size = result.counts[str(rule)]
+            click.echo(
+                "  %s : %s files, %s" % (rule, files, format_size(size))
+            )
+
+        if result.not_included[0]:
+            click.echo(
+                "  not included : %s files, %s"
+                % (
+                    result.not_included[0],
+                    format_size(result.not_included[1]),
+                )
+            )
+
+        click.echo(
+            "  kept : %s files, %s"
+            % (result.kept[0], format_size(result.kept[1]))
+        )
+
+    if not found:
+        raise click.BadArgumentUsage('Project "%s" not found!' % name)
+
+    return 0
+
+
+@main.command()
+@click.option(
+    "--older-than",
+    type=int,
+    default=90,
+    help="Move archives older than these days.",
+)
+@click.option(
+    "--dry-run",
+    is_flag=True,
+    default=False,
+    help="Only print archives that would be moved.",
+)
+@click.argument("repository")
+@click.argument("cold_dir")
+@click.pass_context
+def tier(ctx, older_than, dry_run, repository, cold_dir):
+    """
+    Move old archives to a cold storage path, linked back in place.
+
+    The newest archive of every project always stays, incremental backups
+    read it.
+
+    \b
+    REPOSITORY : The Areca Backup repository path.
+    COLD_DIR   : Where archives are moved to, in a directory per repository
+    and project.
+    """
+    import datetime
+    from .arecabackup import Repository
+    from .locking import ProjectLock, LockTimeoutError
+    from .tiering import tier_project
+
+    older_than = datetime.timedelta(days=older_than)
+    cold_dir = os.path.realpath(cold_dir)
+    if os.path.realpath(repository) == cold_dir:
+        raise click.UsageError("COLD_DIR must not be the repository!")
+
+    failed = 0
+    for project in Repository(repository).projects:
+        try:
+            with ProjectLock(project.base_dir, timeout=ctx.obj.lock_timeout):
+                with span("tier", lane=project.name):
+                    result = tier_project(
+                        project.base_dir, cold_dir, older_than, dry_run
+                    )
+        except LockTimeoutError as e:
+            click.echo("%s : %s" % (project.name, e), err=True)
+            failed += 1
+            continue
+
+        for name in result.moved:
+            click.echo(
+                "%s : %s %s"
+                % (
+                    project.name,
+                    "would move" if dry_run else "moved",
+                    name,
+                )
+            )
+        for name in result.pruned:
+            click.echo("%s : pruned unlinked %s" % (project.name, name))
+
+    return 1 if failed else 0
+
+
+@main.command()
+@click.option(
+    "-j",
+    "--jobs",
+    type=int,
+    default=None,
+    help="Files copied in parallel.",
+)
+@click.option(
+    "--no-verify",
+    is_flag=True,
+    default=False,
+    help="Don't compare copied files with their sources.",
+)
+@click.argument("repository")
+@click.argument("dest")
+@click.pass_context
+def replicate(ctx, jobs, no_verify, repository, dest):
+    """
+    Copy new archives of a repository to another directory.
+
+    Only archives added (or merged) since the last run are copied, the
+    replicated archives are recorded in the destination.
+
+    \b
+    REPOSITORY : The Areca Backup repository path.
+    DEST       : The replica directory.
+    """
+    from .arecabackup import Repository
+    from .locking import ProjectLock, LockTimeoutError
+    from .replicate import Replicator
+    from .dedup import format_size
+
+    arepository = Repository(repository)
+    if os.path.realpath(repository) == os.path.realpath(dest):
+        raise click.UsageError("DEST must not be the repository!")
+
+    replicator = Replicator(repository, dest, jobs, verify=not no_verify)
+    replicator.sync_config()
+
+    failed = 0
+    for project in arepository.projects:
+
+        def on_archive(action, name, project_name=project.name):
+            click.echo("%s : %s %s" % (project_name, action, name))
+
+        try:
+            with ProjectLock(
+                project.base_dir,
+                exclusive=False,
+                timeout=ctx.obj.lock_timeout,
+            ):
+                with span("replicate", lane=project.name):
+                    result = replicator.replicate_project(
+                        project.base_dir, on_archive
+                    )
+        except (LockTimeoutError, OSError) as e:
+            click.echo("%s : %s" % (project.name, e), err=True)
+            failed += 1
+            continue
+
+        if result.copied or result.removed:
+            click.echo(
+                "%s : %s archives copied (%s), %s removed"
+                % (
+                    project.name,
+                    len(result.copied),
+                    format_size(result.bytes),
+                    len(result.removed),
+                )
+            )
+
+    return 1 if failed else 0
+
+
+@main.command()
+@click.option(
+    "--host",
+    default=None,
+    help="Host name of this worker, default to the system host name.",
+)
+@click.option(
+    "--run-id",
+    default=None,
+    help="Identify of the run that workers cooperate on, default to today "
+    "(YYYY-MM-DD).",
+)
+@click.option(
+    "--stale-timeout",
+    type=float,
+    default=600,
+    help="Seconds before an untouched lock is taken over.",
+)
+@click.option(
+    "-j",
+    "--jobs",
+    type=int,
+    default=1,
+    help="How many projects this worker backs up at the same time.",
+)
+@click.option(
+    "--wait/--no-wait",
+    default=True,
+    help="Wait for projects owned by other workers to take over stale ones.",
+)
+@click.argument("config", type=click.File())
+@click.pass_context
+def worker(ctx, host, run_id, stale_timeout, jobs, wait, config):
+    """
+    Backup projects in cooperation with workers on other hosts.
+
+    Every worker reads the same config. A source with a "host" option is
+    only backed up by that host, others by any worker. Projects are claimed
+    through lock files in the repository, longest first.
+
+    \b
+    CONFIG: The config file (in YAML format) path.
+    """
+    import datetime
+    from .arecabackup import Repository
+    from .config import ConfigWorkspace, iter_project_vars, load_config
+    from .coordinator import ClaimStore, WorkPlan, predict_duration
+    from .coordinator import run_worker
+    from .runner import run_sync
+    from .throttle import Limits, Throttle
+
+    vars = load_config(config)
+    workspace = ConfigWorkspace.for_config(config.name, "backup")
+    throttle = Throttle(Limits(vars.get("total_limits", None)), jobs)
+
+    if run_id is None:
+        run_id = datetime.date.today().isoformat()
+
+    state_dir = pathlib.Path(vars["repository"]) / Repository.STATE_DIR_NAME
+    store = ClaimStore(state_dir, run_id, host, stale_timeout)
+
+    items = []
+    for project_vars, options in iter_project_vars(vars):
+        if options.get("host", store.host) != store.host:
+            continue
+
+        Limits(project_vars["limits"])
+
+        project_name = project_vars["project_name"]
+        predicted = predict_duration(
+            pathlib.Path(vars["repository"]) / project_name
+        )
+        items.append((project_name, predicted, project_vars))
+
+    def run_project(project_vars):
+        return exec_async(
+            True,
+            ctx.obj.is_dockerized,
+            project_vars,
+            workspace=workspace,
+            verbose=ctx.obj.verbose,
+            lock_timeout=ctx.obj.lock_timeout,
+            throttle=throttle,
+        )
+
+    try:
+        rets = run_sync(
+            run_worker(WorkPlan(store, items), run_project, jobs, wait)
+        )
+    finally:
+        throttle.close()
+
+    for name, ret in sorted(rets.items()):
+        click.echo("%s : %s" % (name, "OK" if not ret else "FAILED"))
+
+    for ret in rets.values():
+        if ret:
+            return ret
 
     return 0
 
@@ -5,39 +5,52 @@ This module contained a series classes that use for maintain informations of
 Areca Backup.
 """
 
-import arrow
-import zipfile
-import gzip
-import io
 import os
 import os.path
-import subprocess
 import xml.etree.ElementTree as etree
-from whichcraft import which
+import click
 from pathlib import Path
-from . import abhealer, pathutils
-
-
-def folder_to_int(name):
-    parts = name.split("_")
-    first_part = int(parts[0])
-    if len(parts) < 2:
-        second_part = 0
-    else:
-        second_part = int(parts[1])
+from . import abhealer, pathutils, environment
+from .runner import run_process, run_sync
+from .listing import folder_to_int, int_to_folder, get_listing  # noqa: F401
+
+DURATION_KEY = "Backup duration"
+DURATION_UNITS = {
+    "ms": 0.001,
+    "s": 1,
+    "sec": 1,
+    "min": 60,
+    "mn": 60,
+    "h": 3600,
+    "d": 86400,
+}
+
+
+def parse_duration(text):
+    """
+    Parse Areca durations like "273 ms" or "1 h 2 min 3 s" into seconds,
+    None if not parsable.
+    """
 
-    return first_part * 1000 + second_part
+    if not text:
+        return None
 
+    tokens = text.replace(",", " ").split()
+    if len(tokens) % 2:
+        return None
 
-def int_to_folder(aint):
-    first_part = aint // 1000
-    second_part = aint % 1000
+    seconds = 0.0
+    for value, unit in zip(tokens[::2], tokens[1::2]):
+        unit = unit.lower()
+        if unit not in DURATION_UNITS:
+            return None
 
-    second_part_text = ""
-    if second_part > 0:
-        second_part_text = "_%s" % second_part
+        try:
+            seconds += float(value) * DURATION_UNITS[unit]
+        except ValueError:
+            return None
 
-    return str(first_part) + second_part_text
+    return seconds
 
 
 class TraceInfo(object):
@@ -98,14 +111,9 @@ class DataInfo(object):
         self._base_dir = adir
 
     def _extract_data(self, name):
-        info_zip_path = self.base_dir / name
-        with zipfile.ZipFile(str(info_zip_path)) as info_zip_file:
-            data_file = io.BytesIO(info_zip_file.read(name))
-
-        with gzip.GzipFile(fileobj=data_file) as data_zip_file:
-            data = data_zip_file.read().decode()
+        from .zipview import read_gzip_member
 
-        return data
+        return read_gzip_member(self.base_dir / name, name).decode()
 
     @property
     def base_dir(self):
@@ -113,6 +121,8 @@ class DataInfo(object):
 
     @property
     def datetime(self):
+        import arrow
+
         value = str(int(self))
         return arrow.Arrow(
             int(value[:4]),
@@ -124,6 +134,13 @@ class DataInfo(object):
             int(value[12:]),
         ).datetime
 
+    @property
+    def local_datetime(self):
+        """
+        Naive datetime of the archive, Areca names archives in local time.
+        """
+        return self.datetime.replace(tzinfo=None)
+
     @property
     def traces(self):
         infos = list()
@@ -184,6 +201,30 @@ class DataInfo(object):
         data = self._extract_data("manifest")
         return etree.fromstring(data)
 
+    @property
+    def properties(self):
+        """
+        Get manifest properties as a dict, e.g. "Archive size" -> "256".
+        """
+        props = dict()
+        for element in self.manifest.iter("property"):
+            props[element.get("key")] = element.get("value")
+
+        return props
+
+    def get_int_property(self, key, default=None):
+        try:
+            return int(self.properties[key])
+        except (KeyError, TypeError, ValueError):
+            return default
+
+    @property
+    def duration(self):
+        """
+        Backup duration in seconds from manifest, None if unknown.
+        """
+        return parse_duration(self.properties.get(DURATION_KEY, None))
+
     def _name_without_suffix(self):
         return self.base_dir.name[: -len(self.DIR_SUFFIX)]
 
@@ -213,17 +254,27 @@ class Project(object):
         return self.base_dir.name
 
     @property
-    def data_infos(self):
-        infos = []
-        for subdir in self.base_dir.iterdir():
-            if not subdir.name.endswith(DataInfo.DIR_SUFFIX):
-                continue
+    def cfg_path(self):
+        return self.repository.cfg_dir / (self.name + ".bcfg")
 
-            infos.append(DataInfo(subdir))
-
-        infos = sorted(infos, key=lambda x: int(x))
+    @property
+    def file_compression(self):
+        """
+        Whether archives store every file as a zip, from Areca's copy of the
+        project config.
+        """
+        medium = self._cfg.find("medium")
+        return (medium is not None) and (
+            medium.get("file_compression") == "true"
+        )
 
-        return infos
+    @property
+    def data_infos(self):
+        listing = get_listing(self.base_dir)
+        return [
+            DataInfo(Path(listing.data_path(num)))
+            for num in listing.data_archives
+        ]
 
     def __repr__(self):
         return '%s("%s")' % (type(self).__qualname__, self.name)
@@ -231,6 +282,8 @@ class Project(object):
 
 class Repository(object):
     CFG_DIR_NAME = "areca_config_backup"
+    # Where abhealer keeps its own files inside a repository
+    STATE_DIR_NAME = ".abhealer"
 
     def __init__(self, adir):
         self._base_dir = Path(adir)
@@ -253,12 +306,16 @@ class Repository(object):
     def cfg_dir(self):
         return self._cfg_dir
 
+    @property
+    def state_dir(self):
+        return self._base_dir / self.STATE_DIR_NAME
+
     @property
     def projects(self):
 
         all = []
         for subdir in self.base_dir.iterdir():
-            if subdir.name == self.CFG_DIR_NAME:
+            if subdir.name in (self.CFG_DIR_NAME, self.STATE_DIR_NAME):
                 continue
 
             history_path = subdir / "history"
@@ -284,21 +341,48 @@ class LocalArecaBackup(object):
         self._program_path = self._detect_program_path()
 
     def _detect_program_path(self):
-        apath = which("areca_cl.sh")
+        apath = environment.find_areca_cl()
         if apath is None:
-            return None
+            raise click.ClickException("Can't find areca_cl.sh in PATH!")
 
         return Path(apath)
 
-    def backup(self, cfg_path, ws_dir):
-        return subprocess.call(
-            self.gen_backup_cmd(cfg_path, ws_dir), shell=True
+    def backup(self, cfg_path, ws_dir, timeout=None):
+        return run_sync(self.backup_async(cfg_path, ws_dir, timeout))
+
+    def recover(self, cfg_path, dst_dir, timeout=None):
+        return run_sync(self.recover_async(cfg_path, dst_dir, timeout))
+
+    async def backup_async(self, cfg_path, ws_dir, timeout=None):
+        result = await run_process(
+            self.gen_backup_cmd(cfg_path, ws_dir),
+            name=Path(str(cfg_path)).stem,
+            timeout=timeout,
+        )
+        return result.returncode
+
+    async def recover_async(self, cfg_path, dst_dir, timeout=None):
+        result = await run_process(
+            self.gen_recover_cmd(cfg_path, dst_dir),
+            name=Path(str(cfg_path)).stem,
+            timeout=timeout,
+        )
+        return result.returncode
+
+    def merge(self, cfg_path, dst_dir, from_days, to_days, timeout=None):
+        return run_sync(
+            self.merge_async(cfg_path, dst_dir, from_days, to_days, timeout)
         )
 
-    def recover(self, cfg_path, dst_dir):
-        return subprocess.call(
-            self.gen_recover_cmd(cfg_path, dst_dir), shell=True
+    async def merge_async(
+        self, cfg_path, dst_dir, from_days, to_days, timeout=None
+    ):
+        result = await run_process(
+            self.gen_merge_cmd(cfg_path, dst_dir, from_days, to_days),
+            name=Path(str(cfg_path)).stem,
+            timeout=timeout,
         )
+        return result.returncode
 
     def gen_backup_cmd(self, cfg_path, ws_dir=None):
         """
@@ -331,13 +415,37 @@ class LocalArecaBackup(object):
 
         return cmd
 
+    def gen_merge_cmd(self, cfg_path, dst_dir, from_days, to_days):
+        """
+        Generate merge command
+
+        Archives between from_days ago and to_days ago will be merged into
+        one archive.
+
+        :param dst_dir: The project directory that contains the archives, the
+        medium path inside cfg_path is used by local Areca.
+        """
+
+        cfg_path = pathutils.normal_path(cfg_path)
+
+        cmd = "cd %s; ./areca_cl.sh merge -config %s -from %s -to %s"
+        cmd = cmd % (
+            self._program_path.parent,
+            str(cfg_path),
+            int(from_days),
+            int(to_days),
+        )
+
+        return cmd
+
 
 class DockerizedArecaBackup(LocalArecaBackup):
     """
     The class use for maintain Dockerized Areca Backup's behaviors.
     """
 
-    CMD_PREFIX = "docker run -t --rm starofrainnight/areca-backup "
+    IMAGE = "starofrainnight/areca-backup"
+    CMD_PREFIX = "docker run -t --rm %s " % IMAGE
     SRC_DIR = "/opt/source"
     DST_DIR = "/opt/backup"
     WS_DIR = "/opt/workspace"
@@ -347,15 +455,28 @@ class DockerizedArecaBackup(LocalArecaBackup):
         super().__init__()
 
     def _detect_program_path(self):
-        cmd = "%s bash --version" % self.CMD_PREFIX
-        ret = subprocess.call(cmd, shell=True)
-        if ret:
-            return None
+        # Ask the daemon instead of starting a container
+        if not environment.is_docker_available():
+            raise click.ClickException(
+                "Docker daemon is not reachable at %s!"
+                % environment.docker_socket_path()
+            )
 
         return Path("/usr/local/bin/areca_cl.sh")
 
     def gen_docker_volume_options(self, cfg_path, dst_dir):
-        pass
+        from .tiering import gen_docker_cold_options
+
+        cfg_path = pathutils.normal_path(cfg_path)
+        dst_dir = pathutils.normal_path(dst_dir)
+
+        # Map users and groups, so the owners in traces are resolvable
+        options = " -v /etc/passwd:/etc/passwd "
+        options += " -v /etc/group:/etc/group "
+        options += " -v %s:%s " % (cfg_path.parent, self.CFG_DIR)
+        options += " -v %s:%s " % (dst_dir, self.DST_DIR)
+        options += gen_docker_cold_options(dst_dir)
+        return options
 
     def gen_backup_cmd(self, cfg_path, ws_dir=None):
         cfg_path = pathutils.normal_path(cfg_path)
@@ -379,3 +500,17 @@ class DockerizedArecaBackup(LocalArecaBackup):
         cmd = super().gen_recover_cmd(client_cfg_path, self.DST_DIR)
 
         return cmd
+
+    def gen_merge_cmd(self, cfg_path, dst_dir, from_days, to_days):
+        cfg_path = pathutils.normal_path(cfg_path)
+        client_cfg_path = os.path.join(self.CFG_DIR, cfg_path.name)
+
+        cmd = super().gen_merge_cmd(
+            client_cfg_path, self.DST_DIR, from_days, to_days
+        )
+
+        return "docker run -t --rm %s %s sh -c '%s'" % (
+            self.gen_docker_volume_options(cfg_path, dst_dir),
+            self.IMAGE,
+            cmd,
+        )
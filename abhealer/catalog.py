@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+
+"""
+Path catalog of a project, to find the restore points that contain a path.
+
+Every archive's trace lists all paths of the project at backup time. The
+catalog keeps each path once in a sorted (indexed) SQLite table with the
+runs of consecutive archives that contain it, so a search is a range scan
+instead of decompressing every trace. New archives are appended
+incrementally; when archives were removed (merged) the catalog is rebuilt.
+
+Several processes could update a catalog at once (they only hold the shared
+project lock), every write takes the SQLite write lock (BEGIN IMMEDIATE)
+and checks the cataloged archives again inside.
+"""
+
+import os
+import os.path
+import sqlite3
+
+CATALOG_DIR_NAME = "catalog"
+
+GLOB_CHARS = "*?["
+
+# Seconds to wait for the write lock held by another process
+BUSY_TIMEOUT = 600.0
+
+
+def get_catalog_path(proj_dir):
+    from .arecabackup import Repository
+
+    proj_dir = os.path.abspath(str(proj_dir))
+    return os.path.join(
+        os.path.dirname(proj_dir),
+        Repository.STATE_DIR_NAME,
+        CATALOG_DIR_NAME,
+        os.path.basename(proj_dir) + ".sqlite",
+    )
+
+
+def format_archive_name(name):
+    """
+    Format archive names like "201711032056" as "2017-11-03 20:56".
+    """
+
+    stamp = name.split("_")[0]
+    if len(stamp) < 12:
+        return name
+
+    return "%s-%s-%s %s:%s" % (
+        stamp[:4],
+        stamp[4:6],
+        stamp[6:8],
+        stamp[8:10],
+        stamp[10:12],
+    )
+
+
+def read_trace_keys(data_dir):
+    """
+    Get (path, type) of all entries in the trace of an archive.
+    """
+
+    from .traceload import iter_trace_keys
+
+    return next(iter_trace_keys([data_dir]))
+
+
+def pattern_to_glob(pattern):
+    """
+    Convert a search pattern to a SQLite GLOB, patterns without wildcards
+    are path prefixes.
+
+    :return: (glob, exact path or None), a prefix matches the path itself
+    and everything below it.
+    """
+
+    pattern = pattern.lstrip("/")
+    for c in GLOB_CHARS:
+        if c in pattern:
+            return (pattern, None)
+
+    pattern = pattern.rstrip("/")
+    if not pattern:
+        return ("*", None)
+
+    return (pattern + "/*", pattern)
+
+
+class PathCatalog(object):
+    def __init__(self, path):
+        self._path = str(path)
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+
+        self._conn = sqlite3.connect(self._path, timeout=BUSY_TIMEOUT)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS archives (
+                idx INTEGER PRIMARY KEY, name TEXT UNIQUE
+            );
+            CREATE TABLE IF NOT EXISTS paths (
+                id INTEGER PRIMARY KEY, path TEXT UNIQUE, type TEXT
+            );
+            CREATE TABLE IF NOT EXISTS runs (
+                path_id INTEGER, first INTEGER, last INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS runs_last ON runs (last, path_id);
+            CREATE INDEX IF NOT EXISTS runs_path ON runs (path_id);
+            CREATE TEMP TABLE current (path TEXT PRIMARY KEY, type TEXT);
+            """)
+
+    @property
+    def path(self):
+        return self._path
+
+    def close(self):
+        self._conn.close()
+
+    def archives(self):
+        """
+        Get names of cataloged archives, oldest first.
+        """
+
+        return [
+            row[0]
+            for row in self._conn.execute(
+                "SELECT name FROM archives ORDER BY idx"
+            )
+        ]
+
+    def _begin(self):
+        # Other processes wait for our commit from here
+        self._conn.execute("BEGIN IMMEDIATE")
+
+    def _clear(self):
+        for table in ("archives", "paths", "runs"):
+            self._conn.execute("DELETE FROM %s" % table)
+
+    def clear(self):
+        with self._conn:
+            self._begin()
+            self._clear()
+
+    def _count_archives(self):
+        row = self._conn.execute("SELECT COUNT(*) FROM archives").fetchone()
+        return row[0]
+
+    def _add_archive(self, name, keys):
+        row = self._conn.execute("SELECT MAX(idx) FROM archives").fetchone()
+        prev = -1 if row[0] is None else row[0]
+        idx = prev + 1
+
+        self._conn.execute("DELETE FROM current")
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO current VALUES (?, ?)", keys
+        )
+        # No UPSERT, it needs SQLite 3.24 which older Pythons don't ship
+        self._conn.execute(
+            "UPDATE paths SET type = "
+            "(SELECT c.type FROM current c WHERE c.path = paths.path) "
+            "WHERE path IN (SELECT path FROM current)"
+        )
+        self._conn.execute(
+            "INSERT OR IGNORE INTO paths (path, type) "
+            "SELECT path, type FROM current"
+        )
+        # Paths still there continue their runs, others start new ones
+        self._conn.execute(
+            "UPDATE runs SET last = ? WHERE last = ? AND path_id IN "
+            "(SELECT p.id FROM paths p JOIN current c ON p.path = c.path)",
+            (idx, prev),
+        )
+        self._conn.execute(
+            "INSERT INTO runs SELECT p.id, ?, ? FROM paths p "
+            "JOIN current c ON p.path = c.path WHERE NOT EXISTS "
+            "(SELECT 1 FROM runs r WHERE r.path_id = p.id AND r.last = ?)",
+            (idx, idx, idx),
+        )
+        self._conn.execute("INSERT INTO archives VALUES (?, ?)", (idx, name))
+        self._conn.execute("DELETE FROM current")
+
+    def add_archive(self, name, keys):
+        """
+        Append the next archive with its trace keys, (path, type).
+        """
+
+        with self._conn:
+            self._begin()
+            self._add_archive(name, keys)
+
+    def update(self, proj_dir, on_archive=None, jobs=None):
+        """
+        Catalog new archives of a project directory, their traces are
+        decoded in parallel.
+
+        :param on_archive: Called with the name of every cataloged archive.
+        :return: Count of cataloged archives.
+        """
+
+        from .listing import get_listing
+        from .traceload import iter_trace_keys
+
+        listing = get_listing(proj_dir)
+        names = [listing.name_of(num) for num in listing.data_archives]
+
+        with self._conn:
+            self._begin()
+            known = self.archives()
+            if names[: len(known)] != known:
+                # Archives were merged or removed
+                self._clear()
+                known = []
+
+        start = len(known)
+        nums = listing.data_archives[start:]
+        added = 0
+        for index, (num, keys) in enumerate(
+            zip(
+                nums,
+                iter_trace_keys([listing.data_path(x) for x in nums], jobs),
+            ),
+            start,
+        ):
+            name = listing.name_of(num)
+            with self._conn:
+                self._begin()
+                if self._count_archives() != index:
+                    # Another process cataloged it meanwhile
+                    continue
+
+                self._add_archive(name, keys)
+
+            added += 1
+            if on_archive is not None:
+                on_archive(name)
+
+        return added
+
+    def find(self, pattern, limit=None):
+        """
+        Yield (path, type, [(first archive, last archive, count) ...]) of
+        paths that match pattern, sorted by path.
+        """
+
+        names = self.archives()
+        sql = (
+            "SELECT p.path, p.type, r.first, r.last FROM paths p "
+            "JOIN runs r ON r.path_id = p.id "
+            "WHERE p.path GLOB ? OR p.path = ? "
+            "ORDER BY p.path, r.first"
+        )
+
+        current = None
+        current_type = None
+        runs = []
+        count = 0
+        for path, atype, first, last in self._conn.execute(
+            sql, pattern_to_glob(pattern)
+        ):
+            if path != current:
+                if current is not None:
+                    yield (current, current_type, runs)
+                    count += 1
+                    if (limit is not None) and (count >= limit):
+                        return
+
+                current = path
+                current_type = atype
+                runs = []
+
+            runs.append((names[first], names[last], last - first + 1))
+
+        if current is not None:
+            yield (current, current_type, runs)
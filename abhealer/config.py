@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+
+"""
+Config loading and compilation of Areca project configs (.bcfg).
+
+The YAML config is loaded and validated once, project configs are rendered
+from one cached template environment into a persistent workspace and only
+rendered again when their inputs (YAML values or template) changed.
+"""
+
+import os
+import os.path
+import json
+import hashlib
+import click
+import six
+import yaml
+
+TEMPLATE_NAME = "project.bcfg"
+
+# Areca medium settings a source or the config could set, the values are
+# the template defaults.
+MEDIUM_DEFAULTS = {
+    "file_compression": True,
+    "zip_level": 9,
+    "transaction_size": 51200,
+}
+
+_template_env = None
+
+
+def get_cache_dir():
+    """
+    Get abhealer's cache directory, honors XDG_CACHE_HOME.
+    """
+    base_dir = os.environ.get("XDG_CACHE_HOME", None)
+    if not base_dir:
+        base_dir = os.path.join(os.path.expanduser("~"), ".cache")
+
+    return os.path.join(base_dir, "abhealer")
+
+
+def get_template_env():
+    global _template_env
+
+    if _template_env is None:
+        from jinja2 import Environment, PackageLoader
+
+        _template_env = Environment(
+            loader=PackageLoader("abhealer", "templates")
+        )
+
+    return _template_env
+
+
+def get_project_template():
+    # Environment caches loaded templates by itself
+    return get_template_env().get_template(TEMPLATE_NAME)
+
+
+def get_template_hash():
+    env = get_template_env()
+    source, _, _ = env.loader.get_source(env, TEMPLATE_NAME)
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+
+def load_config(stream):
+    """
+    Load and validate the YAML config.
+
+    :param stream: An opened config file.
+    """
+
+    try:
+        vars = yaml.safe_load(stream)
+    except yaml.YAMLError as e:
+        raise click.UsageError("Invalid config file : %s" % e)
+
+    if not isinstance(vars, dict):
+        raise click.UsageError("Config must be a mapping!")
+
+    for key in ("repository", "sources"):
+        if key not in vars:
+            raise click.UsageError('Config key "%s" is required!' % key)
+
+    if not isinstance(vars["sources"], list):
+        raise click.UsageError('Config key "sources" must be a list!')
+
+    for source in vars["sources"]:
+        if isinstance(source, six.string_types):
+            continue
+
+        if isinstance(source, list) and source:
+            continue
+
+        if isinstance(source, dict) and ("path" in source):
+            continue
+
+        raise click.UsageError("Invalid source : %s" % (source,))
+
+    return vars
+
+
+def iter_sources(vars):
+    """
+    Yield (source path, project name, options) of all sources in config.
+
+    A source could be a path, a [path, name] list or a mapping with "path",
+    "name" and per-source options (which override the global ones).
+    """
+
+    for source in vars["sources"]:
+        options = dict()
+
+        # Support path only source
+        if isinstance(source, six.string_types):
+            source = [source]
+        elif isinstance(source, dict):
+            options = dict(source)
+            source = [options.pop("path"), options.pop("name", "") or ""]
+
+        project_name = os.path.splitext(os.path.basename(source[0]))[0]
+        if (len(source) > 1) and (len(source[1].strip()) > 0):
+            project_name = source[1].strip()
+
+        yield (source[0], project_name, options)
+
+
+def merge_option(vars, options, key):
+    """
+    Merge a mapping option of a source over the global one.
+    """
+
+    merged = dict(vars.get(key, None) or dict())
+    merged.update(options.get(key, None) or dict())
+    return merged
+
+
+def merge_medium_options(vars, options, tuned=None):
+    """
+    Get medium settings of a source, taken from the source options, the
+    config, tuned values (see tuning.py) or defaults in this order.
+    """
+
+    merged = dict()
+    for key, default in MEDIUM_DEFAULTS.items():
+        for values in (options, vars, tuned or dict()):
+            if key in values:
+                merged[key] = values[key]
+                break
+        else:
+            merged[key] = default
+
+    if not isinstance(merged["file_compression"], bool):
+        raise click.UsageError('Config key "file_compression" must be a bool!')
+
+    for key, min_value, max_value in (
+        ("zip_level", 0, 9),
+        ("transaction_size", 1, None),
+    ):
+        value = merged[key]
+        if (
+            isinstance(value, bool)
+            or (not isinstance(value, int))
+            or (value < min_value)
+            or ((max_value is not None) and (value > max_value))
+        ):
+            raise click.UsageError("Invalid %s : %s" % (key, value))
+
+    return merged
+
+
+def iter_project_vars(vars):
+    """
+    Yield (project vars, options) of all sources in config, project vars are
+    the config values with "src_path", "project_name" and the merged limits,
+    medium settings (tuned ones included) and filters of the source.
+    """
+
+    from .filters import merge_filters
+    from .tuning import load_tuning
+
+    tuning = load_tuning(vars["repository"])
+    for src_path, project_name, options in iter_sources(vars):
+        project_vars = dict(vars)
+        project_vars["src_path"] = src_path
+        project_vars["project_name"] = project_name
+        project_vars["limits"] = merge_option(vars, options, "limits")
+        project_vars.update(
+            merge_medium_options(vars, options, tuning.get(project_name))
+        )
+        project_vars["filters"] = merge_filters(vars, options)
+        yield (project_vars, options)
+
+
+class ConfigWorkspace(object):
+    """
+    Persistent directory of rendered project configs.
+
+    A "<project>.bcfg.sha256" stamp beside every config records the hash of
+    its render inputs and the hash of the rendered content. The stamp is
+    written last, a config replaced by another process without its stamp (or
+    the other way round) doesn't match and is rendered again.
+    """
+
+    STAMP_SUFFIX = ".sha256"
+
+    def __init__(self, base_dir):
+        self._base_dir = str(base_dir)
+        os.makedirs(self._base_dir, exist_ok=True)
+
+    @classmethod
+    def for_config(cls, config_path, mode):
+        """
+        Get the default workspace of a config file.
+
+        :param mode: Usually "backup" or "recover", they render different
+        source paths.
+        """
+
+        real_path = os.path.realpath(str(config_path))
+        key = hashlib.sha256(real_path.encode("utf-8")).hexdigest()[:16]
+        return cls(os.path.join(get_cache_dir(), "workspace", key, mode))
+
+    @property
+    def base_dir(self):
+        return self._base_dir
+
+    def config_path(self, project_name):
+        return os.path.join(self._base_dir, project_name + ".bcfg")
+
+    def _is_current(self, config_path, stamp_path, input_hash):
+        try:
+            with open(stamp_path, "r") as f:
+                stamp = f.read().split()
+            with open(config_path, "rb") as f:
+                content_hash = hashlib.sha256(f.read()).hexdigest()
+        except OSError:
+            return False
+
+        return stamp == [input_hash, content_hash]
+
+    def _compute_hash(self, vars):
+        content = json.dumps(vars, sort_keys=True, default=str)
+        digest = hashlib.sha256(get_template_hash().encode("utf-8"))
+        digest.update(content.encode("utf-8"))
+        return digest.hexdigest()
+
+    def render(self, project_name, vars):
+        """
+        Render a project config if its inputs changed.
+
+        :return: (config path, True if rendered)
+        """
+
+        vars = dict((k, v) for k, v in vars.items() if k != "sources")
+
+        config_path = self.config_path(project_name)
+        stamp_path = config_path + self.STAMP_SUFFIX
+        new_hash = self._compute_hash(vars)
+
+        if self._is_current(config_path, stamp_path, new_hash):
+            return (config_path, False)
+
+        content = get_project_template().render(vars).encode("utf-8")
+        stamp = "%s %s\n" % (new_hash, hashlib.sha256(content).hexdigest())
+
+        # Other abhealer processes may read the same workspace
+        for apath, data in (
+            (config_path, content),
+            (stamp_path, stamp.encode("utf-8")),
+        ):
+            temp_path = "%s.%s.tmp" % (apath, os.getpid())
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, apath)
+
+        return (config_path, True)
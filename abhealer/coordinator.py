@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+
+"""
+Multi-host backup coordination over a shared repository.
+
+Workers on every host read the same config and claim projects through lock
+files inside the repository (".abhealer/claims/<run id>/"). Creating a lock
+file with O_EXCL is atomic on local file systems and NFS, so only one worker
+wins a project. Projects are claimed longest first (by previous backup
+durations), which lets all hosts finish at roughly the same time.
+
+A worker touches its lock file periodically; a lock that has not been
+touched for the stale timeout belongs to a dead worker and could be taken
+over.
+
+A failed project is marked failed instead of done, other workers (and later
+workers of the same run) retry it, the worker that failed it doesn't.
+"""
+
+import os
+import os.path
+import json
+import time
+import socket
+import asyncio
+import statistics
+from pathlib import Path
+
+CLAIMS_DIR_NAME = "claims"
+LOCK_SUFFIX = ".lock"
+DONE_SUFFIX = ".done"
+FAILED_SUFFIX = ".failed"
+
+# Manifests used to predict the next backup duration
+HISTORY_SIZE = 5
+
+# Seconds between checks of projects owned by other workers
+POLL_INTERVAL = 5.0
+
+
+def predict_duration(proj_dir, default=None):
+    """
+    Predict backup seconds of a project from its newest manifests.
+    """
+
+    from .arecabackup import DataInfo
+    from .listing import get_listing
+
+    if not os.path.isdir(str(proj_dir)):
+        return default
+
+    listing = get_listing(proj_dir)
+    durations = []
+    for num in reversed(listing.data_archives):
+        info = DataInfo(Path(listing.data_path(num)))
+        try:
+            duration = info.duration
+        except Exception:
+            duration = None
+
+        if duration is not None:
+            durations.append(duration)
+
+        if len(durations) >= HISTORY_SIZE:
+            break
+
+    if not durations:
+        return default
+
+    return statistics.median(durations)
+
+
+def _is_process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+    return True
+
+
+class Claim(object):
+    """
+    A project claimed by this worker.
+    """
+
+    def __init__(self, store, name):
+        self._store = store
+        self._name = name
+        self._started = time.time()
+
+    @property
+    def name(self):
+        return self._name
+
+    def heartbeat(self):
+        try:
+            os.utime(self._store.lock_path(self._name), None)
+        except OSError:
+            pass
+
+    def finish(self, returncode):
+        """
+        Record the project as done in this run, or as failed if returncode
+        isn't 0, and release the lock.
+        """
+
+        info = self._store.owner_info()
+        info["returncode"] = returncode
+        info["duration"] = time.time() - self._started
+
+        if returncode:
+            apath = self._store.failed_path(self._name)
+        else:
+            apath = self._store.done_path(self._name)
+
+        temp_path = "%s.%s.tmp" % (apath, os.getpid())
+        with open(temp_path, "w") as f:
+            json.dump(info, f)
+        os.replace(temp_path, apath)
+
+        if not returncode:
+            try:
+                os.remove(self._store.failed_path(self._name))
+            except OSError:
+                pass
+
+        self.release()
+
+    def release(self):
+        try:
+            os.remove(self._store.lock_path(self._name))
+        except OSError:
+            pass
+
+
+class ClaimStore(object):
+    """
+    Lock files of one backup run.
+    """
+
+    def __init__(self, state_dir, run_id, host=None, stale_timeout=600):
+        self._base_dir = os.path.join(str(state_dir), CLAIMS_DIR_NAME, run_id)
+        self._host = host if host else socket.gethostname()
+        self._stale_timeout = stale_timeout
+        os.makedirs(self._base_dir, exist_ok=True)
+
+    @property
+    def base_dir(self):
+        return self._base_dir
+
+    @property
+    def host(self):
+        return self._host
+
+    @property
+    def stale_timeout(self):
+        return self._stale_timeout
+
+    def lock_path(self, name):
+        return os.path.join(self._base_dir, name + LOCK_SUFFIX)
+
+    def done_path(self, name):
+        return os.path.join(self._base_dir, name + DONE_SUFFIX)
+
+    def failed_path(self, name):
+        return os.path.join(self._base_dir, name + FAILED_SUFFIX)
+
+    def owner_info(self):
+        return dict(host=self._host, pid=os.getpid(), time=time.time())
+
+    def is_done(self, name):
+        return os.path.exists(self.done_path(name))
+
+    def is_failed(self, name):
+        return os.path.exists(self.failed_path(name))
+
+    def is_locked(self, name):
+        return os.path.exists(self.lock_path(name))
+
+    def _read_owner(self, apath):
+        try:
+            with open(apath, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _is_stale_file(self, apath):
+        try:
+            mtime = os.path.getmtime(apath)
+        except OSError:
+            return False
+
+        if time.time() - mtime > self._stale_timeout:
+            return True
+
+        # We could tell faster if the owner was a process on this host
+        owner = self._read_owner(apath)
+        if (owner is not None) and (owner.get("host", None) == self._host):
+            return not _is_process_alive(int(owner.get("pid", 0)))
+
+        return False
+
+    def is_stale(self, name):
+        return self._is_stale_file(self.lock_path(name))
+
+    def _break_stale(self, name):
+        """
+        Move a stale lock away, only one of the competing workers succeeds
+        to rename it.
+        """
+
+        lock_path = self.lock_path(name)
+        stale_path = "%s.stale.%s.%s" % (lock_path, self._host, os.getpid())
+        try:
+            os.rename(lock_path, stale_path)
+        except OSError:
+            return False
+
+        if not self._is_stale_file(stale_path):
+            # Another worker broke the stale lock and claimed the project
+            # after we checked, give its fresh lock back.
+            try:
+                os.link(stale_path, lock_path)
+            except OSError:
+                pass
+            os.remove(stale_path)
+            return False
+
+        os.remove(stale_path)
+        return True
+
+    def claim(self, name):
+        """
+        Try to claim a project, returns a Claim or None if it's done or owned
+        by another worker.
+        """
+
+        if self.is_done(name):
+            return None
+
+        for _ in range(2):
+            try:
+                fd = os.open(
+                    self.lock_path(name),
+                    os.O_CREAT | os.O_EXCL | os.O_WRONLY,
+                    0o644,
+                )
+            except FileExistsError:
+                if self.is_stale(name) and self._break_stale(name):
+                    continue
+
+                return None
+
+            with os.fdopen(fd, "w") as f:
+                json.dump(self.owner_info(), f)
+
+            # Finished by another worker between is_done() and now
+            if self.is_done(name):
+                Claim(self, name).release()
+                return None
+
+            return Claim(self, name)
+
+        return None
+
+
+class WorkPlan(object):
+    """
+    Projects a worker is allowed to run, longest predicted first.
+    """
+
+    def __init__(self, store, items):
+        """
+        :param items: A list of (project name, predicted seconds, payload)
+        """
+        self._store = store
+        self._items = sorted(items, key=lambda x: -(x[1] or 0))
+
+    @property
+    def store(self):
+        return self._store
+
+    @property
+    def items(self):
+        return self._items
+
+    def next_claim(self, skipped=()):
+        """
+        Claim the next project, returns (Claim, payload) or (None, None).
+
+        :param skipped: Names of projects not to claim.
+        """
+
+        for name, _, payload in self._items:
+            if name in skipped:
+                continue
+
+            claim = self._store.claim(name)
+            if claim is not None:
+                return (claim, payload)
+
+        return (None, None)
+
+    def pending(self):
+        """
+        Names of projects that are neither done nor failed yet (maybe run
+        by others).
+        """
+
+        return [
+            name
+            for name, _, _ in self._items
+            if not (self._store.is_done(name) or self._store.is_failed(name))
+        ]
+
+
+async def run_worker(plan, run_project, jobs=1, wait=True):
+    """
+    Claim and run projects until all of them are done.
+
+    :param run_project: A coroutine function that receives the payload of a
+    project and returns its exit code.
+    :param wait: Keep polling while other workers own pending projects, so
+    their stale locks could be taken over.
+    :return: Exit codes of the projects run by this worker.
+    """
+
+    store = plan.store
+    interval = max(1.0, store.stale_timeout / 3.0)
+    poll_interval = min(POLL_INTERVAL, interval)
+    rets = dict()
+
+    async def keep_alive(claim):
+        while True:
+            await asyncio.sleep(interval)
+            claim.heartbeat()
+
+    async def slot():
+        while True:
+            # Projects failed here are left to other workers
+            claim, payload = plan.next_claim(rets)
+            if claim is None:
+                if wait and plan.pending():
+                    await asyncio.sleep(poll_interval)
+                    continue
+
+                return
+
+            heartbeat = asyncio.ensure_future(keep_alive(claim))
+            try:
+                ret = await run_project(payload)
+            except BaseException:
+                claim.release()
+                raise
+            finally:
+                heartbeat.cancel()
+
+            claim.finish(ret)
+            rets[claim.name] = ret
+
+    await asyncio.gather(*[slot() for _ in range(max(1, jobs))])
+    return rets
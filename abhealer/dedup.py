@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+
+"""
+Content-addressed hash index of a repository, to measure how much space a
+dedup store shared by all projects would save.
+
+File contents are hashed (sha256) in a process pool, either from archives
+(decompressed on the way if the project compresses files) or from the source
+trees of a config before they are backed up. Hashes are kept in a SQLite
+index, so archives already hashed and unchanged source files are skipped
+next time.
+"""
+
+import os
+import os.path
+import stat
+import hashlib
+import sqlite3
+import zipfile
+import zlib
+import concurrent.futures
+from .zipview import ZipView
+
+CHUNK_SIZE = 1024 * 1024
+
+# Source files are hashed in batches, one batch per task
+BATCH_FILES = 256
+BATCH_BYTES = 64 * 1024 * 1024
+
+# Unit name of source trees, archives use their own names
+SOURCE_UNIT = ""
+
+SIZE_UNITS = ("B", "KB", "MB", "GB", "TB")
+
+
+def format_size(size):
+    size = float(size)
+    for unit in SIZE_UNITS:
+        if (size < 1024) or (unit == SIZE_UNITS[-1]):
+            break
+        size /= 1024
+
+    return "%.1f %s" % (size, unit)
+
+
+def _hash_stream(f):
+    digest = hashlib.sha256()
+    size = 0
+    while True:
+        chunk = f.read(CHUNK_SIZE)
+        if not chunk:
+            break
+
+        size += len(chunk)
+        digest.update(chunk)
+
+    return (size, digest.digest())
+
+
+def _hash_chunks(chunks):
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in chunks:
+        size += len(chunk)
+        digest.update(chunk)
+
+    return (size, digest.digest())
+
+
+def hash_archive(archive_dir, file_compression):
+    """
+    Hash contents of all files in an archive, executed in worker processes.
+
+    :param file_compression: Whether every file is a zip (the project's
+    medium setting), members are hashed then, raw files otherwise.
+    :return: A list of (path, size, mtime_ns, sha256), members of zips are
+    listed as "<zip path>/<member>".
+    """
+
+    rows = []
+    for parent, _, filenames in os.walk(archive_dir):
+        for filename in filenames:
+            apath = os.path.join(parent, filename)
+            related = os.path.relpath(apath, archive_dir)
+            try:
+                if file_compression:
+                    with ZipView(apath) as zip_view:
+                        for member in zip_view.infolist():
+                            if member.filename.endswith("/"):
+                                continue
+
+                            size, digest = _hash_chunks(
+                                zip_view.iter_chunks(member)
+                            )
+                            rows.append(
+                                (
+                                    "%s/%s" % (related, member.filename),
+                                    size,
+                                    0,
+                                    digest,
+                                )
+                            )
+                else:
+                    with open(apath, "rb") as f:
+                        size, digest = _hash_stream(f)
+                    rows.append((related, size, 0, digest))
+            except (OSError, zipfile.BadZipfile, zlib.error):
+                # Broken archives are reported by "abhealer verify"
+                continue
+
+    return rows
+
+
+def hash_files(base_dir, items):
+    """
+    Hash a batch of source files, executed in worker processes.
+
+    :param items: A list of (path, size, mtime_ns), paths related to base_dir
+    :return: A list of (path, size, mtime_ns, sha256), unreadable files are
+    left out.
+    """
+
+    rows = []
+    for related, _, mtime_ns in items:
+        try:
+            with open(os.path.join(base_dir, related), "rb") as f:
+                size, digest = _hash_stream(f)
+        except OSError:
+            continue
+
+        rows.append((related, size, mtime_ns, digest))
+
+    return rows
+
+
+def scan_source(base_dir):
+    """
+    Get (path, size, mtime_ns) of regular files in a source tree.
+    """
+
+    items = []
+    for parent, _, filenames in os.walk(base_dir):
+        for filename in filenames:
+            apath = os.path.join(parent, filename)
+            try:
+                st = os.lstat(apath)
+            except OSError:
+                continue
+
+            if not stat.S_ISREG(st.st_mode):
+                continue
+
+            items.append(
+                (os.path.relpath(apath, base_dir), st.st_size, st.st_mtime_ns)
+            )
+
+    return items
+
+
+def _split_batches(items):
+    batch = []
+    batch_bytes = 0
+    for item in items:
+        batch.append(item)
+        batch_bytes += item[1]
+        if (len(batch) >= BATCH_FILES) or (batch_bytes >= BATCH_BYTES):
+            yield batch
+            batch = []
+            batch_bytes = 0
+
+    if batch:
+        yield batch
+
+
+class HashIndex(object):
+    """
+    SQLite index of hashed files, one "unit" is an archive or a source tree.
+    """
+
+    def __init__(self, path):
+        self._path = str(path)
+        parent = os.path.dirname(self._path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+
+        self._conn = sqlite3.connect(self._path)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS units (
+                project TEXT, unit TEXT, PRIMARY KEY (project, unit)
+            );
+            CREATE TABLE IF NOT EXISTS files (
+                project TEXT, unit TEXT, path TEXT, size INTEGER,
+                mtime_ns INTEGER, sha256 BLOB,
+                PRIMARY KEY (project, unit, path)
+            );
+            CREATE INDEX IF NOT EXISTS files_sha256 ON files (sha256);
+            """)
+
+    @property
+    def path(self):
+        return self._path
+
+    def close(self):
+        self._conn.close()
+
+    def units(self):
+        return set(self._conn.execute("SELECT project, unit FROM units"))
+
+    def get_files(self, project, unit):
+        """
+        Get recorded files of a unit: path -> (size, mtime_ns, sha256)
+        """
+
+        return dict(
+            (row[0], row[1:])
+            for row in self._conn.execute(
+                "SELECT path, size, mtime_ns, sha256 FROM files "
+                "WHERE project = ? AND unit = ?",
+                (project, unit),
+            )
+        )
+
+    def replace_unit(self, project, unit, rows):
+        with self._conn:
+            self._remove_unit(project, unit)
+            self._conn.executemany(
+                "INSERT INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    (project, unit, path, size, mtime_ns, digest)
+                    for path, size, mtime_ns, digest in rows
+                ),
+            )
+            self._conn.execute(
+                "INSERT INTO units VALUES (?, ?)", (project, unit)
+            )
+
+    def _remove_unit(self, project, unit):
+        for table in ("files", "units"):
+            self._conn.execute(
+                "DELETE FROM %s WHERE project = ? AND unit = ?" % table,
+                (project, unit),
+            )
+
+    def remove_units(self, units):
+        with self._conn:
+            for project, unit in units:
+                self._remove_unit(project, unit)
+
+    def project_bytes(self):
+        """
+        Get bytes of distinct contents in every project.
+        """
+
+        return dict(
+            self._conn.execute(
+                "SELECT project, SUM(size) FROM "
+                "(SELECT DISTINCT project, sha256, size FROM files) "
+                "GROUP BY project"
+            )
+        )
+
+    def total_bytes(self):
+        """
+        Get bytes of distinct contents in all projects.
+        """
+
+        row = self._conn.execute(
+            "SELECT SUM(size) FROM (SELECT DISTINCT sha256, size FROM files)"
+        ).fetchone()
+        return row[0] or 0
+
+    def pair_bytes(self):
+        """
+        Get (project, project, duplicated bytes) of project pairs that share
+        contents, most duplicated first.
+        """
+
+        return list(
+            self._conn.execute(
+                "WITH u AS (SELECT DISTINCT project, sha256, size FROM files) "
+                "SELECT a.project, b.project, SUM(a.size) FROM u a "
+                "JOIN u b ON a.sha256 = b.sha256 AND a.project < b.project "
+                "GROUP BY a.project, b.project ORDER BY 3 DESC"
+            )
+        )
+
+
+def index_archives(repository, index, jobs=None):
+    """
+    Hash archives that are not in the index yet, archives that disappeared
+    (merged) are removed from it.
+
+    Yields (project, archive name, files count) in completion order.
+    """
+
+    from .verify import iter_archives
+
+    known = index.units()
+    found = set()
+    pending = []
+    for key, archive_dir, _, file_compression in iter_archives(repository):
+        unit = tuple(key.split("/", 1))
+        found.add(unit)
+        if unit not in known:
+            pending.append((unit, archive_dir, file_compression))
+
+    index.remove_units(known - found)
+
+    with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+        futures = dict(
+            (
+                executor.submit(hash_archive, archive_dir, file_compression),
+                unit,
+            )
+            for unit, archive_dir, file_compression in pending
+        )
+
+        for future in concurrent.futures.as_completed(futures):
+            project, unit = futures[future]
+            rows = future.result()
+            index.replace_unit(project, unit, rows)
+            yield (project, unit, len(rows))
+
+
+def index_sources(sources, index, jobs=None):
+    """
+    Hash changed files of source trees, unchanged ones (same size and
+    mtime) keep their recorded hashes.
+
+    :param sources: A list of (project name, source path)
+    Yields (project, files count, hashed files count).
+    """
+
+    known = index.units()
+    index.remove_units(known - set((p, SOURCE_UNIT) for p, _ in sources))
+
+    with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+        for project, src_path in sources:
+            recorded = index.get_files(project, SOURCE_UNIT)
+            rows = []
+            changed = []
+            for item in scan_source(src_path):
+                old = recorded.get(item[0], None)
+                if (old is not None) and (tuple(old[:2]) == item[1:]):
+                    rows.append(item + (old[2],))
+                else:
+                    changed.append(item)
+
+            futures = [
+                executor.submit(hash_files, src_path, batch)
+                for batch in _split_batches(changed)
+            ]
+            for future in concurrent.futures.as_completed(futures):
+                rows.extend(future.result())
+
+            index.replace_unit(project, SOURCE_UNIT, rows)
+            yield (project, len(rows), len(changed))
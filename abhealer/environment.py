@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+"""
+Cached detection of the Areca Backup environment.
+
+Detection results are kept in a small state file with a TTL, Docker is probed
+through its daemon socket instead of starting a container. Negative results
+are never kept, Areca could be installed or the daemon started right after.
+"""
+
+import os
+import json
+import time
+import socket
+
+DEFAULT_TTL = 3600
+DOCKER_SOCKET = "/var/run/docker.sock"
+
+
+def get_state_path():
+    from .config import get_cache_dir
+
+    return os.path.join(get_cache_dir(), "environment.json")
+
+
+class EnvironmentCache(object):
+    """
+    Detected values with their detection time, persisted as JSON.
+    """
+
+    def __init__(self, path=None, ttl=DEFAULT_TTL):
+        self._path = path if path is not None else get_state_path()
+        self._ttl = ttl
+        self._values = None
+
+    def _load(self):
+        if self._values is not None:
+            return
+
+        self._values = dict()
+        try:
+            with open(self._path, "r") as f:
+                self._values = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self._path), exist_ok=True)
+            temp_path = "%s.%s.tmp" % (self._path, os.getpid())
+            with open(temp_path, "w") as f:
+                json.dump(self._values, f)
+            os.replace(temp_path, self._path)
+        except OSError:
+            # A read only home must not break the program
+            pass
+
+    def get(self, key, detect):
+        """
+        Get a cached value, call detect() if missing or expired. Falsy values
+        are not cached.
+        """
+
+        self._load()
+        record = self._values.get(key, None)
+        if (record is not None) and (time.time() - record[1] < self._ttl):
+            return record[0]
+
+        value = detect()
+        if value:
+            self._values[key] = [value, time.time()]
+            self._save()
+        else:
+            self.invalidate(key)
+        return value
+
+    def invalidate(self, key):
+        self._load()
+        if self._values.pop(key, None) is not None:
+            self._save()
+
+
+_cache = None
+
+
+def get_cache():
+    global _cache
+
+    if _cache is None:
+        _cache = EnvironmentCache()
+
+    return _cache
+
+
+def find_areca_cl():
+    """
+    Get path of areca_cl.sh in PATH, None if not found.
+    """
+
+    def detect():
+        from whichcraft import which
+
+        return which("areca_cl.sh")
+
+    # Cron jobs and shells may have different PATH
+    key = "areca_cl_path:%s" % os.environ.get("PATH", "")
+    apath = get_cache().get(key, detect)
+    if (apath is not None) and (not os.path.exists(apath)):
+        # Areca moved since last detection
+        get_cache().invalidate(key)
+        apath = get_cache().get(key, detect)
+
+    return apath
+
+
+def docker_socket_path():
+    host = os.environ.get("DOCKER_HOST", "")
+    if host.startswith("unix://"):
+        return host[7:]
+
+    return DOCKER_SOCKET
+
+
+def docker_request(path, timeout=2.0):
+    """
+    Send a GET request to the Docker daemon socket.
+
+    :return: (status code, body), (None, None) if the daemon is unreachable.
+    """
+
+    if not hasattr(socket, "AF_UNIX"):
+        return (None, None)
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(docker_socket_path())
+        sock.sendall(
+            ("GET %s HTTP/1.0\r\nHost: docker\r\n\r\n" % path).encode("ascii")
+        )
+
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    except OSError:
+        return (None, None)
+    finally:
+        sock.close()
+
+    response = b"".join(chunks)
+    head, _, body = response.partition(b"\r\n\r\n")
+    try:
+        status = int(head.split(b" ", 2)[1])
+    except (IndexError, ValueError):
+        return (None, None)
+
+    return (status, body)
+
+
+def is_docker_available():
+    """
+    Check the Docker daemon is running, "docker run" pulls a missing image
+    by itself.
+    """
+
+    def detect():
+        status, _ = docker_request("/_ping")
+        return status == 200
+
+    return get_cache().get("docker:%s" % docker_socket_path(), detect)
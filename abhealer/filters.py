@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+
+"""
+Include/exclude filters of sources.
+
+Rules come from the "filters" config key, a source's rules are added to the
+global ones:
+
+    filters:
+      exclude:
+        - dir: node_modules
+        - dir: .git
+        - glob: "*.pyc"
+        - regex: "/build/.*\\.o$"
+        - ext: .log
+        - size: 1G
+      include:
+        - glob: "*.py"
+
+Paths are matched relative to the source, with a leading "/". Globs without
+"/" match names, "**" matches across directories. Regexes are searched in
+the path. Directory rules match a name (or a path if it contains "/") and
+everything below. Size rules exclude larger files. If include rules exist,
+only files that match one of them are kept.
+
+Rules are rendered into Areca filters of the project config and compiled
+into a matcher that previews what every rule removes.
+"""
+
+import os
+import os.path
+import re
+import stat
+import click
+
+# Always excluded, as the project template did before filters existed
+DEFAULT_EXCLUDES = [dict(ext=".tmp"), dict(ext=".temp")]
+
+RULE_KINDS = ("glob", "regex", "dir", "ext", "size")
+
+
+def glob_to_regex(pattern):
+    """
+    Translate a glob into a regex that both Python and Java understand.
+    """
+
+    parts = []
+    i = 0
+    n = len(pattern)
+    while i < n:
+        c = pattern[i]
+        i += 1
+        if c == "*":
+            if pattern.startswith("*", i):
+                i += 1
+                parts.append(".*")
+            else:
+                parts.append("[^/]*")
+        elif c == "?":
+            parts.append("[^/]")
+        elif c == "[":
+            j = pattern.find("]", i + 1 if pattern.startswith("!", i) else i)
+            if j < 0:
+                parts.append(re.escape(c))
+                continue
+
+            content = pattern[i:j].replace("\\", "\\\\")
+            if content.startswith("!"):
+                content = "^" + content[1:]
+            parts.append("[%s]" % content)
+            i = j + 1
+        else:
+            parts.append(re.escape(c))
+
+    return "".join(parts)
+
+
+class Rule(object):
+    """
+    One include or exclude rule.
+    """
+
+    def __init__(self, kind, value, include=False):
+        from .throttle import parse_size
+
+        self._kind = kind
+        self._value = value
+        self._include = include
+        self._size = None
+        self._regex = None
+
+        if kind == "size":
+            self._size = parse_size(value)
+            return
+
+        value = str(value)
+        if kind == "glob":
+            if "/" in value:
+                self._regex = "^/%s$" % glob_to_regex(value.strip("/"))
+            else:
+                self._regex = "/%s$" % glob_to_regex(value)
+        elif kind == "dir":
+            if "/" in value:
+                self._regex = "^/%s(/|$)" % re.escape(value.strip("/"))
+            else:
+                self._regex = "/%s(/|$)" % re.escape(value)
+        elif kind == "ext":
+            self._regex = "%s$" % re.escape(value)
+        elif kind == "regex":
+            self._regex = value
+
+        try:
+            self._compiled = re.compile(self._regex)
+        except re.error as e:
+            raise click.UsageError(
+                "Invalid %s filter %s : %s" % (kind, value, e)
+            )
+
+    @property
+    def kind(self):
+        return self._kind
+
+    @property
+    def value(self):
+        return self._value
+
+    @property
+    def include(self):
+        return self._include
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def regex(self):
+        """Regex searched in source related paths, None for size rules"""
+        return self._regex
+
+    def matches_dir(self, rel_path):
+        """
+        Check if a whole directory is excluded by this rule.
+        """
+
+        if self._include or (self._kind in ("size", "ext")):
+            return False
+
+        return self._compiled.search(rel_path) is not None
+
+    def matches(self, rel_path, size):
+        if self._kind == "size":
+            return size > self._size
+
+        return self._compiled.search(rel_path) is not None
+
+    def gen_areca_regex(self, src_path):
+        """
+        Generate the regex Areca searches in absolute paths.
+        """
+
+        prefix = re.escape(src_path.rstrip("/"))
+        if self._regex.startswith("^"):
+            return "^%s%s" % (prefix, self._regex[1:])
+
+        return "^%s.*?(?:%s)" % (prefix, self._regex)
+
+    def __str__(self):
+        return "%s %s %s" % (
+            "include" if self._include else "exclude",
+            self._kind,
+            self._value,
+        )
+
+
+def parse_rules(filters):
+    """
+    Parse the "filters" mapping into a list of Rule.
+    """
+
+    filters = filters or dict()
+    if not isinstance(filters, dict):
+        raise click.UsageError('Config key "filters" must be a mapping!')
+
+    unknown = set(filters.keys()) - set(["include", "exclude"])
+    if unknown:
+        raise click.UsageError(
+            "Unknown filters : %s" % ", ".join(sorted(unknown))
+        )
+
+    rules = []
+    for group in ("exclude", "include"):
+        for item in filters.get(group, None) or []:
+            if (not isinstance(item, dict)) or (len(item) != 1):
+                raise click.UsageError("Invalid filter : %s" % (item,))
+
+            kind, value = list(item.items())[0]
+            if kind not in RULE_KINDS:
+                raise click.UsageError("Unknown filter kind : %s" % kind)
+
+            if (group == "include") and (kind == "size"):
+                raise click.UsageError("Size filters only exclude files!")
+
+            rules.append(Rule(kind, value, group == "include"))
+
+    return rules
+
+
+def merge_filters(vars, options):
+    """
+    Merge filters of a source after the global ones and the defaults.
+    """
+
+    merged = dict(exclude=list(DEFAULT_EXCLUDES), include=[])
+    for values in (vars, options):
+        filters = values.get("filters", None) or dict()
+        if not isinstance(filters, dict):
+            raise click.UsageError('Config key "filters" must be a mapping!')
+
+        for group in ("exclude", "include"):
+            merged[group].extend(filters.get(group, None) or [])
+
+    # Report bad rules before anything started
+    parse_rules(merged)
+    return merged
+
+
+def gen_areca_filters(filters, src_path):
+    """
+    Generate filters for the project template.
+
+    :return: A dict of "excludes" and "includes" lists, items are dicts with
+    "tag", "logical_not" and "attrs" (or "ext").
+    """
+
+    excludes = []
+    includes = []
+    for rule in parse_rules(filters):
+        if rule.kind == "ext" and not rule.include:
+            item = dict(tag="extension_filter", ext=rule.value)
+        elif rule.kind == "size":
+            item = dict(
+                tag="size_filter", attrs=dict(param="> %s" % rule.size)
+            )
+        else:
+            item = dict(
+                tag="regex_filter",
+                attrs=dict(
+                    regex=rule.gen_areca_regex(src_path),
+                    mode="2",
+                    full_match="false",
+                ),
+            )
+
+        item["logical_not"] = "false" if rule.include else "true"
+        (includes if rule.include else excludes).append(item)
+
+    return dict(excludes=excludes, includes=includes)
+
+
+def _count(counter, size):
+    counter[0] += 1
+    counter[1] += size
+
+
+class PreviewResult(object):
+    def __init__(self, rules):
+        self._counts = dict((str(r), [0, 0]) for r in rules)
+        self._not_included = [0, 0]
+        self._kept = [0, 0]
+
+    @property
+    def counts(self):
+        """Mapping of rule -> [files, bytes] removed by it"""
+        return self._counts
+
+    @property
+    def not_included(self):
+        return self._not_included
+
+    @property
+    def kept(self):
+        return self._kept
+
+
+class FilterMatcher(object):
+    """
+    Compiled rules of a source.
+    """
+
+    def __init__(self, filters):
+        self._rules = parse_rules(filters)
+        self._excludes = [r for r in self._rules if not r.include]
+        self._includes = [r for r in self._rules if r.include]
+
+    @property
+    def rules(self):
+        return self._rules
+
+    def excluded_dir_by(self, rel_path):
+        for rule in self._excludes:
+            if rule.matches_dir(rel_path):
+                return rule
+
+        return None
+
+    def excluded_by(self, rel_path, size):
+        """
+        Get the first rule that removes a file, True if no include rule
+        keeps it, None if the file is kept.
+        """
+
+        for rule in self._excludes:
+            if rule.matches(rel_path, size):
+                return rule
+
+        if self._includes and not any(
+            r.matches(rel_path, size) for r in self._includes
+        ):
+            return True
+
+        return None
+
+    def preview(self, src_path):
+        """
+        Walk a source and count files and bytes removed by every rule.
+        """
+
+        result = PreviewResult(self._rules)
+        src_path = str(src_path)
+
+        def walk(adir, rel_dir, counter):
+            try:
+                entries = list(os.scandir(adir))
+            except OSError:
+                return
+
+            for entry in entries:
+                rel_path = "%s/%s" % (rel_dir, entry.name)
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+
+                if stat.S_ISDIR(st.st_mode):
+                    sub_counter = counter
+                    if sub_counter is None:
+                        rule = self.excluded_dir_by(rel_path)
+                        if rule is not None:
+                            sub_counter = result.counts[str(rule)]
+                    walk(entry.path, rel_path, sub_counter)
+                    continue
+
+                size = st.st_size
+                if counter is not None:
+                    _count(counter, size)
+                    continue
+
+                rule = self.excluded_by(rel_path, size)
+                if rule is None:
+                    _count(result.kept, size)
+                elif rule is True:
+                    _count(result.not_included, size)
+                else:
+                    _count(result.counts[str(rule)], size)
+
+        walk(src_path, "", None)
+        return result
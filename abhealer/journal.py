@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+"""
+Checkpoint journal of "recover repo", so an interrupted recovery could be
+resumed without restoring the finished projects again.
+
+Recorded states let a project skip the empty destination check, so a journal
+that is broken or was written for another repository is ignored.
+"""
+
+import os
+import json
+import datetime
+
+
+class RecoverJournal(object):
+    FILE_NAME = ".abhealer-recover.json"
+
+    # Project states, in the order they are reached
+    STARTED = "started"
+    ARECA_DONE = "areca"
+    DONE = "done"
+    STATES = (STARTED, ARECA_DONE, DONE)
+
+    def __init__(self, to_path, repository):
+        self._path = os.path.join(str(to_path), self.FILE_NAME)
+        self._repository = os.path.realpath(str(repository))
+        self._projects = dict()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self._path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        if (not isinstance(data, dict)) or (
+            data.get("repository", None) != self._repository
+        ):
+            return
+
+        projects = data.get("projects", None)
+        if not isinstance(projects, dict):
+            return
+
+        for name, record in projects.items():
+            if isinstance(record, dict) and (
+                record.get("state", None) in self.STATES
+            ):
+                self._projects[name] = record
+
+    @property
+    def path(self):
+        return self._path
+
+    def state_of(self, name):
+        """
+        Get the recorded state of a project, None if never started.
+        """
+        record = self._projects.get(name, None)
+        if record is None:
+            return None
+
+        return record["state"]
+
+    def mark(self, name, state):
+        self._projects[name] = dict(
+            state=state, time=datetime.datetime.now().isoformat()
+        )
+        self.save()
+
+    def save(self):
+        parent = os.path.dirname(self._path)
+        if not os.path.exists(parent):
+            os.makedirs(parent, exist_ok=True)
+
+        # Replace atomically, a killed process must not leave a broken
+        # journal behind.
+        temp_path = self._path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(
+                dict(repository=self._repository, projects=self._projects),
+                f,
+                indent=1,
+            )
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(temp_path, self._path)
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+"""
+Cached directory model of Areca Backup project directories.
+
+Each project directory is listed once per run, archive numbers are kept in a
+sorted array and the cached listing is only invalidated when abhealer itself
+changes the directory (removing damaged archives, running Areca).
+
+Archive directories could be symbolic links into a cold tier (see
+tiering), they are listed even if their target isn't reachable, so an
+unmounted cold tier never makes archives look damaged.
+"""
+
+import os
+import os.path
+import bisect
+from array import array
+
+DATA_SUFFIX = "_data"
+
+_listings = dict()
+
+
+def folder_to_int(name):
+    parts = name.split("_")
+    first_part = int(parts[0])
+    if len(parts) < 2:
+        second_part = 0
+    else:
+        second_part = int(parts[1])
+
+    return first_part * 1000 + second_part
+
+
+def int_to_folder(aint):
+    first_part = aint // 1000
+    second_part = aint % 1000
+
+    second_part_text = ""
+    if second_part > 0:
+        second_part_text = "_%s" % second_part
+
+    return str(first_part) + second_part_text
+
+
+def _parse_archive_name(name):
+    try:
+        return folder_to_int(name)
+    except ValueError:
+        return None
+
+
+class ProjectListing(object):
+    """
+    One listing of a project directory.
+
+    Archive directories are the ones named like "201711032056" (or
+    "201711032056_1"), their data directories have the "_data" suffix.
+    """
+
+    def __init__(self, proj_dir):
+        self._base_dir = os.path.realpath(str(proj_dir))
+        self._archives = None
+        self._data_archives = None
+        self._names = None
+        self._cold = None
+
+    @property
+    def base_dir(self):
+        return self._base_dir
+
+    def _load(self):
+        archives = array("q")
+        data_archives = array("q")
+        names = dict()
+        cold = set()
+
+        for entry in os.scandir(self._base_dir):
+            is_link = entry.is_symlink()
+            if not (is_link or entry.is_dir()):
+                continue
+
+            name = entry.name
+            is_data = name.endswith(DATA_SUFFIX)
+            if is_data:
+                name = name[: -len(DATA_SUFFIX)]
+
+            num = _parse_archive_name(name)
+            if num is None:
+                continue
+
+            names[num] = name
+            if is_link:
+                cold.add(num)
+
+            if is_data:
+                data_archives.append(num)
+            else:
+                archives.append(num)
+
+        self._archives = array("q", sorted(archives))
+        self._data_archives = array("q", sorted(data_archives))
+        self._names = names
+        self._cold = cold
+
+    def _ensure_loaded(self):
+        if self._archives is None:
+            self._load()
+
+    def invalidate(self):
+        self._archives = None
+        self._data_archives = None
+        self._names = None
+        self._cold = None
+
+    @property
+    def archives(self):
+        """Sorted archive numbers (see folder_to_int())"""
+        self._ensure_loaded()
+        return self._archives
+
+    @property
+    def data_archives(self):
+        """Sorted numbers of archives that own a "_data" directory"""
+        self._ensure_loaded()
+        return self._data_archives
+
+    def has_data(self, num):
+        data_archives = self.data_archives
+        index = bisect.bisect_left(data_archives, num)
+        return (index < len(data_archives)) and (data_archives[index] == num)
+
+    @property
+    def cold_archives(self):
+        """Sorted numbers of archives linked to the cold tier"""
+        self._ensure_loaded()
+        return sorted(self._cold)
+
+    def is_cold(self, num):
+        self._ensure_loaded()
+        return num in self._cold
+
+    @property
+    def damaged_archives(self):
+        """Archive numbers which do not have a "_data" directory"""
+        return [num for num in self.archives if not self.has_data(num)]
+
+    def name_of(self, num):
+        self._ensure_loaded()
+        return self._names.get(num, int_to_folder(num))
+
+    def archive_path(self, num):
+        return os.path.join(self._base_dir, self.name_of(num))
+
+    def data_path(self, num):
+        return os.path.join(self._base_dir, self.name_of(num) + DATA_SUFFIX)
+
+    def discard(self, num):
+        """Forget an archive that abhealer removed by itself"""
+        self._ensure_loaded()
+        for nums in (self._archives, self._data_archives):
+            index = bisect.bisect_left(nums, num)
+            if (index < len(nums)) and (nums[index] == num):
+                del nums[index]
+
+    def __repr__(self):
+        return '%s("%s")' % (type(self).__qualname__, self._base_dir)
+
+
+def get_listing(proj_dir):
+    key = os.path.realpath(str(proj_dir))
+    listing = _listings.get(key, None)
+    if listing is None:
+        listing = ProjectListing(key)
+        _listings[key] = listing
+
+    return listing
+
+
+def invalidate(proj_dir=None):
+    """
+    Drop cached listings, all of them if proj_dir is None.
+    """
+    if proj_dir is None:
+        _listings.clear()
+        return
+
+    _listings.pop(os.path.realpath(str(proj_dir)), None)
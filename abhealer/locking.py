@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+
+"""
+Per-project advisory locks, so several abhealer processes (overlapping cron
+jobs, workers of other hosts) could work on one repository.
+
+Lock files live in ".abhealer/locks/<project>.lock" of the repository and
+are locked with flock(). Backups, merges and removal of damaged archives
+need the exclusive lock, recoveries share the lock with each other.
+
+Locks are reentrant for their owner, the asyncio task or else the thread
+that acquired them: a nested acquire of a lock that the owner already holds
+(exclusively, or shared for a shared request) only counts. Other tasks and
+threads of the process wait like other processes do.
+"""
+
+import os
+import os.path
+import json
+import time
+import socket
+import asyncio
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory locks on Windows, locking is a no-op there
+    fcntl = None
+
+LOCKS_DIR_NAME = "locks"
+LOCK_SUFFIX = ".lock"
+
+# Poll interval grows from MIN to MAX while waiting for a lock
+MIN_POLL_INTERVAL = 0.1
+MAX_POLL_INTERVAL = 2.0
+
+# Locks held by this process: lock path -> [fd, exclusive, {owner: count}]
+_held = dict()
+_held_guard = threading.Lock()
+
+
+def _get_owner():
+    """
+    Get the running asyncio task, or the current thread's id outside tasks.
+    """
+
+    try:
+        if hasattr(asyncio, "current_task"):
+            task = asyncio.current_task()
+        else:
+            task = asyncio.Task.current_task()
+    except RuntimeError:
+        # No running event loop
+        task = None
+
+    if task is not None:
+        return task
+
+    return threading.get_ident()
+
+
+class LockTimeoutError(TimeoutError):
+    def __init__(self, path, owner=None):
+        self.path = path
+        self.owner = owner
+
+        message = "Timeout while waiting for lock : %s" % path
+        if owner:
+            message += " (held by %s pid %s since %s)" % (
+                owner.get("host", "?"),
+                owner.get("pid", "?"),
+                time.strftime(
+                    "%Y-%m-%d %H:%M:%S",
+                    time.localtime(owner.get("time", 0)),
+                ),
+            )
+
+        super(LockTimeoutError, self).__init__(message)
+
+
+def get_lock_path(proj_dir):
+    """
+    Get lock file path of a project directory inside a repository.
+    """
+
+    from .arecabackup import Repository
+
+    proj_dir = os.path.abspath(str(proj_dir))
+    return os.path.join(
+        os.path.dirname(proj_dir),
+        Repository.STATE_DIR_NAME,
+        LOCKS_DIR_NAME,
+        os.path.basename(proj_dir) + LOCK_SUFFIX,
+    )
+
+
+def read_owner(lock_path):
+    """
+    Get owner info of the last exclusive holder, None if unknown.
+    """
+
+    try:
+        with open(lock_path, "r") as f:
+            return json.loads(f.read() or "null")
+    except (OSError, ValueError):
+        return None
+
+
+class ProjectLock(object):
+    """
+    An advisory lock of one project.
+
+    :param timeout: Seconds to wait for the lock, None waits forever and 0
+    fails at once.
+    """
+
+    def __init__(self, proj_dir, exclusive=True, timeout=None):
+        self._path = get_lock_path(proj_dir)
+        self._exclusive = exclusive
+        self._timeout = timeout
+        self._acquired = False
+        self._owner = None
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def exclusive(self):
+        return self._exclusive
+
+    def _try_acquire(self):
+        """
+        Try to acquire the lock once, returns True on success.
+        """
+
+        owner = _get_owner()
+        with _held_guard:
+            held = _held.get(self._path, None)
+            if held is not None:
+                owners = held[2]
+                if self._exclusive and not held[1]:
+                    if owner in owners:
+                        raise RuntimeError(
+                            "Can't upgrade shared lock : %s" % self._path
+                        )
+
+                    return False
+
+                if held[1] and (owner not in owners):
+                    # Held exclusively by another task or thread
+                    return False
+
+                owners[owner] = owners.get(owner, 0) + 1
+                self._owner = owner
+                return True
+
+            if fcntl is None:
+                _held[self._path] = [None, self._exclusive, {owner: 1}]
+                self._owner = owner
+                return True
+
+            os.makedirs(os.path.dirname(self._path), exist_ok=True)
+            fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o666)
+            operation = fcntl.LOCK_EX if self._exclusive else fcntl.LOCK_SH
+            try:
+                fcntl.flock(fd, operation | fcntl.LOCK_NB)
+            except (BlockingIOError, PermissionError):
+                os.close(fd)
+                return False
+
+            if self._exclusive:
+                self._write_owner(fd)
+
+            _held[self._path] = [fd, self._exclusive, {owner: 1}]
+            self._owner = owner
+            return True
+
+    def _write_owner(self, fd):
+        info = dict(
+            host=socket.gethostname(), pid=os.getpid(), time=time.time()
+        )
+        os.ftruncate(fd, 0)
+        os.pwrite(fd, json.dumps(info).encode("utf-8"), 0)
+
+    def _gen_intervals(self):
+        """
+        Generate sleep intervals until the timeout expired.
+        """
+
+        deadline = None
+        if self._timeout is not None:
+            deadline = time.monotonic() + self._timeout
+
+        interval = MIN_POLL_INTERVAL
+        while True:
+            if deadline is not None:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    raise LockTimeoutError(self._path, read_owner(self._path))
+                interval = min(interval, left)
+
+            yield interval
+            interval = min(interval * 2, MAX_POLL_INTERVAL)
+
+    def acquire(self):
+        if not self._try_acquire():
+            for interval in self._gen_intervals():
+                time.sleep(interval)
+                if self._try_acquire():
+                    break
+
+        self._acquired = True
+        return self
+
+    async def acquire_async(self):
+        """
+        Acquire the lock without blocking other jobs of the event loop.
+        """
+
+        if not self._try_acquire():
+            for interval in self._gen_intervals():
+                await asyncio.sleep(interval)
+                if self._try_acquire():
+                    break
+
+        self._acquired = True
+        return self
+
+    def release(self):
+        if not self._acquired:
+            return
+
+        self._acquired = False
+        with _held_guard:
+            held = _held[self._path]
+            owners = held[2]
+            owners[self._owner] -= 1
+            if not owners[self._owner]:
+                del owners[self._owner]
+            self._owner = None
+            if owners:
+                return
+
+            del _held[self._path]
+            if held[0] is not None:
+                # Keep the file, removing it races with other waiters
+                fcntl.flock(held[0], fcntl.LOCK_UN)
+                os.close(held[0])
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+    async def __aenter__(self):
+        return await self.acquire_async()
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.release()
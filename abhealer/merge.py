@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+"""
+Plan archive merges that bound the incremental chain length.
+
+Recent archives are kept one per day, older ones one per week and the rest
+one per month. Every bucket that holds more than one archive becomes a merge
+range that Areca's merge operation collapses into a single archive.
+"""
+
+import datetime
+
+ARCHIVE_SIZE_KEY = "Archive size"
+
+
+class MergePolicy(object):
+    def __init__(self, daily_days=7, weekly_weeks=8):
+        self._daily_days = daily_days
+        self._weekly_weeks = weekly_weeks
+
+    @property
+    def daily_days(self):
+        return self._daily_days
+
+    @property
+    def weekly_weeks(self):
+        return self._weekly_weeks
+
+    def bucket_of(self, date, today):
+        """
+        Get the bucket key of an archive date, archives in the same bucket
+        are merged together.
+        """
+
+        age = (today - date).days
+        if age < self._daily_days:
+            return ("day", date.toordinal())
+
+        if age < self._daily_days + self._weekly_weeks * 7:
+            year, week, _ = date.isocalendar()
+            return ("week", year, week)
+
+        return ("month", date.year, date.month)
+
+
+class MergeRange(object):
+    """
+    A series of contiguous archives that should be merged into one.
+    """
+
+    def __init__(self, project, infos, sizes, today):
+        self._project = project
+        self._infos = infos
+        self._sizes = sizes
+        self._today = today
+
+    @property
+    def project(self):
+        return self._project
+
+    @property
+    def infos(self):
+        return self._infos
+
+    @property
+    def first(self):
+        return self._infos[0]
+
+    @property
+    def last(self):
+        return self._infos[-1]
+
+    @property
+    def size(self):
+        return sum(self._sizes)
+
+    @property
+    def from_days(self):
+        """Age in days of the oldest archive"""
+        return (self._today - self.first.datetime.date()).days
+
+    @property
+    def to_days(self):
+        """Age in days of the newest archive"""
+        return (self._today - self.last.datetime.date()).days
+
+    @property
+    def removed_archives(self):
+        return len(self._infos) - 1
+
+    def __repr__(self):
+        return "%s(%s, %s..%s)" % (
+            type(self).__qualname__,
+            self._project.name,
+            int(self.first),
+            int(self.last),
+        )
+
+
+class MergePlan(object):
+    def __init__(self, project, chain_length, ranges):
+        self._project = project
+        self._chain_length = chain_length
+        self._ranges = ranges
+
+    @property
+    def project(self):
+        return self._project
+
+    @property
+    def ranges(self):
+        return self._ranges
+
+    @property
+    def chain_length(self):
+        """Archives Areca replays to recover the newest state today"""
+        return self._chain_length
+
+    @property
+    def merged_chain_length(self):
+        return self._chain_length - sum(
+            r.removed_archives for r in self._ranges
+        )
+
+    def estimate_savings(self, archive_overhead):
+        """
+        Estimated recovery seconds saved, every archive that disappears saves
+        its open/replay overhead.
+        """
+        return (self.chain_length - self.merged_chain_length) * float(
+            archive_overhead
+        )
+
+
+def _get_size(info):
+    return info.get_int_property(ARCHIVE_SIZE_KEY, 0)
+
+
+def plan_project(project, policy, today=None):
+    if today is None:
+        today = datetime.date.today()
+
+    infos = project.data_infos
+
+    groups = []
+    last_key = None
+    for info in infos:
+        key = policy.bucket_of(info.datetime.date(), today)
+        if key != last_key:
+            groups.append([])
+            last_key = key
+
+        groups[-1].append(info)
+
+    ranges = []
+    for group in groups:
+        if len(group) < 2:
+            continue
+
+        ranges.append(
+            MergeRange(project, group, [_get_size(i) for i in group], today)
+        )
+
+    return MergePlan(project, len(infos), ranges)
@@ -48,33 +48,90 @@ def normal_path(apath):
     return pathlib.Path(apath)
 
 
-def compute_related_path(link, target):
-    link = pathlib.Path(normal_path(str(link)))
-    target = pathlib.Path(normal_path(str(target)))
-
-    link_parents = [str(p) for p in reversed(link.parents)]
-    target_parents = [str(p) for p in reversed(target.parents)]
-
-    max_parents = min(len(link.parents), len(target.parents))
-    found_index = max_parents
-    for i in range(0, max_parents):
-        if link_parents[i] != target_parents[i]:
-            found_index = i
-            break
-
-    if len(link.parents) > len(target.parents):
-        return os.path.join(
-            "../" * (len(link.parents) - found_index), target.name
-        )
-    elif found_index == max_parents:
-        return target.name
-    else:
-        # Don't join like this:
-        #
-        #    os.path.join(*target_parents[found_index:], target.name)
-        #
-        # This syntax will lead python below v3.4 report error : "SyntaxError:
-        # only named arguments may follow *expression"!
-        return os.path.join(
-            os.path.join(*target_parents[found_index:]), target.name
-        )
+def split_path(apath):
+    """
+    Split a "/" separated path into normalized components, ".." of the root
+    stays at the root like os.path.normpath() does.
+    """
+
+    parts = []
+    for part in str(apath).replace("\\", "/").split("/"):
+        if (not part) or (part == "."):
+            continue
+
+        if part == "..":
+            if parts:
+                parts.pop()
+        else:
+            parts.append(part)
+
+    return parts
+
+
+class _TrieNode(object):
+    __slots__ = ("parent", "name", "depth", "children")
+
+    def __init__(self, parent, name):
+        self.parent = parent
+        self.name = name
+        self.depth = 0 if parent is None else parent.depth + 1
+        self.children = dict()
+
+
+class PathTrie(object):
+    """
+    Paths of a tree stored once as a trie of their components.
+
+    Relative paths between two nodes are found by walking up to their
+    common ancestor, without normalizing or comparing path strings again.
+    """
+
+    def __init__(self):
+        self._root = _TrieNode(None, "")
+
+    @property
+    def root(self):
+        return self._root
+
+    def add(self, parts, node=None):
+        """
+        Get the node of components below node (the root by default), missing
+        nodes are created.
+        """
+
+        if node is None:
+            node = self._root
+
+        for part in parts:
+            child = node.children.get(part, None)
+            if child is None:
+                child = _TrieNode(node, part)
+                node.children[part] = child
+            node = child
+
+        return node
+
+    @staticmethod
+    def relative(from_dir, to_node):
+        """
+        Get the relative path from a directory node to another node.
+        """
+
+        ups = 0
+        names = []
+        while from_dir.depth > to_node.depth:
+            from_dir = from_dir.parent
+            ups += 1
+
+        while to_node.depth > from_dir.depth:
+            names.append(to_node.name)
+            to_node = to_node.parent
+
+        while from_dir is not to_node:
+            from_dir = from_dir.parent
+            ups += 1
+            names.append(to_node.name)
+            to_node = to_node.parent
+
+        names.reverse()
+        return os.sep.join([".."] * ups + names) or "."
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+
+"""
+Timing spans of abhealer phases, written as a Chrome trace (JSON) that
+chrome://tracing or Perfetto could open.
+
+Spans are recorded only after start_tracing(), otherwise span() returns a
+shared no-op context manager. Projects run concurrently on one asyncio
+thread, so spans could be put in named lanes (one per project) which the
+viewer shows as separate threads.
+"""
+
+import os
+import json
+import time
+import threading
+
+_tracer = None
+
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_null_span = _NullSpan()
+
+
+class _Span(object):
+    def __init__(self, tracer, name, lane, args):
+        self._tracer = tracer
+        self._name = name
+        self._lane = lane
+        self._args = args
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        args = self._args
+        if exc_type is not None:
+            args = dict(args, error=exc_type.__name__)
+
+        self._tracer.add_span(
+            self._name, self._start, time.perf_counter(), self._lane, args
+        )
+        return False
+
+
+class Tracer(object):
+    def __init__(self):
+        self._origin = time.perf_counter()
+        self._events = []
+        self._lanes = dict()
+        self._lock = threading.Lock()
+
+    def _get_tid(self, lane):
+        if lane is None:
+            return threading.get_ident()
+
+        tid = self._lanes.get(lane, None)
+        if tid is None:
+            # Small numbers, real thread ids are addresses
+            tid = len(self._lanes) + 1
+            self._lanes[lane] = tid
+
+        return tid
+
+    def _to_us(self, seconds):
+        return (seconds - self._origin) * 1000000.0
+
+    def add_span(self, name, start, end, lane=None, args=None):
+        """
+        Record a span, start and end are time.perf_counter() values.
+        """
+
+        with self._lock:
+            self._events.append(
+                dict(
+                    name=name,
+                    ph="X",
+                    ts=self._to_us(start),
+                    dur=(end - start) * 1000000.0,
+                    pid=os.getpid(),
+                    tid=self._get_tid(lane),
+                    args=args or dict(),
+                )
+            )
+
+    def span(self, name, lane=None, **args):
+        return _Span(self, name, lane, args)
+
+    def save(self, path):
+        events = list(self._events)
+        for lane, tid in self._lanes.items():
+            events.append(
+                dict(
+                    name="thread_name",
+                    ph="M",
+                    pid=os.getpid(),
+                    tid=tid,
+                    args=dict(name=lane),
+                )
+            )
+
+        temp_path = "%s.%s.tmp" % (path, os.getpid())
+        with open(temp_path, "w") as f:
+            json.dump(dict(traceEvents=events, displayTimeUnit="ms"), f)
+        os.replace(temp_path, path)
+
+
+class Profiler(object):
+    """
+    Tracing (and optionally cProfile) of one abhealer run.
+    """
+
+    def __init__(self, path, python=False):
+        self._path = str(path)
+        self._tracer = Tracer()
+        self._profile = None
+        if python:
+            import cProfile
+
+            self._profile = cProfile.Profile()
+
+    @property
+    def tracer(self):
+        return self._tracer
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def stats_path(self):
+        return self._path + ".prof"
+
+    def start(self):
+        if self._profile is not None:
+            self._profile.enable()
+
+    def stop(self):
+        if self._profile is not None:
+            self._profile.disable()
+            self._profile.dump_stats(self.stats_path)
+
+        self._tracer.save(self._path)
+
+
+_profiler = None
+
+
+def start_tracing(path, python=False):
+    """
+    Start recording spans into path, python=True also runs cProfile and
+    writes its stats to "<path>.prof".
+    """
+
+    global _tracer, _profiler
+
+    _profiler = Profiler(path, python)
+    _tracer = _profiler.tracer
+    _profiler.start()
+    return _profiler
+
+
+def stop_tracing():
+    global _tracer, _profiler
+
+    if _profiler is None:
+        return None
+
+    profiler = _profiler
+    _tracer = None
+    _profiler = None
+    profiler.stop()
+    return profiler
+
+
+def is_tracing():
+    return _tracer is not None
+
+
+def span(name, lane=None, **args):
+    """
+    Time a block, a no-op unless tracing is started.
+    """
+
+    if _tracer is None:
+        return _null_span
+
+    return _tracer.span(name, lane, **args)
+
+
+def add_span(name, start, end, lane=None, **args):
+    if _tracer is not None:
+        _tracer.add_span(name, start, end, lane, args)
@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+
+"""
+Streaming parser of Areca console output that reports progress.
+
+Areca doesn't know how many entries it will scan, so the expected count is
+taken from the previous archive's manifest ("Scanned entries (files or
+directories)").
+
+Sizes of scanned files are stat'ed by a worker thread in batches, output
+lines are fed from the event loop which must not wait on the disk.
+"""
+
+import os
+import re
+import time
+import asyncio
+import datetime
+import concurrent.futures
+import click
+
+SCANNED_ENTRIES_KEY = "Scanned entries (files or directories)"
+
+# Some Areca tasks report their progress on lines like "Progress : 45 %",
+# the whole line must match since file names could contain percents too
+PERCENT_RE = re.compile(
+    r"^\s*Progress\s*:\s*(\d{1,3}(?:[.,]\d+)?)\s?%\s*$", re.IGNORECASE
+)
+
+# Paths stat'ed together by the worker thread
+STAT_BATCH_SIZE = 256
+
+_stat_executor = None
+
+
+def _get_stat_executor():
+    global _stat_executor
+
+    if _stat_executor is None:
+        _stat_executor = concurrent.futures.ThreadPoolExecutor(1)
+
+    return _stat_executor
+
+
+def _get_total_size(paths):
+    """
+    Sum sizes of paths, executed in the worker thread.
+    """
+
+    total = 0
+    for apath in paths:
+        try:
+            total += os.lstat(apath).st_size
+        except OSError:
+            pass
+
+    return total
+
+
+def format_eta(seconds):
+    if seconds is None:
+        return "--:--:--"
+
+    return str(datetime.timedelta(seconds=int(seconds)))
+
+
+class ProjectProgress(object):
+    """
+    Progress of one Areca process, feed it with every output line.
+    """
+
+    def __init__(
+        self,
+        name,
+        expected_entries=None,
+        source_dir=None,
+        client_source_dir=None,
+        board=None,
+    ):
+        self._name = name
+        self._expected = expected_entries
+        self._source_dir = source_dir
+        self._client_source_dir = client_source_dir
+        self._board = board
+        self._entries = 0
+        self._bytes = 0
+        self._sizing = []
+        self._unsized = []
+        self._reported_percent = None
+        self._started = time.monotonic()
+        self._finished = None
+        self._succeeded = None
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def expected_entries(self):
+        return self._expected
+
+    @property
+    def entries(self):
+        return self._entries
+
+    @property
+    def bytes_(self):
+        self._collect_sizes()
+        return self._bytes
+
+    @property
+    def finished(self):
+        return self._finished is not None
+
+    @property
+    def succeeded(self):
+        """None until finished"""
+        return self._succeeded
+
+    @property
+    def elapsed(self):
+        end = self._finished
+        if end is None:
+            end = time.monotonic()
+
+        return end - self._started
+
+    @property
+    def percent(self):
+        if self._succeeded:
+            return 100.0
+
+        if self._reported_percent is not None:
+            return self._reported_percent
+
+        if not self._expected:
+            return None
+
+        return min(99.9, self._entries * 100.0 / self._expected)
+
+    @property
+    def files_rate(self):
+        elapsed = self.elapsed
+        if elapsed <= 0:
+            return 0.0
+
+        return self._entries / elapsed
+
+    @property
+    def bytes_rate(self):
+        elapsed = self.elapsed
+        if elapsed <= 0:
+            return 0.0
+
+        return self.bytes_ / elapsed
+
+    @property
+    def eta(self):
+        """Remaining seconds, None if unknown"""
+        percent = self.percent
+        if (not percent) or (self._finished is not None):
+            return None
+
+        return self.elapsed * (100.0 - percent) / percent
+
+    def _parse_path(self, line):
+        if not self._client_source_dir:
+            return None
+
+        index = line.find(self._client_source_dir)
+        if index < 0:
+            return None
+
+        return line[index:].strip()
+
+    def feed(self, line):
+        matched = PERCENT_RE.search(line)
+        if matched:
+            value = float(matched.group(1).replace(",", "."))
+            if value <= 100.0:
+                self._reported_percent = value
+
+        client_path = self._parse_path(line)
+        if client_path is not None:
+            self._entries += 1
+
+            if self._source_dir:
+                related = os.path.relpath(client_path, self._client_source_dir)
+                self._unsized.append(os.path.join(self._source_dir, related))
+                if len(self._unsized) >= STAT_BATCH_SIZE:
+                    self._stat_unsized()
+
+        if self._board is not None:
+            self._board.update(self)
+
+    def _stat_unsized(self):
+        if not self._unsized:
+            return
+
+        self._sizing.append(
+            _get_stat_executor().submit(_get_total_size, self._unsized)
+        )
+        self._unsized = []
+
+    def _collect_sizes(self):
+        pending = []
+        for future in self._sizing:
+            if future.done():
+                self._bytes += future.result()
+            else:
+                pending.append(future)
+        self._sizing = pending
+
+    def finish(self, succeeded=True):
+        """
+        :param succeeded: False if Areca failed, the progress stays where
+        it stopped.
+        """
+
+        self._stat_unsized()
+        concurrent.futures.wait(self._sizing)
+        self._finish(succeeded)
+
+    async def finish_async(self, succeeded=True):
+        """
+        finish() for event loops, waits for the last sizes without blocking
+        other jobs.
+        """
+
+        self._stat_unsized()
+        if self._sizing:
+            await asyncio.wait([asyncio.wrap_future(x) for x in self._sizing])
+        self._finish(succeeded)
+
+    def _finish(self, succeeded):
+        self._finished = time.monotonic()
+        self._succeeded = succeeded
+        if self._board is not None:
+            self._board.update(self, force=True)
+
+    def format(self):
+        percent = self.percent
+        if percent is None:
+            percent_text = "  ?.?%"
+        else:
+            percent_text = "%5.1f%%" % percent
+
+        if self._expected:
+            entries_text = "%s/%s" % (self._entries, self._expected)
+        else:
+            entries_text = "%s" % self._entries
+
+        text = "%s (%s entries) %.1f files/s %.2f MB/s ETA %s" % (
+            percent_text,
+            entries_text,
+            self.files_rate,
+            self.bytes_rate / (1024.0 * 1024.0),
+            format_eta(self.eta),
+        )
+        if self._succeeded is False:
+            text += " failed"
+
+        return text
+
+
+class ProgressBoard(object):
+    """
+    Collects progress of all projects of a run and emits them periodically.
+    """
+
+    def __init__(self, interval=5.0, emit=None):
+        self._interval = interval
+        self._emit = emit if emit is not None else click.echo
+        self._projects = []
+        self._last_emitted = dict()
+
+    @property
+    def projects(self):
+        return self._projects
+
+    def track(self, name, expected_entries=None, **kwargs):
+        progress = ProjectProgress(
+            name, expected_entries, board=self, **kwargs
+        )
+        self._projects.append(progress)
+        return progress
+
+    def overall(self):
+        """
+        Returns (percent, eta) over all tracked projects, ETA is None if any
+        project doesn't know its expected entries.
+        """
+
+        expected = 0
+        done = 0
+        eta = 0
+        for progress in self._projects:
+            if not progress.expected_entries:
+                return (None, None)
+
+            expected += progress.expected_entries
+            if progress.succeeded:
+                done += progress.expected_entries
+            elif progress.finished:
+                done += min(progress.entries, progress.expected_entries)
+            else:
+                done += min(progress.entries, progress.expected_entries)
+                project_eta = progress.eta
+                if project_eta is None:
+                    eta = None
+                elif eta is not None:
+                    eta = max(eta, project_eta)
+
+        if not expected:
+            return (None, None)
+
+        return (done * 100.0 / expected, eta)
+
+    def update(self, progress, force=False):
+        now = time.monotonic()
+        last = self._last_emitted.get(progress.name, 0)
+        if (not force) and (now - last < self._interval):
+            return
+
+        self._last_emitted[progress.name] = now
+        self._emit("[%s] progress %s" % (progress.name, progress.format()))
+
+        if len(self._projects) > 1:
+            percent, eta = self.overall()
+            if percent is not None:
+                self._emit(
+                    "[overall] progress %5.1f%% ETA %s"
+                    % (percent, format_eta(eta))
+                )
@@ -0,0 +1,368 @@
+# -*- coding: utf-8 -*-
+
+"""
+Incremental replication of a repository to another directory (e.g. a NAS).
+
+An archive is never changed once its "_data" directory exists, so instead of
+comparing every file like rsync does, only the archive listings of the
+source projects are compared with a journal of replicated archives kept in
+the destination. New archives are copied by a thread pool with
+os.copy_file_range() (or os.sendfile()), which let the kernel move the data,
+into a pending directory that is renamed into place once it's verified.
+Archives that were merged away in the source are removed from the
+destination. Other files of projects and the repository (config backups,
+history) are small and copied when their size or time changed.
+"""
+
+import os
+import os.path
+import json
+import time
+import errno
+import shutil
+import hashlib
+import datetime
+import concurrent.futures
+
+from .listing import get_listing
+
+PENDING_SUFFIX = ".abhealer-replica"
+
+# Kernel copy errors that mean "not supported here", fall back to sendfile
+_FALLBACK_ERRNOS = set(
+    getattr(errno, name)
+    for name in ("EXDEV", "ENOSYS", "EINVAL", "EOPNOTSUPP", "ENOTSUP")
+    if hasattr(errno, name)
+)
+
+
+class ReplicationJournal(object):
+    """
+    Archives already replicated to a destination, with a fingerprint of
+    their manifest to notice archives that were rewritten (merged).
+
+    Changes are saved every save_interval seconds and by save(), an archive
+    copied but not saved yet is only copied again after a crash.
+    """
+
+    FILE_NAME = "replication.json"
+
+    def __init__(self, dest, save_interval=30.0):
+        from .arecabackup import Repository
+
+        self._path = os.path.join(
+            str(dest), Repository.STATE_DIR_NAME, self.FILE_NAME
+        )
+        self._projects = dict()
+        self._save_interval = save_interval
+        self._last_saved = time.monotonic()
+
+        if os.path.exists(self._path):
+            with open(self._path, "r") as f:
+                self._projects = json.load(f).get("projects", dict())
+
+    @property
+    def path(self):
+        return self._path
+
+    def archives_of(self, project_name):
+        """
+        Get a dict of replicated archive name -> fingerprint.
+        """
+        return self._projects.setdefault(project_name, dict())
+
+    def mark(self, project_name, name, fingerprint):
+        self.archives_of(project_name)[name] = fingerprint
+        self._save_if_due()
+
+    def forget(self, project_name, name):
+        self.archives_of(project_name).pop(name, None)
+        self._save_if_due()
+
+    def _save_if_due(self):
+        if time.monotonic() - self._last_saved >= self._save_interval:
+            self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+
+        temp_path = self._path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(
+                dict(
+                    projects=self._projects,
+                    time=datetime.datetime.now().isoformat(),
+                ),
+                f,
+                indent=1,
+            )
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self._path)
+        self._last_saved = time.monotonic()
+
+
+class ReplicationResult(object):
+    def __init__(self):
+        self._copied = []
+        self._removed = []
+        self._bytes = 0
+
+    @property
+    def copied(self):
+        """Names of copied archives"""
+        return self._copied
+
+    @property
+    def removed(self):
+        """Names of archives removed from the destination"""
+        return self._removed
+
+    @property
+    def bytes(self):
+        return self._bytes
+
+    def add_bytes(self, size):
+        self._bytes += size
+
+
+def get_fingerprint(data_dir):
+    """
+    Fingerprint of an archive: size and time of its manifest.
+    """
+
+    apath = os.path.join(str(data_dir), "manifest")
+    if not os.path.exists(apath):
+        apath = str(data_dir)
+
+    st = os.stat(apath)
+    return "%s-%s" % (st.st_size, st.st_mtime_ns)
+
+
+def copy_file(src, dst):
+    """
+    Copy a file inside the kernel if possible, executed in worker threads.
+
+    :return: Copied bytes
+    """
+
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        in_fd = fsrc.fileno()
+        out_fd = fdst.fileno()
+        size = os.fstat(in_fd).st_size
+        copied = 0
+
+        if hasattr(os, "copy_file_range"):
+            try:
+                while copied < size:
+                    n = os.copy_file_range(in_fd, out_fd, size - copied)
+                    if n == 0:
+                        break
+                    copied += n
+            except OSError as e:
+                if e.errno not in _FALLBACK_ERRNOS:
+                    raise
+
+        if (copied < size) and hasattr(os, "sendfile"):
+            try:
+                while copied < size:
+                    n = os.sendfile(out_fd, in_fd, copied, size - copied)
+                    if n == 0:
+                        break
+                    copied += n
+            except OSError as e:
+                if e.errno not in _FALLBACK_ERRNOS:
+                    raise
+
+        if copied < size:
+            fsrc.seek(copied)
+            fdst.seek(copied)
+            shutil.copyfileobj(fsrc, fdst)
+            copied = fdst.tell()
+
+    shutil.copystat(src, dst)
+    return copied
+
+
+def files_equal(src, dst):
+    """
+    Compare the contents of two files, executed in worker threads.
+    """
+
+    from .zipview import hash_file
+
+    if os.path.getsize(src) != os.path.getsize(dst):
+        return False
+
+    digests = []
+    for apath in (src, dst):
+        digest = hashlib.sha256()
+        hash_file(apath, digest)
+        digests.append(digest.digest())
+
+    return digests[0] == digests[1]
+
+
+def _plan_copy(src_dir, dst_dir):
+    """
+    Create directories of a tree and get its files as (src, dst) pairs.
+    """
+
+    pairs = []
+    for parent, dirnames, filenames in os.walk(src_dir):
+        rel_dir = os.path.relpath(parent, src_dir)
+        dst_parent = os.path.normpath(os.path.join(dst_dir, rel_dir))
+        os.makedirs(dst_parent, exist_ok=True)
+        for name in filenames:
+            pairs.append(
+                (os.path.join(parent, name), os.path.join(dst_parent, name))
+            )
+
+    return pairs
+
+
+def _remove_dir(apath):
+    if os.path.islink(apath):
+        os.unlink(apath)
+    elif os.path.lexists(apath):
+        shutil.rmtree(apath)
+
+
+def _sync_files(src_dir, dst_dir):
+    """
+    Copy regular files directly in src_dir whose size or time changed.
+    """
+
+    os.makedirs(dst_dir, exist_ok=True)
+    for entry in os.scandir(src_dir):
+        if not entry.is_file(follow_symlinks=False):
+            continue
+
+        dst = os.path.join(dst_dir, entry.name)
+        st = entry.stat()
+        try:
+            dst_st = os.stat(dst)
+            if (dst_st.st_size == st.st_size) and (
+                dst_st.st_mtime_ns == st.st_mtime_ns
+            ):
+                continue
+        except OSError:
+            pass
+
+        temp_path = dst + PENDING_SUFFIX
+        copy_file(entry.path, temp_path)
+        os.replace(temp_path, dst)
+
+
+class Replicator(object):
+    """
+    Replicate projects of a repository into dest.
+
+    :param verify: Compare the contents of every copied file.
+    """
+
+    def __init__(self, repository, dest, jobs=None, verify=True):
+        self._repository = str(repository)
+        self._dest = str(dest)
+        self._jobs = jobs or min(16, (os.cpu_count() or 1) * 2)
+        self._verify = verify
+        self._journal = ReplicationJournal(dest)
+
+    @property
+    def journal(self):
+        return self._journal
+
+    def sync_config(self):
+        """
+        Copy the config backups of the repository.
+        """
+        from .arecabackup import Repository
+
+        _sync_files(
+            os.path.join(self._repository, Repository.CFG_DIR_NAME),
+            os.path.join(self._dest, Repository.CFG_DIR_NAME),
+        )
+
+    def _copy_archive(self, executor, src_dirs, dst_proj_dir, result):
+        pending_dirs = []
+        for src_dir in src_dirs:
+            pending = os.path.join(
+                dst_proj_dir, os.path.basename(src_dir) + PENDING_SUFFIX
+            )
+            _remove_dir(pending)
+            pending_dirs.append(pending)
+
+            pairs = _plan_copy(src_dir, pending)
+            for size in executor.map(lambda x: copy_file(*x), pairs):
+                result.add_bytes(size)
+
+            if self._verify:
+                for (src, dst), same in zip(
+                    pairs, executor.map(lambda x: files_equal(*x), pairs)
+                ):
+                    if not same:
+                        raise OSError("Copy of %s differs : %s" % (src, dst))
+
+        # The archive first, the data directory marks it complete
+        for src_dir, pending in zip(src_dirs, pending_dirs):
+            dst = os.path.join(dst_proj_dir, os.path.basename(src_dir))
+            _remove_dir(dst)
+            os.rename(pending, dst)
+
+    def replicate_project(self, proj_dir, on_archive=None):
+        """
+        Replicate new archives of a project, remove merged ones. The journal
+        is saved when the project is done, or failed.
+
+        :param on_archive: Called with (action, archive name), action is
+        "copied" or "removed".
+        :return: ReplicationResult
+        """
+
+        try:
+            return self._replicate_project(proj_dir, on_archive)
+        finally:
+            self._journal.save()
+
+    def _replicate_project(self, proj_dir, on_archive):
+
+        proj_dir = str(proj_dir)
+        project_name = os.path.basename(os.path.realpath(proj_dir))
+        dst_proj_dir = os.path.join(self._dest, project_name)
+        listing = get_listing(proj_dir)
+        known = self._journal.archives_of(project_name)
+        result = ReplicationResult()
+
+        _sync_files(proj_dir, dst_proj_dir)
+
+        names = dict()
+        for num in listing.data_archives:
+            name = listing.name_of(num)
+            names[name] = get_fingerprint(listing.data_path(num))
+
+        for name in sorted(set(known.keys()) - set(names.keys())):
+            for suffix in ("", "_data"):
+                _remove_dir(os.path.join(dst_proj_dir, name + suffix))
+            self._journal.forget(project_name, name)
+            result.removed.append(name)
+            if on_archive is not None:
+                on_archive("removed", name)
+
+        with concurrent.futures.ThreadPoolExecutor(self._jobs) as executor:
+            for num in listing.data_archives:
+                name = listing.name_of(num)
+                if known.get(name, None) == names[name]:
+                    continue
+
+                self._copy_archive(
+                    executor,
+                    [listing.archive_path(num), listing.data_path(num)],
+                    dst_proj_dir,
+                    result,
+                )
+                self._journal.mark(project_name, name, names[name])
+                result.copied.append(name)
+                if on_archive is not None:
+                    on_archive("copied", name)
+
+        return result
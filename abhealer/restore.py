@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+
+"""
+Pipelined fix-up of recovered directories and symbolic links.
+
+Areca Backup doesn't restore empty directories, directory permissions and
+relative symbolic links. The trace of the project already lists them before
+Areca starts, so the directory skeleton is created up front and a final pass
+after Areca fixes permissions and symbolic links. Links are fixed per
+directory, every directory that contains links is listed once.
+
+Targets of all symbolic links are resolved in one batch against a trie of
+the recovered tree's paths, instead of normalizing and comparing the parent
+lists of every link and its target.
+"""
+
+import os
+import os.path
+import sys
+import click
+
+from .pathutils import (
+    get_path_owner,
+    get_path_group,
+    chown,
+    split_path,
+    PathTrie,
+)
+
+# Directories must stay writable for Areca until the final pass
+SKELETON_MODE = 0o700
+
+
+class TraceEntry(object):
+    """
+    A directory or symbolic link listed in the trace.
+    """
+
+    def __init__(self, key, infos):
+        self._rel_path = key[1:].lstrip("/")
+        self._is_dir = key.startswith("d")
+
+        if self._is_dir:
+            self._link = None
+            mode_index = 2
+        else:
+            # Link target as seen by the Areca client
+            self._link = infos[1][1:]
+            mode_index = 3
+
+        self._mode = int(infos[mode_index]) & 0o777
+        self._owner = infos[mode_index + 1]
+        self._group = infos[mode_index + 2]
+
+    @property
+    def rel_path(self):
+        return self._rel_path
+
+    @property
+    def is_dir(self):
+        return self._is_dir
+
+    @property
+    def link(self):
+        return self._link
+
+    @property
+    def mode(self):
+        return self._mode
+
+    @property
+    def owner(self):
+        return self._owner
+
+    @property
+    def group(self):
+        return self._group
+
+    @property
+    def depth(self):
+        return self._rel_path.count("/")
+
+
+def parse_entries(trace_infos):
+    """
+    Get (directories parents first, symbolic links) from trace infos.
+    """
+
+    dirs = []
+    links = []
+    for k, v in trace_infos.items():
+        if k.startswith("d"):
+            dirs.append(TraceEntry(k, v))
+        elif k.startswith("s"):
+            links.append(TraceEntry(k, v))
+
+    dirs.sort(key=lambda x: x.depth)
+    return (dirs, links)
+
+
+def resolve_link_targets(links, client_source_dir):
+    """
+    Get targets to restore of symbolic links: links into client_source_dir
+    are made relative, others are kept.
+
+    :return: A dict of link's relative path -> target.
+    """
+
+    trie = PathTrie()
+    client_parts = split_path(client_source_dir)
+    client_len = len(client_parts)
+
+    targets = dict()
+    for entry in links:
+        if not os.path.isabs(entry.link):
+            targets[entry.rel_path] = entry.link
+            continue
+
+        target_parts = split_path(entry.link)
+        if target_parts[:client_len] != client_parts:
+            targets[entry.rel_path] = entry.link
+            continue
+
+        link_dir = trie.add(split_path(os.path.dirname(entry.rel_path)))
+        del target_parts[:client_len]
+        targets[entry.rel_path] = trie.relative(
+            link_dir, trie.add(target_parts)
+        )
+
+    return targets
+
+
+class RecoverPipeline(object):
+    """
+    Fix-up of one recovered project.
+
+    Call start() before Areca runs and finish() after it succeeded, or only
+    finish() if Areca already finished.
+
+    :param source_dir: Where the project is recovered to.
+    :param client_source_dir: The same directory seen by the Areca client,
+    links into it are made relative.
+    """
+
+    def __init__(self, trace_infos, source_dir, client_source_dir):
+        self._source_dir = source_dir
+        self._client_source_dir = client_source_dir
+        self._dirs, self._links = parse_entries(trace_infos)
+        self._targets = resolve_link_targets(self._links, client_source_dir)
+
+    def _path_of(self, entry):
+        return os.path.join(self._source_dir, entry.rel_path)
+
+    def _fix_owner(self, entry, apath):
+        if sys.platform == "win32":
+            return
+
+        import pwd
+        import grp
+
+        if (get_path_owner(apath) == entry.owner) and (
+            get_path_group(apath) == entry.group
+        ):
+            return
+
+        try:
+            uid = pwd.getpwnam(entry.owner).pw_uid
+            gid = grp.getgrnam(entry.group).gr_gid
+        except KeyError:
+            # No such a group or owner name
+            click.echo(
+                'No such owner or group : ("%s", "%s") !'
+                % (entry.owner, entry.group)
+            )
+            return
+
+        chown(apath, uid, gid)
+
+    def _fix_links(self):
+        """
+        Fix symbolic links, one listing of every directory tells which ones
+        Areca extracted.
+        """
+
+        by_dir = dict()
+        for entry in self._links:
+            by_dir.setdefault(os.path.dirname(entry.rel_path), []).append(
+                entry
+            )
+
+        for rel_dir, entries in by_dir.items():
+            try:
+                with os.scandir(os.path.join(self._source_dir, rel_dir)) as it:
+                    found = dict((e.name, e) for e in it)
+            except FileNotFoundError:
+                found = dict()
+
+            for entry in entries:
+                apath = self._path_of(entry)
+                target = self._targets[entry.rel_path]
+                dir_entry = found.get(os.path.basename(entry.rel_path), None)
+                if dir_entry is None:
+                    os.symlink(target, apath)
+                elif (not dir_entry.is_symlink()) or (
+                    os.readlink(apath) != target
+                ):
+                    os.unlink(apath)
+                    os.symlink(target, apath)
+
+                self._fix_owner(entry, apath)
+
+    def create_skeleton(self):
+        """
+        Create missing directories, writable by us until finish().
+        """
+
+        for entry in self._dirs:
+            apath = self._path_of(entry)
+            if os.path.exists(apath):
+                continue
+
+            try:
+                os.makedirs(apath, mode=entry.mode | SKELETON_MODE)
+                self._fix_owner(entry, apath)
+            except OSError:
+                # Retried by the final pass
+                pass
+
+    def start(self):
+        self.create_skeleton()
+
+    def finish(self):
+        """
+        Apply directory permissions and fix symbolic links.
+        """
+
+        # Deepest first, so parents stay accessible while their children
+        # are changed
+        for entry in reversed(self._dirs):
+            apath = self._path_of(entry)
+            if os.path.exists(apath):
+                if (os.stat(apath).st_mode & 0o777) != entry.mode:
+                    os.chmod(apath, entry.mode)
+            else:
+                os.makedirs(apath, mode=entry.mode)
+
+            self._fix_owner(entry, apath)
+
+        self._fix_links()
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+"""
+Asyncio based runner for Areca and Docker processes.
+
+Processes are started from one event loop, their output is streamed and
+timestamped line by line, and every job could be limited by a timeout.
+"""
+
+import os
+import sys
+import signal
+import asyncio
+import datetime
+import functools
+import click
+
+# Areca prints long path lines, don't let StreamReader choke on them.
+LINE_LIMIT = 1024 * 1024
+
+# How long we wait for a terminated process before killing it.
+KILL_DELAY = 10
+
+
+class ProcessResult(object):
+    def __init__(self, name, returncode, timed_out, started, finished):
+        self._name = name
+        self._returncode = returncode
+        self._timed_out = timed_out
+        self._started = started
+        self._finished = finished
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def returncode(self):
+        return self._returncode
+
+    @property
+    def timed_out(self):
+        return self._timed_out
+
+    @property
+    def started(self):
+        return self._started
+
+    @property
+    def finished(self):
+        return self._finished
+
+    @property
+    def duration(self):
+        return (self._finished - self._started).total_seconds()
+
+    def __repr__(self):
+        return '%s("%s", %s)' % (
+            type(self).__qualname__,
+            self._name,
+            self._returncode,
+        )
+
+
+def run_sync(coro):
+    """
+    Run a coroutine to the end in a new event loop
+    """
+    if hasattr(asyncio, "run"):
+        return asyncio.run(coro)
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+async def run_blocking(func, *args, **kwargs):
+    """
+    Call a blocking function in the default thread pool, so other jobs of
+    the event loop keep running.
+    """
+
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(
+        None, functools.partial(func, *args, **kwargs)
+    )
+
+
+def echo_line(name, line):
+    now = datetime.datetime.now().strftime("%H:%M:%S")
+    if name:
+        click.echo("[%s] [%s] %s" % (now, name, line))
+    else:
+        click.echo("[%s] %s" % (now, line))
+
+
+async def _read_lines(stream, name, on_line, echo):
+    while True:
+        data = await stream.readline()
+        if not data:
+            break
+
+        line = data.decode("utf-8", errors="replace").rstrip("\r\n")
+        if echo:
+            echo_line(name, line)
+
+        if on_line is not None:
+            on_line(line)
+
+
+def _signal_process(process, signum):
+    try:
+        if sys.platform == "win32":
+            process.send_signal(signum)
+        else:
+            os.killpg(process.pid, signum)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+async def _terminate(process, kill_cmd):
+    if kill_cmd:
+        # The process is only a client (e.g. docker run), stop the real
+        # worker first.
+        await run_process(kill_cmd, echo=False)
+
+    _signal_process(process, signal.SIGTERM)
+    try:
+        await asyncio.wait_for(process.wait(), KILL_DELAY)
+    except asyncio.TimeoutError:
+        _signal_process(process, getattr(signal, "SIGKILL", signal.SIGTERM))
+        await process.wait()
+
+
+async def run_process(
+    cmd,
+    name=None,
+    timeout=None,
+    on_line=None,
+    echo=True,
+    kill_cmd=None,
+    **kwargs
+):
+    """
+    Run a command and stream its output
+
+    :param cmd: A command line string (executed by shell) or a list of
+    arguments.
+    :param name: Prefix of the echoed lines, usually the project name.
+    :param timeout: Seconds before the process be terminated, None for
+    waiting forever.
+    :param on_line: Callback that receives every output line.
+    :param kill_cmd: Command that must be executed before terminating the
+    process on timeout.
+    :return: A ProcessResult object
+    """
+
+    options = dict(
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+        limit=LINE_LIMIT,
+    )
+    if sys.platform != "win32":
+        # Own process group, so we could terminate the whole tree
+        options["start_new_session"] = True
+    options.update(kwargs)
+
+    started = datetime.datetime.now()
+    if isinstance(cmd, str):
+        process = await asyncio.create_subprocess_shell(cmd, **options)
+    else:
+        process = await asyncio.create_subprocess_exec(*cmd, **options)
+
+    async def communicate():
+        await _read_lines(process.stdout, name, on_line, echo)
+        return await process.wait()
+
+    timed_out = False
+    try:
+        returncode = await asyncio.wait_for(communicate(), timeout)
+    except asyncio.TimeoutError:
+        timed_out = True
+        echo_line(name, "Timeout after %s seconds, terminating ..." % timeout)
+        await _terminate(process, kill_cmd)
+        returncode = process.returncode
+
+    return ProcessResult(
+        name, returncode, timed_out, started, datetime.datetime.now()
+    )
+
+
+async def run_jobs(jobs, concurrency=1, stop_on_error=True):
+    """
+    Run coroutine factories concurrently
+
+    :param jobs: A list of callables, each returns a coroutine that returns
+    an exit code.
+    :param concurrency: Maximum jobs running at the same time.
+    :param stop_on_error: Don't start pending jobs after any job failed.
+    :return: Exit codes in the order of jobs, None for skipped jobs.
+    """
+
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    failed = []
+
+    async def run_one(job):
+        async with semaphore:
+            if stop_on_error and failed:
+                return None
+
+            ret = await job()
+            if ret:
+                failed.append(ret)
+
+            return ret
+
+    return await asyncio.gather(*[run_one(job) for job in jobs])
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+
+"""
+Scheduling of backups into a time window.
+
+Projects are ranked by staleness (time since their newest archive, projects
+never backed up first), their durations are predicted from past manifests
+(see coordinator.predict_duration()). Ranked projects are packed onto the
+workers like they will run: each one goes to the worker that is free first
+if it can finish before the window ends, otherwise it's deferred. Deferred
+projects become the stalest ones of the next run.
+"""
+
+import os
+import os.path
+import json
+import time
+import heapq
+import statistics
+import datetime
+
+SCHEDULE_FILE_NAME = "schedule.json"
+
+# Predicted seconds of projects without any manifest that has a duration
+DEFAULT_DURATION = 3600.0
+
+
+class ScheduleItem(object):
+    """
+    A project to schedule.
+
+    :param staleness: Seconds since the newest archive, None if the project
+    was never backed up.
+    :param predicted: Predicted backup seconds, None if unknown.
+    """
+
+    def __init__(self, name, staleness, predicted, payload=None):
+        self._name = name
+        self._staleness = staleness
+        self._predicted = predicted
+        self._payload = payload
+        self._start = None
+        self._worker = None
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def staleness(self):
+        return self._staleness
+
+    @property
+    def predicted(self):
+        return self._predicted
+
+    @predicted.setter
+    def predicted(self, value):
+        self._predicted = value
+
+    @property
+    def payload(self):
+        return self._payload
+
+    @property
+    def start(self):
+        """Planned start, seconds after the window opened"""
+        return self._start
+
+    @property
+    def worker(self):
+        return self._worker
+
+    def _assign(self, worker, start):
+        self._worker = worker
+        self._start = start
+
+
+class Schedule(object):
+    def __init__(self, window, workers):
+        self._window = window
+        self._workers = workers
+        self._scheduled = []
+        self._deferred = []
+
+    @property
+    def window(self):
+        return self._window
+
+    @property
+    def workers(self):
+        return self._workers
+
+    @property
+    def scheduled(self):
+        """Scheduled items, in the order they start"""
+        return self._scheduled
+
+    @property
+    def deferred(self):
+        return self._deferred
+
+
+def get_staleness(proj_dir, now=None):
+    """
+    Get seconds since the newest archive of a project, None if it has none.
+    """
+
+    from pathlib import Path
+    from .arecabackup import DataInfo
+    from .listing import get_listing
+
+    if not os.path.isdir(str(proj_dir)):
+        return None
+
+    listing = get_listing(proj_dir)
+    if not len(listing.data_archives):
+        return None
+
+    if now is None:
+        now = datetime.datetime.now(datetime.timezone.utc)
+
+    info = DataInfo(Path(listing.data_path(listing.data_archives[-1])))
+    return max(0.0, (now - info.datetime).total_seconds())
+
+
+def _rank_key(item):
+    # Never backed up first, then stalest, shorter ones first on ties
+    if item.staleness is None:
+        return (0, 0.0, item.predicted)
+
+    return (1, -item.staleness, item.predicted)
+
+
+def plan_window(items, window, workers=1, default_duration=None):
+    """
+    Pack items into a window of seconds on workers.
+
+    :param default_duration: Used for items without a prediction, defaults
+    to the median of known predictions (or DEFAULT_DURATION).
+    :return: Schedule
+    """
+
+    known = [i.predicted for i in items if i.predicted is not None]
+    if default_duration is None:
+        if known:
+            default_duration = statistics.median(known)
+        else:
+            default_duration = DEFAULT_DURATION
+
+    for item in items:
+        if item.predicted is None:
+            item.predicted = default_duration
+
+    schedule = Schedule(window, workers)
+
+    # (time a worker is free, worker index)
+    free_at = [(0.0, i) for i in range(max(1, workers))]
+    heapq.heapify(free_at)
+    for item in sorted(items, key=_rank_key):
+        start, worker = free_at[0]
+        if start + item.predicted > window:
+            schedule.deferred.append(item)
+            continue
+
+        heapq.heapreplace(free_at, (start + item.predicted, worker))
+        item._assign(worker, start)
+        schedule.scheduled.append(item)
+
+    schedule.scheduled.sort(key=lambda x: (x.start, x.worker))
+    return schedule
+
+
+class WindowClock(object):
+    """
+    Decide at run time whether a scheduled item still fits, predictions of
+    earlier items could have been too optimistic.
+    """
+
+    def __init__(self, window):
+        self._deadline = time.monotonic() + window
+
+    def remaining(self):
+        return self._deadline - time.monotonic()
+
+    def fits(self, item):
+        return item.predicted <= self.remaining()
+
+
+def get_schedule_path(repository):
+    from .arecabackup import Repository
+
+    return os.path.join(
+        str(repository), Repository.STATE_DIR_NAME, SCHEDULE_FILE_NAME
+    )
+
+
+def load_report(repository):
+    try:
+        with open(get_schedule_path(repository), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return dict()
+
+
+def save_report(repository, schedule, finished, deferred):
+    """
+    Record the outcome of a scheduled run.
+
+    :param finished: Names of backed up projects.
+    :param deferred: Names of deferred projects, in plan or at run time.
+    """
+
+    previous = load_report(repository).get("deferred", dict())
+    now = time.time()
+    report = dict(
+        time=now,
+        window=schedule.window,
+        workers=schedule.workers,
+        finished=sorted(finished),
+        # Since when every project has been deferred
+        deferred=dict((name, previous.get(name, now)) for name in deferred),
+    )
+
+    apath = get_schedule_path(repository)
+    os.makedirs(os.path.dirname(apath), exist_ok=True)
+    temp_path = "%s.%s.tmp" % (apath, os.getpid())
+    with open(temp_path, "w") as f:
+        json.dump(report, f, indent=1, sort_keys=True)
+    os.replace(temp_path, apath)
+    return report
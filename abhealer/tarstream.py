@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+"""
+Streaming of a recovered project as a PAX tar.
+
+Areca only extracts into a directory, so the project is recovered into a
+staging directory first. The tree is then written in one pass to a tar
+stream (a file, a pipe or stdout) which is never seeked. Modes, owners and
+groups of directories and symbolic links, and the targets of links, are
+taken from the trace like recover_dirs applies them, so they are right even
+when the staged copy couldn't be chowned.
+"""
+
+import os
+import os.path
+import stat
+import shutil
+import tarfile
+
+from .restore import parse_entries, resolve_link_targets
+
+# Bigger blocks than the default 10 KB records for pipes and compressors
+BUFFER_SIZE = 1024 * 1024
+
+
+class TarStats(object):
+    def __init__(self):
+        self._files = 0
+        self._bytes = 0
+
+    @property
+    def files(self):
+        return self._files
+
+    @property
+    def bytes(self):
+        return self._bytes
+
+    def add(self, size):
+        self._files += 1
+        self._bytes += size
+
+
+def _apply_entry(info, entry):
+    info.mode = entry.mode
+    info.uname = entry.owner
+    info.gname = entry.group
+
+    try:
+        import pwd
+        import grp
+
+        info.uid = pwd.getpwnam(entry.owner).pw_uid
+        info.gid = grp.getgrnam(entry.group).gr_gid
+    except (ImportError, KeyError):
+        # Names are enough for the extracting side
+        pass
+
+
+def write_tar(fileobj, source_dir, trace_infos, client_source_dir, root=""):
+    """
+    Write a recovered tree to fileobj as a PAX tar stream.
+
+    :param source_dir: The staging directory the project is recovered to.
+    :param client_source_dir: The project's directory seen by the Areca
+    client, links into it become relative.
+    :param root: Name of the top directory in the tar, empty for none.
+    :return: TarStats
+    """
+
+    dirs, links = parse_entries(trace_infos)
+    entries = dict((e.rel_path, e) for e in dirs)
+    entries.update((e.rel_path, e) for e in links)
+    targets = resolve_link_targets(links, client_source_dir)
+
+    source_dir = str(source_dir)
+    stats = TarStats()
+    tar = tarfile.open(
+        fileobj=fileobj,
+        mode="w|",
+        format=tarfile.PAX_FORMAT,
+        bufsize=BUFFER_SIZE,
+    )
+    try:
+        for parent, dirnames, filenames in os.walk(source_dir):
+            dirnames.sort()
+            filenames.sort()
+
+            rel_dir = os.path.relpath(parent, source_dir)
+            if rel_dir == ".":
+                rel_dir = ""
+
+            # Links to directories are listed but not walked into
+            names = dirnames + filenames
+            if not rel_dir and root:
+                names.insert(0, "")
+
+            for name in names:
+                rel_path = os.path.join(rel_dir, name) if name else rel_dir
+                apath = os.path.join(parent, name) if name else parent
+                arcname = "/".join(p for p in (root, rel_path) if p)
+
+                info = tar.gettarinfo(apath, arcname)
+                if info is None:
+                    # Sockets and the like
+                    continue
+
+                entry = entries.get(rel_path.replace(os.sep, "/"), None)
+                if entry is not None:
+                    _apply_entry(info, entry)
+                    if info.issym():
+                        info.linkname = targets[entry.rel_path]
+
+                if info.isreg():
+                    with open(apath, "rb") as f:
+                        tar.addfile(info, f)
+                    stats.add(info.size)
+                else:
+                    tar.addfile(info)
+    finally:
+        tar.close()
+
+    return stats
+
+
+def remove_staging(apath):
+    """
+    Remove a staging directory, recovered directories may be read only.
+    """
+
+    apath = str(apath)
+    for parent, dirnames, _ in os.walk(apath):
+        for name in dirnames:
+            dpath = os.path.join(parent, name)
+            if not os.path.islink(dpath):
+                os.chmod(dpath, os.stat(dpath).st_mode | stat.S_IRWXU)
+
+    shutil.rmtree(apath)
@@ -0,0 +1,490 @@
+# -*- coding: utf-8 -*-
+
+"""
+I/O and CPU throttling of Areca processes.
+
+Limits come from the "limits" (per process) and "total_limits" (shared by
+all processes of a run) config keys, a source could override "limits":
+
+    limits:
+      nice: 10
+      ionice_class: 3
+      read_bps: 50M
+      write_bps: 20M
+      read_iops: 500
+      write_iops: 200
+      cpus: 1.5
+
+They are applied through cgroup v2 (io.max/cpu.max) when the current cgroup
+is delegated to us, otherwise through nice/ionice for local Areca and
+"docker run" options for dockerized Areca. A warning is printed for every
+limit that can't be enforced.
+
+cgroup v2 doesn't let a group with processes enable controllers for its
+children, so abhealer first moves itself into the SELF_CGROUP leaf below the
+current group. That only happens if the group offers the controllers and is
+writable (delegated to us), and it's undone if enabling them fails.
+"""
+
+import os
+import os.path
+import re
+import click
+
+SIZE_UNITS = {"": 1, "k": 1024, "m": 1024**2, "g": 1024**3}
+
+IO_KEYS = ("read_bps", "write_bps", "read_iops", "write_iops")
+IO_MAX_NAMES = {
+    "read_bps": "rbps",
+    "write_bps": "wbps",
+    "read_iops": "riops",
+    "write_iops": "wiops",
+}
+DOCKER_IO_OPTIONS = {
+    "read_bps": "--device-read-bps",
+    "write_bps": "--device-write-bps",
+    "read_iops": "--device-read-iops",
+    "write_iops": "--device-write-iops",
+}
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+CPU_PERIOD = 100000
+
+# Leaf group abhealer moves itself into
+SELF_CGROUP = "abhealer-self"
+CONTROLLERS = ("io", "cpu")
+
+
+def parse_size(value):
+    """
+    Parse sizes like 1024, "512k", "50M" or "1G" into bytes.
+    """
+
+    if isinstance(value, (int, float)):
+        return int(value)
+
+    text = str(value).strip().lower()
+    if text.endswith("b"):
+        text = text[:-1]
+
+    unit = ""
+    if text and text[-1] in SIZE_UNITS:
+        unit = text[-1]
+        text = text[:-1]
+
+    try:
+        return int(float(text) * SIZE_UNITS[unit])
+    except ValueError:
+        raise click.UsageError("Invalid size : %s" % value)
+
+
+class Limits(object):
+    def __init__(self, values=None):
+        values = dict(values or dict())
+
+        self._nice = values.pop("nice", None)
+        self._ionice_class = values.pop("ionice_class", None)
+        self._ionice_level = values.pop("ionice_level", None)
+        self._cpus = values.pop("cpus", None)
+        if self._cpus is not None:
+            self._cpus = float(self._cpus)
+
+        self._io = dict()
+        for key in IO_KEYS:
+            value = values.pop(key, None)
+            if value is not None:
+                self._io[key] = parse_size(value)
+
+        if values:
+            raise click.UsageError(
+                "Unknown limits : %s" % ", ".join(sorted(values.keys()))
+            )
+
+    @property
+    def nice(self):
+        return self._nice
+
+    @property
+    def ionice_class(self):
+        return self._ionice_class
+
+    @property
+    def ionice_level(self):
+        return self._ionice_level
+
+    @property
+    def cpus(self):
+        return self._cpus
+
+    @property
+    def io(self):
+        """Mapping of IO_KEYS to their limits"""
+        return self._io
+
+    def __bool__(self):
+        return bool(
+            self._io
+            or (self._cpus is not None)
+            or (self._nice is not None)
+            or (self._ionice_class is not None)
+        )
+
+    def combine(self, other):
+        """
+        Get the tighter limits of both.
+        """
+
+        combined = Limits()
+        for name in ("_nice", "_ionice_class", "_ionice_level"):
+            value = getattr(other, name)
+            if value is None:
+                value = getattr(self, name)
+            setattr(combined, name, value)
+
+        cpus = [v for v in (self._cpus, other._cpus) if v is not None]
+        combined._cpus = min(cpus) if cpus else None
+
+        for key in IO_KEYS:
+            values = [
+                v
+                for v in (self._io.get(key, None), other._io.get(key, None))
+                if v is not None
+            ]
+            if values:
+                combined._io[key] = min(values)
+
+        return combined
+
+    def split(self, count):
+        """
+        Get a share of the limits for one of count processes.
+        """
+
+        count = max(1, int(count))
+        shared = Limits()
+        shared._cpus = None if self._cpus is None else self._cpus / count
+        shared._io = dict((k, max(1, v // count)) for k, v in self._io.items())
+        return shared
+
+
+def get_disk_device(apath):
+    """
+    Get ("major:minor", "/dev/name") of the whole disk that holds apath,
+    (None, None) if unknown.
+
+    io.max and docker's --device-* options don't accept partitions.
+    """
+
+    try:
+        st_dev = os.stat(str(apath)).st_dev
+    except OSError:
+        return (None, None)
+
+    sys_path = "/sys/dev/block/%s:%s" % (os.major(st_dev), os.minor(st_dev))
+    if not os.path.exists(sys_path):
+        return (None, None)
+
+    sys_path = os.path.realpath(sys_path)
+    if os.path.exists(os.path.join(sys_path, "partition")):
+        sys_path = os.path.dirname(sys_path)
+
+    try:
+        with open(os.path.join(sys_path, "dev"), "r") as f:
+            dev = f.read().strip()
+    except OSError:
+        return (None, None)
+
+    return (dev, "/dev/%s" % os.path.basename(sys_path))
+
+
+def _get_devices(paths):
+    devices = []
+    for apath in paths:
+        device = get_disk_device(apath)
+        if (device[0] is not None) and (device not in devices):
+            devices.append(device)
+
+    return devices
+
+
+def gen_local_prefix(limits):
+    """
+    Generate nice/ionice command prefix for local Areca
+    """
+
+    from whichcraft import which
+
+    prefix = ""
+    if (limits.nice is not None) and which("nice"):
+        prefix += "nice -n %s " % int(limits.nice)
+
+    if (limits.ionice_class is not None) and which("ionice"):
+        prefix += "ionice -c %s " % int(limits.ionice_class)
+        if limits.ionice_level is not None:
+            prefix += "-n %s " % int(limits.ionice_level)
+
+    return prefix
+
+
+def gen_docker_options(limits, paths):
+    """
+    Generate "docker run" options that apply limits to the devices of paths
+    """
+
+    options = ""
+    if limits.cpus is not None:
+        options += " --cpus %s " % limits.cpus
+
+    for _, device in _get_devices(paths):
+        for key, value in sorted(limits.io.items()):
+            options += " %s %s:%s " % (DOCKER_IO_OPTIONS[key], device, value)
+
+    return options
+
+
+def _get_current_cgroup():
+    try:
+        with open("/proc/self/cgroup", "r") as f:
+            for line in f:
+                # cgroup v2 only has the "0::<path>" entry
+                if line.startswith("0::"):
+                    return os.path.join(
+                        CGROUP_ROOT, line[3:].strip().lstrip("/")
+                    )
+    except OSError:
+        pass
+
+    return None
+
+
+def _write(apath, value):
+    with open(apath, "w") as f:
+        f.write(value)
+
+
+def get_cgroup_name(name):
+    """
+    Get a cgroup directory name, dots would clash with interface files.
+    """
+
+    return re.sub(r"[^a-zA-Z0-9_-]", "_", name)
+
+
+def _is_delegated(cgroup_path):
+    """
+    Check the group offers our controllers and we could manage it.
+    """
+
+    try:
+        with open(os.path.join(cgroup_path, "cgroup.controllers"), "r") as f:
+            available = f.read().split()
+    except OSError:
+        return False
+
+    if any(x not in available for x in CONTROLLERS):
+        return False
+
+    return all(
+        os.access(os.path.join(cgroup_path, x), os.W_OK)
+        for x in ("", "cgroup.procs", "cgroup.subtree_control")
+    )
+
+
+def _enable_controllers(cgroup_path):
+    _write(
+        os.path.join(cgroup_path, "cgroup.subtree_control"),
+        " ".join("+%s" % x for x in CONTROLLERS),
+    )
+
+
+def _enable_below_self(cgroup_path):
+    """
+    Move this process into a leaf below cgroup_path and enable controllers
+    for the children of cgroup_path. Undone if the controllers are refused.
+    """
+
+    pid = str(os.getpid())
+    leaf_path = os.path.join(cgroup_path, SELF_CGROUP)
+    created = not os.path.exists(leaf_path)
+    os.makedirs(leaf_path, exist_ok=True)
+    try:
+        _write(os.path.join(leaf_path, "cgroup.procs"), pid)
+        _enable_controllers(cgroup_path)
+    except OSError:
+        try:
+            _write(os.path.join(cgroup_path, "cgroup.procs"), pid)
+            if created:
+                os.rmdir(leaf_path)
+        except OSError:
+            pass
+        raise
+
+
+class Cgroup(object):
+    """
+    A cgroup v2 group created below the current one, None if we are not
+    allowed to.
+    """
+
+    def __init__(self, apath):
+        self._path = apath
+
+    @classmethod
+    def create(cls, name, parent=None):
+        try:
+            if parent is None:
+                parent_path = _get_current_cgroup()
+                if (parent_path is None) or not _is_delegated(parent_path):
+                    return None
+
+                _enable_below_self(parent_path)
+            else:
+                parent_path = parent.path
+                _enable_controllers(parent_path)
+
+            apath = os.path.join(parent_path, get_cgroup_name(name))
+            os.makedirs(apath, exist_ok=True)
+        except OSError:
+            return None
+
+        return cls(apath)
+
+    @property
+    def path(self):
+        return self._path
+
+    def apply(self, limits, paths):
+        """
+        Write limits, returns False if the controllers refused them.
+        """
+
+        try:
+            lines = []
+            for dev, _ in _get_devices(paths):
+                line = " ".join(
+                    "%s=%s" % (IO_MAX_NAMES[k], v)
+                    for k, v in sorted(limits.io.items())
+                )
+                if line:
+                    lines.append("%s %s" % (dev, line))
+
+            for line in lines:
+                _write(os.path.join(self._path, "io.max"), line)
+
+            if limits.cpus is not None:
+                _write(
+                    os.path.join(self._path, "cpu.max"),
+                    "%s %s" % (int(limits.cpus * CPU_PERIOD), CPU_PERIOD),
+                )
+        except OSError:
+            return False
+
+        return True
+
+    def gen_preexec_fn(self):
+        """
+        Generate a function that moves the child process into this group
+        before it executes.
+        """
+
+        procs_path = os.path.join(self._path, "cgroup.procs")
+
+        def preexec_fn():
+            _write(procs_path, str(os.getpid()))
+
+        return preexec_fn
+
+    def remove(self):
+        try:
+            os.rmdir(self._path)
+        except OSError:
+            pass
+
+
+def _warn(message):
+    click.echo("Warning : %s" % message, err=True)
+
+
+def _warn_unenforced(name, unenforced):
+    if unenforced:
+        _warn("%s not enforced for %s" % (", ".join(unenforced), name))
+
+
+class Throttle(object):
+    """
+    Throttling of all Areca processes of a run.
+    """
+
+    def __init__(self, total_limits=None, jobs=1):
+        self._total_limits = total_limits or Limits()
+        self._jobs = jobs
+        self._parent = None
+        self._use_cgroup = None
+
+    def _prepare_parent(self, paths):
+        if self._use_cgroup is not None:
+            return
+
+        self._parent = Cgroup.create("abhealer-%s" % os.getpid())
+        self._use_cgroup = self._parent is not None
+        if self._use_cgroup and self._total_limits:
+            self._use_cgroup = self._parent.apply(self._total_limits, paths)
+
+        if self._total_limits and not self._use_cgroup:
+            _warn("total_limits are not enforced, cgroup v2 is not available")
+
+    def prepare(self, name, limits, paths, is_dockerized):
+        """
+        Prepare throttling of one Areca process.
+
+        :return: (command prefix, docker options, subprocess options,
+        cleanup function)
+        """
+
+        if is_dockerized:
+            # Docker manages its own cgroups, give every process its share
+            limits = limits.combine(self._total_limits.split(self._jobs))
+            unenforced = []
+            if (limits.nice is not None) or (limits.ionice_class is not None):
+                unenforced.append("nice/ionice")
+            if limits.io and not _get_devices(paths):
+                unenforced.append("I/O limits (unknown devices)")
+            _warn_unenforced(name, unenforced)
+
+            return ("", gen_docker_options(limits, paths), dict(), None)
+
+        from whichcraft import which
+
+        prefix = gen_local_prefix(limits)
+        unenforced = []
+        if (limits.nice is not None) and not which("nice"):
+            unenforced.append("nice")
+        if (limits.ionice_class is not None) and not which("ionice"):
+            unenforced.append("ionice")
+
+        self._prepare_parent(paths)
+        if self._use_cgroup:
+            group = Cgroup.create(name, self._parent)
+            if (group is not None) and group.apply(limits, paths):
+                if limits.io and not _get_devices(paths):
+                    unenforced.append("I/O limits (unknown devices)")
+                _warn_unenforced(name, unenforced)
+
+                return (
+                    prefix,
+                    "",
+                    dict(preexec_fn=group.gen_preexec_fn()),
+                    group.remove,
+                )
+
+        if limits.io or (limits.cpus is not None):
+            unenforced.append(
+                "I/O and CPU limits (cgroup v2 is not available)"
+            )
+        _warn_unenforced(name, unenforced)
+
+        return (prefix, "", dict(), None)
+
+    def close(self):
+        if self._parent is not None:
+            self._parent.remove()
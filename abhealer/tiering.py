@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+
+"""
+Hot/cold tiers of archive storage.
+
+Old archives ("<archive>" and "<archive>_data" directories) are moved from a
+project directory (the hot tier) to "<cold dir>/<repository id>/<project>/"
+and replaced by symbolic links, so Areca and abhealer still find every
+archive in the project directory while the hot tier only keeps recent ones.
+
+Several repositories could share a cold dir, the repository id (kept in the
+repository's state directory) separates their projects. Cold copies are only
+ever removed below the project's own cold directory.
+
+A directory is replaced in two steps: it's renamed to a pending name with
+TIER_SUFFIX, then the link takes its place. recover_interrupted() finishes
+or rolls back whatever an interrupted run left behind, before anything
+could mistake a half tiered archive for a damaged one.
+"""
+
+import os
+import os.path
+import uuid
+import shutil
+import datetime
+
+from .listing import get_listing
+
+TIER_SUFFIX = ".abhealer-tier"
+REPOSITORY_ID_FILE_NAME = "repository-id"
+
+
+class TierResult(object):
+    def __init__(self):
+        self._moved = []
+        self._pruned = []
+
+    @property
+    def moved(self):
+        """Names of archives moved to the cold tier"""
+        return self._moved
+
+    @property
+    def pruned(self):
+        """Cold directories removed since their links were gone"""
+        return self._pruned
+
+
+def get_repository_id(repository):
+    """
+    Get the id of a repository, created on first use.
+    """
+
+    from .arecabackup import Repository
+
+    state_dir = os.path.join(str(repository), Repository.STATE_DIR_NAME)
+    apath = os.path.join(state_dir, REPOSITORY_ID_FILE_NAME)
+    os.makedirs(state_dir, exist_ok=True)
+    try:
+        # Exclusive creation, a concurrent run could create it too
+        with open(apath, "x") as f:
+            f.write(uuid.uuid4().hex)
+    except FileExistsError:
+        pass
+
+    with open(apath, "r") as f:
+        return f.read().strip()
+
+
+def get_cold_proj_dir(proj_dir, cold_dir):
+    proj_dir = os.path.realpath(str(proj_dir))
+    return os.path.join(
+        os.path.realpath(str(cold_dir)),
+        get_repository_id(os.path.dirname(proj_dir)),
+        os.path.basename(proj_dir),
+    )
+
+
+def is_cold_copy(proj_dir, target):
+    """
+    Check target is an archive directory in the cold tier of the project.
+    """
+
+    proj_dir = os.path.realpath(str(proj_dir))
+    cold_proj_dir = os.path.dirname(target)
+    return (
+        os.path.basename(cold_proj_dir) == os.path.basename(proj_dir)
+    ) and (
+        os.path.basename(os.path.dirname(cold_proj_dir))
+        == get_repository_id(os.path.dirname(proj_dir))
+    )
+
+
+def remove_archive_dir(apath):
+    """
+    Remove an archive directory of a project, with its cold copy if it is a
+    link to the project's cold tier. Targets of other links are kept.
+    """
+
+    apath = str(apath)
+    if os.path.islink(apath):
+        target = os.path.realpath(apath)
+        os.unlink(apath)
+        if is_cold_copy(os.path.dirname(apath), target):
+            shutil.rmtree(target, ignore_errors=True)
+    else:
+        shutil.rmtree(apath, ignore_errors=True)
+
+
+def get_cold_roots(proj_dir):
+    """
+    Get directories that links of a project point into, they must be
+    visible at the same paths for Areca (e.g. mounted into Docker).
+    """
+
+    listing = get_listing(proj_dir)
+    roots = set()
+    for num in listing.cold_archives:
+        for apath in (listing.archive_path(num), listing.data_path(num)):
+            if os.path.islink(apath):
+                roots.add(os.path.dirname(os.path.realpath(apath)))
+
+    return sorted(roots)
+
+
+def gen_docker_cold_options(proj_dir):
+    """
+    Generate Docker volume options for the cold roots of a project, every
+    container that reads its archives needs them.
+    """
+
+    options = ""
+    for cold_root in get_cold_roots(proj_dir):
+        options += " -v %s:%s " % (cold_root, cold_root)
+    return options
+
+
+def recover_interrupted(proj_dir):
+    """
+    Clean up pending directories of an interrupted tiering run.
+    """
+
+    proj_dir = str(proj_dir)
+    changed = False
+    for entry in os.scandir(proj_dir):
+        if not entry.name.endswith(TIER_SUFFIX):
+            continue
+
+        end = len(entry.name) - len(TIER_SUFFIX)
+        apath = os.path.join(proj_dir, entry.name[:end])
+        if os.path.lexists(apath):
+            # The link is in place already
+            shutil.rmtree(entry.path, ignore_errors=True)
+        else:
+            os.rename(entry.path, apath)
+        changed = True
+
+    if changed:
+        get_listing(proj_dir).invalidate()
+
+
+def _copy_dir(src, dst):
+    """
+    Move a directory into the cold tier, through a pending name so a
+    partial copy is never taken for an archive.
+    """
+
+    pending = dst + TIER_SUFFIX
+    for apath in (pending, dst):
+        if os.path.lexists(apath):
+            shutil.rmtree(apath)
+
+    try:
+        shutil.copytree(src, pending, symlinks=True)
+    except BaseException:
+        shutil.rmtree(pending, ignore_errors=True)
+        raise
+
+    os.rename(pending, dst)
+
+
+def _replace_with_link(apath, target):
+    pending = apath + TIER_SUFFIX
+    os.rename(apath, pending)
+    os.symlink(target, apath)
+    shutil.rmtree(pending)
+
+
+def move_archive(proj_dir, num, cold_proj_dir):
+    """
+    Move one archive of a project into cold_proj_dir and link it back.
+    """
+
+    listing = get_listing(proj_dir)
+    os.makedirs(cold_proj_dir, exist_ok=True)
+
+    for apath in (listing.archive_path(num), listing.data_path(num)):
+        if os.path.islink(apath):
+            continue
+
+        target = os.path.join(cold_proj_dir, os.path.basename(apath))
+        _copy_dir(apath, target)
+        _replace_with_link(apath, target)
+
+    listing.invalidate()
+
+
+def prune_cold(proj_dir, cold_proj_dir):
+    """
+    Remove cold directories that no link of the project points to anymore,
+    e.g. after Areca merged their archives.
+    """
+
+    if not os.path.isdir(cold_proj_dir):
+        return []
+
+    linked = set()
+    for entry in os.scandir(str(proj_dir)):
+        if entry.is_symlink():
+            linked.add(os.path.realpath(entry.path))
+
+    pruned = []
+    for entry in os.scandir(cold_proj_dir):
+        if entry.is_dir(follow_symlinks=False) and (
+            os.path.realpath(entry.path) not in linked
+        ):
+            shutil.rmtree(entry.path)
+            pruned.append(entry.name)
+
+    return sorted(pruned)
+
+
+def plan_project(proj_dir, older_than, now=None):
+    """
+    Get numbers of hot archives older than older_than (a timedelta), the
+    newest archive always stays hot since incremental backups read it.
+    """
+
+    from pathlib import Path
+    from .arecabackup import DataInfo
+
+    listing = get_listing(proj_dir)
+    # Archive names are in local time
+    if now is None:
+        now = datetime.datetime.now()
+
+    candidates = []
+    for num in listing.data_archives[:-1]:
+        if os.path.islink(listing.archive_path(num)) and os.path.islink(
+            listing.data_path(num)
+        ):
+            continue
+
+        info = DataInfo(Path(listing.data_path(num)))
+        if now - info.local_datetime >= older_than:
+            candidates.append(num)
+
+    return candidates
+
+
+def tier_project(proj_dir, cold_dir, older_than, dry_run=False, now=None):
+    """
+    Move old archives of a project to the cold tier.
+
+    :param cold_dir: Root of the cold tier, archives are moved to
+    "<cold_dir>/<repository id>/<project name>".
+    :return: TierResult
+    """
+
+    proj_dir = os.path.realpath(str(proj_dir))
+    cold_proj_dir = get_cold_proj_dir(proj_dir, cold_dir)
+    listing = get_listing(proj_dir)
+    result = TierResult()
+
+    if not dry_run:
+        recover_interrupted(proj_dir)
+
+    for num in plan_project(proj_dir, older_than, now):
+        result.moved.append(listing.name_of(num))
+        if not dry_run:
+            move_archive(proj_dir, num, cold_proj_dir)
+
+    if not dry_run:
+        result.pruned.extend(prune_cold(proj_dir, cold_proj_dir))
+
+    return result
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+"""
+Parallel decoding of archive traces.
+
+Decompressing and splitting the trace of every archive is CPU bound, a
+history of many archives is decoded by a process pool. Each worker takes a
+contiguous batch of archives and merges their entries (newer archives
+override older ones, like the serial loop did), then sends them back as
+two "\\n" joined strings of keys and lines: pickling two big strings is
+much cheaper than millions of small lists. The parent merges the batches in
+archive order and only splits the lines that are left into fields.
+
+Small histories are decoded in the calling process, a pool costs more than
+it saves there. Workers are started by a fork server (or spawned), forking
+a process that runs an event loop and threads is not safe.
+"""
+
+import os
+import os.path
+import collections
+import multiprocessing
+import concurrent.futures
+
+# Archives below which traces are decoded without a pool
+MIN_PARALLEL = 8
+
+# Batches per worker, a few keep workers busy when traces differ in size
+BATCHES_PER_JOB = 4
+
+# Traces in flight per worker, decoded keys wait in memory until consumed
+PENDING_PER_JOB = 2
+
+
+def read_trace_lines(data_dir):
+    """
+    Get entry lines of the trace of an archive, comments and blank lines
+    are dropped.
+    """
+
+    from .zipview import read_gzip_member
+
+    data = read_gzip_member(os.path.join(str(data_dir), "trace"), "trace")
+    lines = []
+    for aline in data.decode().splitlines():
+        aline = aline.strip()
+        if aline and not aline.startswith("#"):
+            lines.append(aline)
+
+    return lines
+
+
+def _key_of(aline):
+    end = aline.find(";")
+    return aline if end < 0 else aline[:end]
+
+
+def _decode_batch(data_dirs):
+    """
+    Merge traces of a batch of archives, executed in worker processes.
+
+    :return: (keys, lines), both joined by "\\n" and in the same order.
+    """
+
+    merged = dict()
+    for data_dir in data_dirs:
+        for aline in read_trace_lines(data_dir):
+            merged[_key_of(aline)] = aline
+
+    return ("\n".join(merged.keys()), "\n".join(merged.values()))
+
+
+def _decode_keys(data_dir):
+    """
+    Get "\\n" joined keys of one trace, executed in worker processes.
+    """
+
+    return "\n".join(_key_of(aline) for aline in read_trace_lines(data_dir))
+
+
+def _to_keys(keys):
+    return [(k[1:], k[0]) for k in keys.split("\n") if k]
+
+
+def _split_batches(items, count):
+    size = max(1, -(-len(items) // count))
+    batches = []
+    for i in range(0, len(items), size):
+        end = i + size
+        batches.append(items[i:end])
+
+    return batches
+
+
+def _get_jobs(jobs):
+    return jobs or os.cpu_count() or 1
+
+
+def _create_executor(jobs):
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+    else:
+        context = multiprocessing.get_context("spawn")
+
+    return concurrent.futures.ProcessPoolExecutor(jobs, mp_context=context)
+
+
+def load_trace_infos(data_dirs, jobs=None):
+    """
+    Load traces of archives (oldest first) into a dict of key -> fields,
+    entries of newer archives override older ones.
+    """
+
+    data_dirs = [str(x) for x in data_dirs]
+    jobs = _get_jobs(jobs)
+
+    merged = dict()
+    if (jobs <= 1) or (len(data_dirs) < MIN_PARALLEL):
+        for data_dir in data_dirs:
+            for aline in read_trace_lines(data_dir):
+                merged[_key_of(aline)] = aline
+    else:
+        batches = _split_batches(data_dirs, jobs * BATCHES_PER_JOB)
+        with _create_executor(jobs) as executor:
+            # map() returns results in the order of batches
+            for keys, lines in executor.map(_decode_batch, batches):
+                if keys or lines:
+                    merged.update(zip(keys.split("\n"), lines.split("\n")))
+
+    return dict((k, v.split(";")) for k, v in merged.items())
+
+
+def iter_trace_keys(data_dirs, jobs=None):
+    """
+    Yield (path, type) lists of the traces of archives, in their order.
+    """
+
+    data_dirs = [str(x) for x in data_dirs]
+    jobs = _get_jobs(jobs)
+
+    if (jobs <= 1) or (len(data_dirs) < MIN_PARALLEL):
+        for data_dir in data_dirs:
+            yield _to_keys(_decode_keys(data_dir))
+        return
+
+    executor = _create_executor(jobs)
+    futures = collections.deque()
+    remaining = iter(data_dirs)
+    try:
+        while True:
+            for data_dir in remaining:
+                futures.append(executor.submit(_decode_keys, data_dir))
+                if len(futures) >= jobs * PENDING_PER_JOB:
+                    break
+
+            if not futures:
+                break
+
+            yield _to_keys(futures.popleft().result())
+    finally:
+        # The consumer may stop early
+        for future in futures:
+            future.cancel()
+        executor.shutdown()
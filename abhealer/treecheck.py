@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+
+"""
+Verification of a recovered tree against the trace of its archive.
+
+The trace of an archive lists every file, directory and symbolic link of
+the project at backup time. Directories of the recovered tree are scanned
+by a thread pool (os.scandir() releases the GIL while it waits on the
+disk), each scanned entry is compared with its trace entry and removed from
+the expected ones, whatever is left afterwards is missing.
+"""
+
+import os
+import os.path
+import stat
+import concurrent.futures
+
+from .restore import resolve_link_targets, TraceEntry
+
+# Files that abhealer adds to every backup
+IGNORED_NAMES = (".areca-empty",)
+
+TYPE_NAMES = dict(f="file", d="directory", s="symbolic link")
+
+
+class Expected(object):
+    """
+    An entry of the trace, size and metadata are None if not recorded.
+    """
+
+    __slots__ = ("type", "size", "mode", "owner", "group")
+
+    def __init__(self, key, infos):
+        self.type = key[0]
+        self.size = None
+        self.mode = None
+        self.owner = None
+        self.group = None
+
+        if self.type == "f":
+            try:
+                self.size = int(infos[1].split("-")[0])
+            except (IndexError, ValueError):
+                pass
+
+        # Metadata are the last fields of all entry types
+        if len(infos) >= 5:
+            try:
+                self.mode = int(infos[-3]) & 0o777
+            except ValueError:
+                return
+            self.owner = infos[-2]
+            self.group = infos[-1]
+
+
+class Mismatch(object):
+    def __init__(self, rel_path, what, expected=None, actual=None):
+        self._rel_path = rel_path
+        self._what = what
+        self._expected = expected
+        self._actual = actual
+
+    @property
+    def rel_path(self):
+        return self._rel_path
+
+    @property
+    def what(self):
+        return self._what
+
+    def __str__(self):
+        if self._expected is None:
+            return "%s : %s" % (self._rel_path, self._what)
+
+        return "%s : %s, expected %s, got %s" % (
+            self._rel_path,
+            self._what,
+            self._expected,
+            self._actual,
+        )
+
+
+def parse_expected(trace_infos):
+    """
+    Get a dict of relative path -> Expected from trace infos.
+    """
+
+    expected = dict()
+    for key, infos in trace_infos.items():
+        if key[:1] not in TYPE_NAMES:
+            continue
+
+        rel_path = key[1:].strip("/")
+        if rel_path:
+            expected[rel_path] = Expected(key, infos)
+
+    return expected
+
+
+def _scan_dir(apath, rel_dir):
+    """
+    List a directory, executed in worker threads.
+
+    :return: [(relative path, os.stat_result, link target or None) ...]
+    """
+
+    results = []
+    with os.scandir(apath) as it:
+        for entry in it:
+            rel_path = rel_dir + entry.name if rel_dir else entry.name
+            st = entry.stat(follow_symlinks=False)
+            link = None
+            if stat.S_ISLNK(st.st_mode):
+                link = os.readlink(entry.path)
+            results.append((rel_path, st, link))
+
+    return results
+
+
+class _NameCache(object):
+    def __init__(self):
+        self._users = dict()
+        self._groups = dict()
+
+    def user(self, uid):
+        name = self._users.get(uid, None)
+        if name is None:
+            try:
+                import pwd
+
+                name = pwd.getpwuid(uid).pw_name
+            except (ImportError, KeyError):
+                name = str(uid)
+            self._users[uid] = name
+
+        return name
+
+    def group(self, gid):
+        name = self._groups.get(gid, None)
+        if name is None:
+            try:
+                import grp
+
+                name = grp.getgrgid(gid).gr_name
+            except (ImportError, KeyError):
+                name = str(gid)
+            self._groups[gid] = name
+
+        return name
+
+
+def _get_type(st):
+    if stat.S_ISLNK(st.st_mode):
+        return "s"
+    elif stat.S_ISDIR(st.st_mode):
+        return "d"
+    elif stat.S_ISREG(st.st_mode):
+        return "f"
+
+    return None
+
+
+def check_tree(root, trace_infos, client_source_dir, jobs=None, owners=True):
+    """
+    Compare a recovered tree with the trace of its archive.
+
+    :param client_source_dir: The project's directory seen by the Areca
+    client, to know the relative targets of symbolic links.
+    :param owners: Also compare owners and groups, which are only restored
+    when running as root.
+    Yields Mismatch.
+    """
+
+    root = str(root)
+    expected = parse_expected(trace_infos)
+    links = [
+        TraceEntry(k, v)
+        for k, v in trace_infos.items()
+        if k.startswith("s") and k[1:].strip("/")
+    ]
+    targets = resolve_link_targets(links, client_source_dir)
+    names = _NameCache()
+
+    if jobs is None:
+        jobs = min(32, (os.cpu_count() or 1) * 4)
+
+    with concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+        pending = set([executor.submit(_scan_dir, root, "")])
+        while pending:
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                try:
+                    results = future.result()
+                except OSError as e:
+                    yield Mismatch(
+                        os.path.relpath(e.filename or root, root),
+                        "unreadable (%s)" % e.strerror,
+                    )
+                    continue
+
+                for rel_path, st, link in results:
+                    atype = _get_type(st)
+                    if atype == "d":
+                        pending.add(
+                            executor.submit(
+                                _scan_dir,
+                                os.path.join(root, rel_path),
+                                rel_path + "/",
+                            )
+                        )
+
+                    item = expected.pop(rel_path, None)
+                    if item is None:
+                        if os.path.basename(rel_path) not in IGNORED_NAMES:
+                            yield Mismatch(rel_path, "not in the trace")
+                        continue
+
+                    for mismatch in _compare(
+                        rel_path, item, atype, st, link, targets, names, owners
+                    ):
+                        yield mismatch
+
+    for rel_path in sorted(expected.keys()):
+        yield Mismatch(
+            rel_path, "missing %s" % TYPE_NAMES[expected[rel_path].type]
+        )
+
+
+def _compare(rel_path, item, atype, st, link, targets, names, owners):
+    if atype != item.type:
+        yield Mismatch(
+            rel_path,
+            "type",
+            TYPE_NAMES[item.type],
+            TYPE_NAMES.get(atype, "special file"),
+        )
+        return
+
+    if (item.size is not None) and (atype == "f"):
+        if st.st_size != item.size:
+            yield Mismatch(rel_path, "size", item.size, st.st_size)
+
+    if atype == "s":
+        target = targets.get(rel_path, None)
+        if (target is not None) and (link != target):
+            yield Mismatch(rel_path, "link target", target, link)
+    elif (item.mode is not None) and ((st.st_mode & 0o777) != item.mode):
+        yield Mismatch(
+            rel_path, "mode", oct(item.mode), oct(st.st_mode & 0o777)
+        )
+
+    if owners and (item.owner is not None):
+        owner = names.user(st.st_uid)
+        group = names.group(st.st_gid)
+        if (owner, group) != (item.owner, item.group):
+            yield Mismatch(
+                rel_path,
+                "owner",
+                "%s:%s" % (item.owner, item.group),
+                "%s:%s" % (owner, group),
+            )
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+
+"""
+Autotuning of Areca medium settings per project.
+
+A random subset of every source's files is probed in a process pool: a
+slice of each file is compressed with zlib at several levels, results are
+weighted by file sizes. Projects whose data doesn't compress (media,
+archives) get file_compression disabled, others the lowest zip level that
+is close to level 9. The transaction size follows the archive sizes
+recorded in previous manifests.
+
+The archive format (file_compression and zip_level) is only chosen for
+projects without archives, later runs keep it, so every archive of a project
+is written and recovered with the same format.
+
+Results are saved in ".abhealer/tuning.json" of the repository and used
+by backups and recoveries for values that the YAML config doesn't set.
+"""
+
+import os
+import os.path
+import json
+import time
+import zlib
+import random
+import statistics
+import concurrent.futures
+
+TUNING_FILE_NAME = "tuning.json"
+
+PROBE_LEVELS = (1, 6, 9)
+PROBE_BYTES = 256 * 1024
+
+# Compressed to raw ratio above which compression isn't worth it
+INCOMPRESSIBLE_RATIO = 0.95
+
+# A lower zip level is chosen if its result is within this ratio of level 9
+LEVEL_TOLERANCE = 0.02
+
+# Transaction sizes (KB): at least the default, about a tenth of an archive
+MIN_TRANSACTION_SIZE = 51200
+MAX_TRANSACTION_SIZE = 1024 * 1024
+TRANSACTION_FRACTION = 10
+
+# Settings that archives are written with, fixed once a project has any
+FORMAT_KEYS = ("file_compression", "zip_level")
+
+ARCHIVE_SIZE_KEY = "Archive size"
+MANIFEST_HISTORY = 5
+
+
+def get_tuning_path(repository):
+    from .arecabackup import Repository
+
+    return os.path.join(
+        str(repository), Repository.STATE_DIR_NAME, TUNING_FILE_NAME
+    )
+
+
+def load_tuning(repository):
+    """
+    Get tuned settings of all projects: project name -> settings
+    """
+
+    try:
+        with open(get_tuning_path(repository), "r") as f:
+            return json.load(f).get("projects", dict())
+    except (OSError, ValueError):
+        return dict()
+
+
+def save_tuning(repository, projects):
+    apath = get_tuning_path(repository)
+    os.makedirs(os.path.dirname(apath), exist_ok=True)
+
+    temp_path = "%s.%s.tmp" % (apath, os.getpid())
+    with open(temp_path, "w") as f:
+        json.dump(dict(projects=projects), f, indent=1, sort_keys=True)
+    os.replace(temp_path, apath)
+
+
+def sample_files(src_path, count, seed=None):
+    """
+    Pick up to count regular files (path, size) of a tree with reservoir
+    sampling, so the tree is walked once without keeping all paths.
+    """
+
+    rnd = random.Random(seed)
+    samples = []
+    seen = 0
+    for parent, _, filenames in os.walk(str(src_path)):
+        for filename in filenames:
+            apath = os.path.join(parent, filename)
+            if os.path.islink(apath) or not os.path.isfile(apath):
+                continue
+
+            seen += 1
+            if len(samples) < count:
+                samples.append(apath)
+            else:
+                i = rnd.randrange(seen)
+                if i < count:
+                    samples[i] = apath
+
+    result = []
+    for apath in samples:
+        try:
+            result.append((apath, os.path.getsize(apath)))
+        except OSError:
+            pass
+
+    return result
+
+
+def probe_file(apath, size):
+    """
+    Compress a slice from the middle of a file, executed in worker
+    processes.
+
+    :return: (slice bytes, {level: compressed bytes}), None if unreadable.
+    """
+
+    try:
+        with open(apath, "rb") as f:
+            f.seek(max(0, size // 2 - PROBE_BYTES // 2))
+            data = f.read(PROBE_BYTES)
+    except OSError:
+        return None
+
+    if not data:
+        return None
+
+    return (
+        len(data),
+        dict(
+            (level, len(zlib.compress(data, level))) for level in PROBE_LEVELS
+        ),
+    )
+
+
+class ProbeResult(object):
+    """
+    Compressibility of a source, ratios are weighted by file sizes.
+    """
+
+    def __init__(self):
+        self._weight = 0
+        self._ratios = dict((level, 0.0) for level in PROBE_LEVELS)
+        self._files = 0
+
+    def add(self, size, probe):
+        raw, compressed = probe
+        weight = max(size, 1)
+        self._weight += weight
+        self._files += 1
+        for level in PROBE_LEVELS:
+            self._ratios[level] += weight * compressed[level] / raw
+
+    @property
+    def files(self):
+        return self._files
+
+    def ratio(self, level=9):
+        """
+        Compressed / raw bytes at level, 1.0 if nothing was probed.
+        """
+        if not self._weight:
+            return 1.0
+
+        return self._ratios[level] / self._weight
+
+
+def get_archive_sizes(proj_dir):
+    """
+    Get "Archive size" of the newest manifests of a project.
+    """
+
+    from pathlib import Path
+    from .arecabackup import DataInfo
+    from .listing import get_listing
+
+    if not os.path.isdir(str(proj_dir)):
+        return []
+
+    listing = get_listing(proj_dir)
+    sizes = []
+    for num in reversed(listing.data_archives):
+        info = DataInfo(Path(listing.data_path(num)))
+        try:
+            size = info.get_int_property(ARCHIVE_SIZE_KEY)
+        except Exception:
+            size = None
+
+        if size is not None:
+            sizes.append(size)
+
+        if len(sizes) >= MANIFEST_HISTORY:
+            break
+
+    return sizes
+
+
+def has_archives(proj_dir):
+    from .listing import get_listing
+
+    if not os.path.isdir(str(proj_dir)):
+        return False
+
+    return bool(get_listing(proj_dir).data_archives)
+
+
+def choose_settings(probe, archive_sizes, format_=None):
+    """
+    Choose medium settings from the probe result and previous archive sizes.
+
+    :param format_: Tuned FORMAT_KEYS values of a project that has archives,
+    they are kept. None for a project without archives.
+    """
+
+    settings = dict()
+
+    best = probe.ratio(PROBE_LEVELS[-1])
+    if format_ is not None:
+        settings.update(format_)
+    elif (probe.files == 0) or (best > INCOMPRESSIBLE_RATIO):
+        settings["file_compression"] = False
+        settings["zip_level"] = PROBE_LEVELS[-1]
+    else:
+        settings["file_compression"] = True
+        for level in PROBE_LEVELS:
+            if probe.ratio(level) - best <= LEVEL_TOLERANCE:
+                settings["zip_level"] = level
+                break
+
+    transaction_size = MIN_TRANSACTION_SIZE
+    if archive_sizes:
+        size_kb = statistics.median(archive_sizes) / 1024
+        transaction_size = int(size_kb / TRANSACTION_FRACTION) // 1024 * 1024
+        transaction_size = min(
+            MAX_TRANSACTION_SIZE, max(MIN_TRANSACTION_SIZE, transaction_size)
+        )
+    settings["transaction_size"] = transaction_size
+
+    return settings
+
+
+def tune_projects(repository, sources, samples=200, jobs=None, seed=None):
+    """
+    Probe sources and choose their settings.
+
+    :param sources: A list of (project name, source path)
+    Yields (project name, settings, ProbeResult), settings also contain the
+    probed "ratio" and the "time" of tuning.
+    """
+
+    previous = load_tuning(repository)
+    with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+        for project_name, src_path in sources:
+            probe = ProbeResult()
+            files = sample_files(src_path, samples, seed)
+            futures = [
+                (size, executor.submit(probe_file, apath, size))
+                for apath, size in files
+            ]
+            for size, future in futures:
+                result = future.result()
+                if result is not None:
+                    probe.add(size, result)
+
+            proj_dir = os.path.join(str(repository), project_name)
+            format_ = None
+            if has_archives(proj_dir):
+                # Unset keys stay unset, earlier archives used the defaults
+                tuned = previous.get(project_name, dict())
+                format_ = dict(
+                    (k, tuned[k]) for k in FORMAT_KEYS if k in tuned
+                )
+
+            settings = choose_settings(
+                probe, get_archive_sizes(proj_dir), format_
+            )
+            settings["ratio"] = round(probe.ratio(), 4)
+            settings["time"] = time.time()
+            yield (project_name, settings, probe)
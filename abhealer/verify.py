@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+
+"""
+Integrity verification of Areca Backup repositories.
+
+Archives are verified in a process pool. Archives never change once their
+"_data" directory exists, so verified ones are recorded in a state file and
+skipped when the verification is resumed.
+
+Stored files are only checked as zips if the project compresses files (see
+Project.file_compression), zips the user backed up are payload like any
+other file.
+"""
+
+import os
+import json
+import time
+import zlib
+import hashlib
+import zipfile
+import concurrent.futures
+import xml.etree.ElementTree as etree
+from .zipview import ZipView, gunzip_chunks, hash_file
+
+STORED_FILES_KEY = "Stored files"
+
+# Archives submitted to the process pool at once, per job
+PENDING_PER_JOB = 2
+DATA_NAMES = ("trace", "manifest")
+
+
+def _read_data_file(data_dir, name):
+    """
+    Read and decompress a "_data" member, the zip and gzip CRC are checked on
+    the way.
+    """
+
+    with ZipView(os.path.join(data_dir, name)) as zip_view:
+        bad_member = zip_view.testzip()
+        if bad_member is not None:
+            raise zipfile.BadZipfile("Bad CRC of member : %s" % bad_member)
+
+        return gunzip_chunks(zip_view.iter_chunks(name))
+
+
+def verify_archive(archive_dir, data_dir, file_compression):
+    """
+    Verify one archive, executed in worker processes.
+
+    :param file_compression: Whether every stored file is a zip, their CRCs
+    are checked then.
+
+    :return: A dict with "errors" list, stored/found file counts, total bytes
+    and the sha256 digest of the archive contents.
+    """
+
+    errors = []
+    stored_files = None
+
+    for name in DATA_NAMES:
+        try:
+            data = _read_data_file(data_dir, name)
+        except (
+            OSError,
+            EOFError,
+            KeyError,
+            zlib.error,
+            zipfile.BadZipfile,
+        ) as e:
+            errors.append("Broken %s : %s" % (name, e))
+            continue
+
+        if name != "manifest":
+            continue
+
+        try:
+            root = etree.fromstring(data.decode())
+        except (etree.ParseError, UnicodeDecodeError) as e:
+            errors.append("Broken manifest : %s" % e)
+            continue
+
+        for element in root.iter("property"):
+            if element.get("key") == STORED_FILES_KEY:
+                try:
+                    stored_files = int(element.get("value"))
+                except (TypeError, ValueError):
+                    errors.append(
+                        "Broken manifest : invalid %s : %s"
+                        % (STORED_FILES_KEY, element.get("value"))
+                    )
+
+    found_files = 0
+    total_bytes = 0
+    digest = hashlib.sha256()
+    for parent, dirnames, filenames in os.walk(archive_dir):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            apath = os.path.join(parent, filename)
+            related = os.path.relpath(apath, archive_dir)
+            found_files += 1
+            digest.update(related.encode("utf-8", "surrogateescape"))
+            try:
+                total_bytes += os.path.getsize(apath)
+                hash_file(apath, digest)
+                if file_compression:
+                    with ZipView(apath) as zip_view:
+                        bad_member = zip_view.testzip()
+                    if bad_member is not None:
+                        errors.append("Bad CRC : %s" % related)
+            except (OSError, zipfile.BadZipfile, zlib.error) as e:
+                errors.append("Unreadable %s : %s" % (related, e))
+
+    if (stored_files is not None) and (stored_files != found_files):
+        errors.append(
+            "Manifest stored %s files but found %s"
+            % (stored_files, found_files)
+        )
+
+    return dict(
+        errors=errors,
+        stored_files=stored_files,
+        found_files=found_files,
+        bytes=total_bytes,
+        sha256=digest.hexdigest(),
+    )
+
+
+class VerifyState(object):
+    """
+    Resumable progress of a verification, saved as a JSON file.
+    """
+
+    def __init__(self, path):
+        self._path = str(path)
+        self._archives = dict()
+
+        if os.path.exists(self._path):
+            with open(self._path, "r") as f:
+                self._archives = json.load(f).get("archives", dict())
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def archives(self):
+        return self._archives
+
+    def is_verified(self, key):
+        result = self._archives.get(key, None)
+        return (result is not None) and (not result["errors"])
+
+    def record(self, key, result):
+        self._archives[key] = result
+
+    def save(self):
+        parent = os.path.dirname(self._path)
+        if parent and (not os.path.exists(parent)):
+            os.makedirs(parent, exist_ok=True)
+
+        temp_path = self._path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(dict(archives=self._archives), f, indent=1)
+
+        os.replace(temp_path, self._path)
+
+
+def iter_archives(repository):
+    """
+    Yield (key, archive_dir, data_dir, file_compression) of all archives in
+    a repository
+    """
+
+    for project in repository.projects:
+        file_compression = project.file_compression
+        for info in project.data_infos:
+            data_dir = str(info.base_dir)
+            archive_dir = data_dir[: -len(info.DIR_SUFFIX)]
+            key = "%s/%s" % (project.name, os.path.basename(archive_dir))
+            yield (key, archive_dir, data_dir, file_compression)
+
+
+def verify_repository(repository, state, jobs=None, save_interval=5.0):
+    """
+    Verify all archives that are not verified yet.
+
+    Yields (key, result) in completion order, the state is saved every
+    save_interval seconds and at the end.
+    """
+
+    if not jobs:
+        jobs = os.cpu_count() or 1
+
+    pending = (
+        item
+        for item in iter_archives(repository)
+        if not state.is_verified(item[0])
+    )
+
+    last_saved = time.monotonic()
+    with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+        # Bounded, a repository could have a lot of archives
+        futures = dict()
+        try:
+            while True:
+                for key, archive_dir, data_dir, file_compression in pending:
+                    future = executor.submit(
+                        verify_archive, archive_dir, data_dir, file_compression
+                    )
+                    futures[future] = key
+                    if len(futures) >= jobs * PENDING_PER_JOB:
+                        break
+
+                if not futures:
+                    break
+
+                done, _ = concurrent.futures.wait(
+                    futures, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    key = futures.pop(future)
+                    result = future.result()
+                    state.record(key, result)
+                    if time.monotonic() - last_saved >= save_interval:
+                        state.save()
+                        last_saved = time.monotonic()
+
+                    yield (key, result)
+        finally:
+            # The consumer may stop early
+            for future in futures:
+                future.cancel()
+            state.save()
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+
+"""
+Zero-copy reading of zip members through a memory map.
+
+zipfile copies every member into bytes before we could decompress or hash
+it. ZipView maps the zip file once and exposes payloads of stored members as
+memoryview slices of the map, deflated members are decompressed chunk by
+chunk straight from the map. Areca stores trace and manifest as gzip data in
+a zip member, gunzip_chunks() decompresses them without copying the
+payload first.
+
+Views are only valid until the ZipView is closed, consumers must release
+their own slices before.
+"""
+
+import os
+import mmap
+import zlib
+import struct
+import zipfile
+
+CHUNK_SIZE = 1024 * 1024
+
+# Local file header: signature, versions, flags ... name and extra lengths
+LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+LOCAL_SIGNATURE = b"PK\003\004"
+
+
+class ZipViewError(zipfile.BadZipfile):
+    """
+    A member ZipView can't read, e.g. an encrypted one. It's a BadZipfile so
+    callers report it like any broken zip.
+    """
+
+
+class ZipView(object):
+    def __init__(self, path):
+        self._path = str(path)
+        self._map = None
+        self._view = memoryview(b"")
+
+        with open(self._path, "rb") as f:
+            if os.fstat(f.fileno()).st_size > 0:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._view = memoryview(self._map)
+
+        try:
+            # zipfile parses the central directory straight from the map
+            self._zip_file = zipfile.ZipFile(self._map or self._path)
+        except ValueError:
+            # A map raises ValueError where a file raises OSError, when
+            # zipfile seeks before the start of a file too short for a zip
+            self.close()
+            raise zipfile.BadZipfile("File is not a zip file")
+        except BaseException:
+            self.close()
+            raise
+
+    @property
+    def path(self):
+        return self._path
+
+    def infolist(self):
+        return self._zip_file.infolist()
+
+    def getinfo(self, name):
+        return self._zip_file.getinfo(name)
+
+    def _to_info(self, member):
+        if isinstance(member, zipfile.ZipInfo):
+            return member
+
+        return self._zip_file.getinfo(member)
+
+    def raw_view(self, member):
+        """
+        Get the (maybe compressed) payload of a member as a memoryview.
+        """
+
+        info = self._to_info(member)
+        if info.flag_bits & 0x1:
+            raise ZipViewError("Encrypted member : %s" % info.filename)
+
+        offset = info.header_offset
+        header = LOCAL_HEADER.unpack_from(self._view, offset)
+        if header[0] != LOCAL_SIGNATURE:
+            raise zipfile.BadZipfile("Bad local header : %s" % info.filename)
+
+        start = offset + LOCAL_HEADER.size + header[9] + header[10]
+        end = start + info.compress_size
+        if end > len(self._view):
+            raise zipfile.BadZipfile("Truncated member : %s" % info.filename)
+
+        return self._view[start:end]
+
+    def iter_chunks(self, member, chunk_size=CHUNK_SIZE):
+        """
+        Yield the uncompressed content of a member in chunks, chunks of
+        stored members are memoryview slices of the map.
+        """
+
+        info = self._to_info(member)
+        payload = self.raw_view(info)
+
+        try:
+            if info.compress_type == zipfile.ZIP_STORED:
+                for i in range(0, len(payload), chunk_size):
+                    end = i + chunk_size
+                    yield payload[i:end]
+            elif info.compress_type == zipfile.ZIP_DEFLATED:
+                decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+                for i in range(0, len(payload), chunk_size):
+                    end = i + chunk_size
+                    chunk = decompressor.decompress(payload[i:end])
+                    if chunk:
+                        yield chunk
+
+                chunk = decompressor.flush()
+                if chunk:
+                    yield chunk
+            else:
+                # Other methods are rare, let zipfile handle them
+                with self._zip_file.open(info) as f:
+                    while True:
+                        chunk = f.read(chunk_size)
+                        if not chunk:
+                            break
+                        yield chunk
+        finally:
+            payload.release()
+
+    def check(self, member):
+        """
+        Check CRC of a member's content.
+        """
+
+        info = self._to_info(member)
+        crc = 0
+        for chunk in self.iter_chunks(info):
+            crc = zlib.crc32(chunk, crc)
+
+        return crc == info.CRC
+
+    def testzip(self):
+        """
+        Get name of the first member with a bad CRC, like ZipFile.testzip()
+        """
+
+        for info in self.infolist():
+            try:
+                if self.check(info):
+                    continue
+            except zlib.error:
+                pass
+
+            return info.filename
+
+        return None
+
+    def close(self):
+        if getattr(self, "_zip_file", None) is not None:
+            self._zip_file.close()
+            self._zip_file = None
+
+        self._view.release()
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # Slices of callers are still alive, the map is closed when
+                # they are collected.
+                pass
+            self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def gunzip_chunks(chunks):
+    """
+    Decompress gzip data (maybe several concatenated members) from chunks.
+    """
+
+    parts = []
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        while chunk:
+            parts.append(decompressor.decompress(chunk))
+            chunk = decompressor.unused_data
+            if chunk:
+                # Next gzip member
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    parts.append(decompressor.flush())
+    if not decompressor.eof:
+        raise EOFError("Compressed file ended before the end-of-stream")
+
+    return b"".join(parts)
+
+
+def read_gzip_member(path, name):
+    """
+    Read and decompress the gzip data in a zip member.
+    """
+
+    with ZipView(path) as view:
+        return gunzip_chunks(view.iter_chunks(name))
+
+
+def hash_file(path, digest):
+    """
+    Update digest with the content of a file through a memory map.
+    """
+
+    with open(str(path), "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as amap:
+            with memoryview(amap) as view:
+                for i in range(0, len(view), CHUNK_SIZE):
+                    end = i + CHUNK_SIZE
+                    digest.update(view[i:end])
@@ -3,10 +3,12 @@
 
 """Tests for `abhealer` package."""
 
+import os
+
 import pytest
 
 from click.testing import CliRunner
-from abhealer.__main__ import main
+from abhealer.__main__ import main, get_container_name
 
 
 @pytest.fixture
@@ -31,3 +33,9 @@ def test_command_line_interface():
     assert result.exit_code == 0
     help_result = runner.invoke(main, ["--help"])
     assert help_result.exit_code == 0
+
+
+def test_container_name():
+    assert get_container_name("my docs/ä:1") == "abhealer-my_docs___1-%s" % (
+        os.getpid()
+    )
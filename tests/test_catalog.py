@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `abhealer.catalog` module."""
+
+import gzip
+import zipfile
+
+from abhealer import listing
+from abhealer.catalog import PathCatalog
+
+
+def _add_archive(proj_dir, name, paths):
+    proj_dir.mkdir(name)
+    data_dir = proj_dir.mkdir(name + "_data")
+    trace = "#trace\n" + "".join("%s;0\n" % p for p in paths)
+    with zipfile.ZipFile(str(data_dir.join("trace")), "w") as f:
+        f.writestr("trace", gzip.compress(trace.encode()))
+
+    listing.invalidate(proj_dir)
+
+
+def test_prefix_is_a_directory(tmpdir):
+    proj_dir = tmpdir.mkdir("proj")
+    _add_archive(
+        proj_dir, "201801010000", ["dsrc", "fsrc/a", "dsrc2", "fsrc2/b"]
+    )
+
+    catalog = PathCatalog(tmpdir.join("catalog.sqlite"))
+    catalog.update(proj_dir)
+    assert [p for p, _, _ in catalog.find("src")] == ["src", "src/a"]
+    assert [p for p, _, _ in catalog.find("src*")] == [
+        "src",
+        "src/a",
+        "src2",
+        "src2/b",
+    ]
+    catalog.close()
+
+
+def test_concurrent_update(tmpdir):
+    proj_dir = tmpdir.mkdir("proj")
+    _add_archive(proj_dir, "201801010000", ["fa"])
+    _add_archive(proj_dir, "201801020000", ["fa", "fb"])
+
+    apath = tmpdir.join("catalog.sqlite")
+    first = PathCatalog(apath)
+    second = PathCatalog(apath)
+
+    # The second one catalogs everything while the first decodes traces
+    def on_archive(name):
+        if name == "201801010000":
+            second.update(proj_dir)
+
+    first.update(proj_dir, on_archive)
+    assert first.archives() == ["201801010000", "201801020000"]
+    assert list(first.find("b"))[0][2] == [("201801020000", "201801020000", 1)]
+    first.close()
+    second.close()
+
+
+def test_find(tmpdir):
+    proj_dir = tmpdir.mkdir("proj")
+    _add_archive(proj_dir, "201801010000", ["dsrc", "fsrc/a.py", "fold.txt"])
+    _add_archive(proj_dir, "201801020000", ["dsrc", "fsrc/a.py"])
+
+    catalog = PathCatalog(tmpdir.join("catalog.sqlite"))
+    assert catalog.update(proj_dir) == 2
+
+    _add_archive(proj_dir, "201801030000", ["dsrc", "fold.txt"])
+    assert catalog.update(proj_dir) == 1
+    assert catalog.update(proj_dir) == 0
+
+    assert list(catalog.find("old.txt")) == [
+        (
+            "old.txt",
+            "f",
+            [
+                ("201801010000", "201801010000", 1),
+                ("201801030000", "201801030000", 1),
+            ],
+        )
+    ]
+    assert [p for p, _, _ in catalog.find("src")] == ["src", "src/a.py"]
+    assert [p for p, _, _ in catalog.find("/src/")] == ["src", "src/a.py"]
+    # A path that changed its type keeps one row with the newest type
+    _add_archive(proj_dir, "201801040000", ["fsrc"])
+    assert catalog.update(proj_dir) == 1
+    assert [(p, t) for p, t, _ in catalog.find("src")] == [
+        ("src", "f"),
+        ("src/a.py", "f"),
+    ]
+    assert list(catalog.find("*.py")) == [
+        ("src/a.py", "f", [("201801010000", "201801020000", 2)])
+    ]
+    catalog.close()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `abhealer.config` module."""
+
+import io
+
+import click
+import pytest
+
+from abhealer import config
+from abhealer.config import (
+    ConfigWorkspace,
+    iter_project_vars,
+    iter_sources,
+    load_config,
+)
+
+VARS = dict(
+    project_name="proj",
+    src_path="/src",
+    dst_path="/repo",
+    sources=["/src"],
+)
+
+
+def test_render_cached(tmpdir):
+    workspace = ConfigWorkspace(tmpdir)
+
+    config_path, rendered = workspace.render("proj", VARS)
+    assert rendered
+    content = tmpdir.join("proj.bcfg").read()
+    assert 'path="/src"' in content
+    # Defaults are kept without filter rules
+    assert "<ext>.tmp</ext>" in content
+    assert "<ext>.temp</ext>" in content
+
+    # Sources are not a render input
+    vars = dict(VARS, sources=["/src", "/other"])
+    assert workspace.render("proj", vars) == (config_path, False)
+
+
+def test_render_stamp_invalidation(tmpdir, monkeypatch):
+    workspace = ConfigWorkspace(tmpdir)
+    config_path, _ = workspace.render("proj", VARS)
+
+    # Changed inputs
+    _, rendered = workspace.render("proj", dict(VARS, src_path="/moved"))
+    assert rendered
+    assert 'path="/moved"' in tmpdir.join("proj.bcfg").read()
+
+    # A config replaced without its stamp
+    with open(config_path, "a") as f:
+        f.write("<!-- changed -->")
+    assert workspace.render("proj", dict(VARS, src_path="/moved"))[1]
+
+    # A missing stamp
+    tmpdir.join("proj.bcfg" + ConfigWorkspace.STAMP_SUFFIX).remove()
+    assert workspace.render("proj", dict(VARS, src_path="/moved"))[1]
+
+    # A changed template
+    monkeypatch.setattr(config, "get_template_hash", lambda: "changed")
+    assert workspace.render("proj", dict(VARS, src_path="/moved"))[1]
+    assert not workspace.render("proj", dict(VARS, src_path="/moved"))[1]
+
+
+def test_iter_sources():
+    vars = load_config(
+        io.StringIO(
+            "repository: /repo\n"
+            "sources:\n"
+            "  - /data/plain.d\n"
+            "  - [/data/named, other]\n"
+            "  - [/data/blank, '  ']\n"
+            "  - path: /data/mapped\n"
+            "    name: mapped\n"
+            "    zip_level: 1\n"
+        )
+    )
+
+    assert list(iter_sources(vars)) == [
+        ("/data/plain.d", "plain", dict()),
+        ("/data/named", "other", dict()),
+        ("/data/blank", "blank", dict()),
+        ("/data/mapped", "mapped", dict(zip_level=1)),
+    ]
+
+
+def test_load_config_invalid():
+    for text in (
+        "- a list",
+        "sources: []",
+        "repository: /repo\nsources: /src",
+        "repository: /repo\nsources:\n  - 1",
+        "repository: [",
+    ):
+        with pytest.raises(click.UsageError):
+            load_config(io.StringIO(text))
+
+
+def test_iter_project_vars(tmpdir):
+    vars = load_config(
+        io.StringIO(
+            "repository: %s\n"
+            "limits: {cpu: 50%%}\n"
+            "sources:\n"
+            "  - /data/a\n"
+            "  - path: /data/b\n"
+            "    host: other\n"
+            "    zip_level: 1\n"
+            "    limits: {io_read: 10M}\n" % tmpdir
+        )
+    )
+
+    items = list(iter_project_vars(vars))
+    assert [(v["project_name"], v["src_path"]) for v, _ in items] == [
+        ("a", "/data/a"),
+        ("b", "/data/b"),
+    ]
+    assert items[0][0]["zip_level"] == 9
+    assert items[1][0]["zip_level"] == 1
+    assert items[1][0]["limits"] == {"cpu": "50%", "io_read": "10M"}
+    assert items[1][1]["host"] == "other"
+    # The config values are not changed
+    assert "project_name" not in vars
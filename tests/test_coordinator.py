@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `abhealer.coordinator` module."""
+
+import os
+import time
+import asyncio
+import threading
+import multiprocessing
+
+from abhealer.coordinator import ClaimStore, WorkPlan, run_worker
+from abhealer.runner import run_sync
+
+
+def test_claim_is_exclusive(tmpdir):
+    store_a = ClaimStore(str(tmpdir), "run", "host-a")
+    store_b = ClaimStore(str(tmpdir), "run", "host-b")
+
+    claim = store_a.claim("proj")
+    assert claim is not None
+    assert store_b.claim("proj") is None
+
+    claim.finish(0)
+    assert store_b.is_done("proj")
+    assert store_b.claim("proj") is None
+
+
+def test_stale_claim_taken_over(tmpdir):
+    store_a = ClaimStore(str(tmpdir), "run", "host-a", stale_timeout=60)
+    store_b = ClaimStore(str(tmpdir), "run", "host-b", stale_timeout=60)
+
+    assert store_a.claim("proj") is not None
+    assert store_b.claim("proj") is None
+
+    # Owner stopped touching its lock
+    old = time.time() - 120
+    os.utime(store_a.lock_path("proj"), (old, old))
+    assert store_b.claim("proj") is not None
+
+
+def test_workers_run_every_project_once(tmpdir):
+    names = ["p%s" % i for i in range(8)]
+    runs = []
+    lock = threading.Lock()
+
+    async def run_project(name):
+        with lock:
+            runs.append(name)
+        return 0
+
+    def work(host):
+        store = ClaimStore(str(tmpdir), "run", host)
+        plan = WorkPlan(store, [(n, i, n) for i, n in enumerate(names)])
+        run_sync(run_worker(plan, run_project, jobs=2))
+
+    threads = [
+        threading.Thread(target=work, args=("host-%s" % i,)) for i in range(3)
+    ]
+    for athread in threads:
+        athread.start()
+    for athread in threads:
+        athread.join()
+
+    assert sorted(runs) == sorted(names)
+
+
+def _process_worker(state_dir, runs_dir, host, names):
+    async def run_project(name):
+        with open(os.path.join(runs_dir, name), "a") as f:
+            f.write(host + "\n")
+
+        # Longer than the stale timeout, only heartbeats keep the claim
+        await asyncio.sleep(2.0)
+        return 0
+
+    store = ClaimStore(state_dir, "run", host, stale_timeout=1.5)
+    plan = WorkPlan(store, [(n, i, n) for i, n in enumerate(names)])
+    run_sync(run_worker(plan, run_project))
+
+
+def test_worker_processes(tmpdir):
+    names = ["p%s" % i for i in range(4)]
+    runs_dir = tmpdir.mkdir("runs")
+
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(
+            target=_process_worker,
+            args=(str(tmpdir), str(runs_dir), "host-%s" % i, names),
+        )
+        for i in range(2)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+        assert process.exitcode == 0
+
+    # Every project ran once, no claim was taken over as stale
+    assert sorted(runs_dir.listdir(sort=True)) == sorted(
+        runs_dir.join(n) for n in names
+    )
+    hosts = set()
+    for name in names:
+        lines = runs_dir.join(name).read().splitlines()
+        assert len(lines) == 1
+        hosts.update(lines)
+
+    assert hosts == set(["host-0", "host-1"])
+
+
+def test_failed_project_retried(tmpdir):
+    runs = []
+
+    async def run_project(name):
+        runs.append(name)
+        return 1 if len(runs) == 1 else 0
+
+    store_a = ClaimStore(str(tmpdir), "run", "host-a")
+    plan = WorkPlan(store_a, [("proj", 1, "proj")])
+
+    # The failing worker doesn't claim the project again
+    assert run_sync(run_worker(plan, run_project)) == dict(proj=1)
+    assert runs == ["proj"]
+    assert store_a.is_failed("proj")
+    assert not store_a.is_done("proj")
+    assert plan.pending() == []
+
+    # Another worker retries it
+    store_b = ClaimStore(str(tmpdir), "run", "host-b")
+    plan = WorkPlan(store_b, [("proj", 1, "proj")])
+    assert run_sync(run_worker(plan, run_project)) == dict(proj=0)
+    assert store_b.is_done("proj")
+    assert not store_b.is_failed("proj")
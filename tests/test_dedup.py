@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `abhealer.dedup` module."""
+
+import zipfile
+
+from abhealer.arecabackup import Repository
+from abhealer.dedup import (
+    HashIndex,
+    hash_archive,
+    index_archives,
+    index_sources,
+)
+
+
+def test_index_sources(tmpdir):
+    a = tmpdir.mkdir("a")
+    b = tmpdir.mkdir("b")
+    a.join("vendor.bin").write(b"x" * 1000, mode="wb")
+    b.mkdir("lib").join("vendor.bin").write(b"x" * 1000, mode="wb")
+    b.join("own.txt").write("only b")
+
+    index = HashIndex(tmpdir.join("index.sqlite"))
+    sources = [("a", str(a)), ("b", str(b))]
+
+    results = list(index_sources(sources, index, jobs=2))
+    assert sorted(results) == [("a", 1, 1), ("b", 2, 2)]
+    assert index.pair_bytes() == [("a", "b", 1000)]
+    assert index.total_bytes() == 1006
+
+    # Unchanged files are not hashed again
+    results = list(index_sources(sources, index, jobs=2))
+    assert sorted(results) == [("a", 1, 0), ("b", 2, 0)]
+    index.close()
+
+
+def test_hash_archive_zip_members(tmpdir):
+    archive_dir = tmpdir.mkdir("201801010000")
+    with zipfile.ZipFile(str(archive_dir.join("file.txt")), "w") as f:
+        f.writestr("file.txt", "content")
+    plain_dir = tmpdir.mkdir("201801020000")
+    plain_dir.join("plain.txt").write("content")
+
+    rows = hash_archive(str(archive_dir), True)
+    plain_rows = hash_archive(str(plain_dir), False)
+    assert [r[0] for r in rows] == ["file.txt/file.txt"]
+    assert [r[0] for r in plain_rows] == ["plain.txt"]
+    assert rows[0][3] == plain_rows[0][3]
+
+
+def test_hash_archive_user_zip(tmpdir):
+    # A zip backed up without compression is hashed as it is
+    archive_dir = tmpdir.mkdir("201801010000")
+    with zipfile.ZipFile(str(archive_dir.join("user.zip")), "w") as f:
+        f.writestr("file.txt", "content")
+
+    rows = hash_archive(str(archive_dir), False)
+    assert [r[0] for r in rows] == ["user.zip"]
+    assert rows[0][1] == archive_dir.join("user.zip").size()
+
+
+def test_index_archives_medium_setting(tmpdir):
+    repo = tmpdir.mkdir("repo")
+    cfg_dir = repo.mkdir("areca_config_backup")
+    for name, compression in [("zipped", "true"), ("plain", "false")]:
+        cfg_dir.join(name + ".bcfg").write(
+            '<target><medium file_compression="%s"/></target>' % compression
+        )
+        proj_dir = repo.mkdir(name)
+        proj_dir.join("history").write("")
+        proj_dir.mkdir("201801010000_data")
+        apath = proj_dir.mkdir("201801010000").join("file.zip")
+        with zipfile.ZipFile(str(apath), "w") as f:
+            f.writestr("file", "content")
+
+    index = HashIndex(tmpdir.join("index.sqlite"))
+    results = list(index_archives(Repository(str(repo)), index, jobs=1))
+    assert sorted(results) == [
+        ("plain", "201801010000", 1),
+        ("zipped", "201801010000", 1),
+    ]
+    assert list(index.get_files("zipped", "201801010000")) == [
+        "file.zip/file"
+    ]
+    assert list(index.get_files("plain", "201801010000")) == ["file.zip"]
+    index.close()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `abhealer.environment` module."""
+
+import click
+import pytest
+
+from abhealer import environment
+from abhealer.arecabackup import DockerizedArecaBackup
+from abhealer.environment import EnvironmentCache
+
+
+@pytest.fixture
+def cache(tmpdir, monkeypatch):
+    cache = EnvironmentCache(str(tmpdir.join("environment.json")))
+    monkeypatch.setattr(environment, "_cache", cache)
+    return cache
+
+
+def test_docker_available(cache, monkeypatch):
+    requested = []
+
+    def docker_request(path, timeout=2.0):
+        requested.append(path)
+        return (200, b"OK")
+
+    monkeypatch.setattr(environment, "docker_request", docker_request)
+
+    # Only the daemon is checked, images are pulled on demand
+    assert environment.is_docker_available()
+    assert requested == ["/_ping"]
+
+    # Cached
+    assert environment.is_docker_available()
+    assert requested == ["/_ping"]
+
+
+def test_negative_not_cached(cache, monkeypatch):
+    status = [None]
+    monkeypatch.setattr(
+        environment, "docker_request", lambda *args: (status[0], None)
+    )
+
+    assert not environment.is_docker_available()
+
+    # The daemon was started meanwhile
+    status[0] = 200
+    assert environment.is_docker_available()
+
+
+def test_dockerized_without_daemon(cache, monkeypatch):
+    monkeypatch.setattr(
+        environment, "docker_request", lambda *args: (None, None)
+    )
+
+    with pytest.raises(click.ClickException):
+        DockerizedArecaBackup()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `abhealer.filters` module."""
+
+from abhealer.config import get_project_template
+from abhealer.filters import (
+    FilterMatcher,
+    gen_areca_filters,
+    merge_filters,
+)
+
+FILTERS = dict(
+    exclude=[dict(dir="node_modules"), dict(glob="*.pyc"), dict(size="1k")]
+)
+
+
+def test_preview(tmpdir):
+    src = tmpdir.mkdir("src")
+    src.mkdir("node_modules").mkdir("x").join("a.js").write("a" * 10)
+    src.join("a.pyc").write("b" * 10)
+    src.join("big.bin").write("c" * 2000)
+    src.join("keep.py").write("d" * 10)
+    src.join("x.tmp").write("e")
+
+    matcher = FilterMatcher(merge_filters(dict(filters=FILTERS), dict()))
+    result = matcher.preview(src)
+
+    assert result.counts["exclude dir node_modules"] == [1, 10]
+    assert result.counts["exclude glob *.pyc"] == [1, 10]
+    assert result.counts["exclude size 1k"] == [1, 2000]
+    assert result.counts["exclude ext .tmp"] == [1, 1]
+    assert result.kept == [1, 10]
+
+
+def test_includes(tmpdir):
+    src = tmpdir.mkdir("src")
+    src.mkdir("lib").join("a.py").write("a")
+    src.join("README").write("b")
+
+    matcher = FilterMatcher(dict(include=[dict(glob="**.py")]))
+    result = matcher.preview(src)
+    assert result.kept == [1, 1]
+    assert result.not_included == [1, 1]
+
+
+def test_render():
+    filters = merge_filters(dict(filters=FILTERS), dict())
+    content = get_project_template().render(
+        filter_rules=gen_areca_filters(filters, "/opt/source")
+    )
+
+    assert "<ext>.tmp</ext>" in content
+    assert 'regex="^/opt/source.*?(?:/node_modules(/|$))"' in content
+    assert 'param="&gt; 1024"' in content
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `abhealer.journal` module."""
+
+import click
+import pytest
+
+from click.testing import CliRunner
+from abhealer.__main__ import main, exec_
+from abhealer.journal import RecoverJournal
+
+
+def test_round_trip(tmpdir):
+    repository = tmpdir.mkdir("repo")
+    to_path = tmpdir.mkdir("recovered")
+
+    journal = RecoverJournal(to_path, repository)
+    assert journal.state_of("proj") is None
+    journal.mark("proj", RecoverJournal.ARECA_DONE)
+    journal.mark("other", RecoverJournal.DONE)
+
+    journal = RecoverJournal(to_path, repository)
+    assert journal.state_of("proj") == RecoverJournal.ARECA_DONE
+    assert journal.state_of("other") == RecoverJournal.DONE
+
+
+def test_foreign_or_broken_journal(tmpdir):
+    to_path = tmpdir.mkdir("recovered")
+    RecoverJournal(to_path, tmpdir.mkdir("repo")).mark(
+        "proj", RecoverJournal.DONE
+    )
+
+    journal = RecoverJournal(to_path, tmpdir.mkdir("other_repo"))
+    assert journal.state_of("proj") is None
+
+    to_path.join(RecoverJournal.FILE_NAME).write('{"projects": [')
+    journal = RecoverJournal(to_path, tmpdir.join("repo"))
+    assert journal.state_of("proj") is None
+
+
+def test_foreign_journal_keeps_empty_check(tmpdir):
+    to_path = tmpdir.mkdir("recovered")
+    to_path.mkdir("proj").join("file").write("data")
+    RecoverJournal(to_path, tmpdir.mkdir("other_repo")).mark(
+        "proj", RecoverJournal.STARTED
+    )
+
+    vars = dict(
+        repository=str(tmpdir.mkdir("repo")),
+        project_name="proj",
+        src_path=str(to_path.join("proj")),
+    )
+    journal = RecoverJournal(to_path, vars["repository"])
+    with pytest.raises(click.UsageError):
+        exec_(False, False, vars, journal=journal)
+
+
+def test_resume_skips_done(tmpdir, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmpdir.join("cache")))
+    repository = tmpdir.mkdir("repo")
+    to_path = tmpdir.mkdir("recovered")
+    config = tmpdir.join("config.yml")
+    config.write(
+        "repository: %s\nsources:\n  - /data/first\n  - /data/second\n"
+        % repository
+    )
+
+    journal = RecoverJournal(to_path, repository)
+    journal.mark("first", RecoverJournal.DONE)
+    journal.mark("second", RecoverJournal.DONE)
+
+    result = CliRunner().invoke(
+        main, ["--mode", "local", "recover", "repo", str(config), str(to_path)]
+    )
+    assert result.exit_code == 0
+    assert "first already recovered, skipped" in result.output
+    assert "second already recovered, skipped" in result.output
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `abhealer.listing` module."""
+
+import os
+
+from abhealer import listing
+from abhealer.__main__ import clear_dirs, find_data_dirs
+
+
+def _make_project(tmpdir):
+    for name in [
+        "201711032056",
+        "201711032056_data",
+        "201711032056_1",
+        "201711032056_1_data",
+        "201711022056",
+        "201711022056_data",
+        "201711042056",
+    ]:
+        tmpdir.mkdir(name)
+
+    tmpdir.join("history").write("")
+    return tmpdir
+
+
+def test_archives_sorted(tmpdir):
+    proj_dir = _make_project(tmpdir)
+    alisting = listing.ProjectListing(proj_dir)
+
+    assert list(alisting.archives) == [
+        201711022056000,
+        201711032056000,
+        201711032056001,
+        201711042056000,
+    ]
+    assert alisting.damaged_archives == [201711042056000]
+    assert alisting.name_of(201711032056001) == "201711032056_1"
+
+
+def test_clear_dirs_uses_cached_listing(tmpdir):
+    proj_dir = _make_project(tmpdir)
+    listing.invalidate()
+
+    clear_dirs(proj_dir)
+
+    assert not os.path.exists(str(proj_dir.join("201711042056")))
+    assert find_data_dirs(proj_dir) == [
+        "201711022056_data",
+        "201711032056_data",
+        "201711032056_1_data",
+    ]
+
+    # Directories changed by others are not seen until invalidated
+    proj_dir.mkdir("201711052056")
+    assert len(find_data_dirs(proj_dir)) == 3
+
+    listing.invalidate(proj_dir)
+    assert len(find_data_dirs(proj_dir)) == 4
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `abhealer.locking` module."""
+
+import os
+import sys
+import asyncio
+import threading
+import subprocess
+
+import pytest
+
+from abhealer.locking import LockTimeoutError, ProjectLock, read_owner
+from abhealer.runner import run_sync
+
+
+def test_reentrant(tmpdir):
+    proj_dir = tmpdir.mkdir("repo").mkdir("proj")
+
+    with ProjectLock(proj_dir) as lock:
+        with ProjectLock(proj_dir, exclusive=False):
+            pass
+
+        owner = read_owner(lock.path)
+        assert owner["pid"] == os.getpid()
+
+    with ProjectLock(proj_dir, exclusive=False):
+        with pytest.raises(RuntimeError):
+            ProjectLock(proj_dir).acquire()
+
+
+def test_timeout_on_other_process(tmpdir):
+    proj_dir = tmpdir.mkdir("repo").mkdir("proj")
+
+    holder = subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            "import sys\n"
+            "from abhealer.locking import ProjectLock\n"
+            "with ProjectLock(sys.argv[1]):\n"
+            "    print('locked', flush=True)\n"
+            "    sys.stdin.read()\n",
+            str(proj_dir),
+        ],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+    )
+    try:
+        assert holder.stdout.readline().strip() == b"locked"
+
+        with pytest.raises(LockTimeoutError) as e:
+            ProjectLock(proj_dir, exclusive=False, timeout=0.3).acquire()
+        assert e.value.owner["pid"] == holder.pid
+    finally:
+        holder.communicate()
+
+    with ProjectLock(proj_dir, timeout=0):
+        pass
+
+
+def test_exclusive_between_threads(tmpdir):
+    proj_dir = tmpdir.mkdir("repo").mkdir("proj")
+    errors = []
+
+    def other_thread():
+        try:
+            ProjectLock(proj_dir, exclusive=False, timeout=0).acquire()
+        except LockTimeoutError as e:
+            errors.append(e)
+
+    with ProjectLock(proj_dir):
+        thread = threading.Thread(target=other_thread)
+        thread.start()
+        thread.join()
+
+    assert len(errors) == 1
+
+
+def test_exclusive_between_tasks(tmpdir):
+    proj_dir = tmpdir.mkdir("repo").mkdir("proj")
+    events = []
+
+    async def job(name):
+        async with ProjectLock(proj_dir):
+            events.append("%s acquired" % name)
+            await asyncio.sleep(0.2)
+            # Reentrant in the same task
+            async with ProjectLock(proj_dir, exclusive=False):
+                pass
+            events.append("%s released" % name)
+
+    async def both():
+        await asyncio.gather(job("a"), job("b"))
+
+    run_sync(both())
+    assert events == ["a acquired", "a released", "b acquired", "b released"]
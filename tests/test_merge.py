@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `abhealer.merge` module."""
+
+import datetime
+
+from abhealer.merge import MergePolicy, plan_project
+
+
+class FakeDataInfo(object):
+    def __init__(self, dt):
+        self.datetime = dt
+
+    def get_int_property(self, key, default=None):
+        return 100
+
+    def __int__(self):
+        return int(self.datetime.strftime("%Y%m%d%H%M")) * 1000
+
+
+class FakeProject(object):
+    name = "proj"
+
+    def __init__(self, dates):
+        self.data_infos = [FakeDataInfo(d) for d in dates]
+
+
+def test_plan_project_buckets():
+    today = datetime.date(2020, 3, 31)
+    dates = [
+        # Two archives in February : one monthly merge
+        datetime.datetime(2020, 2, 3, 1, 0),
+        datetime.datetime(2020, 2, 4, 1, 0),
+        # Two archives in the same week : one weekly merge
+        datetime.datetime(2020, 3, 16, 1, 0),
+        datetime.datetime(2020, 3, 17, 1, 0),
+        # Daily archives are kept, except the ones at the same day
+        datetime.datetime(2020, 3, 29, 1, 0),
+        datetime.datetime(2020, 3, 30, 1, 0),
+        datetime.datetime(2020, 3, 30, 13, 0),
+    ]
+
+    plan = plan_project(FakeProject(dates), MergePolicy(7, 2), today)
+
+    assert [len(r.infos) for r in plan.ranges] == [2, 2, 2]
+    assert plan.chain_length == 7
+    assert plan.merged_chain_length == 4
+    assert plan.ranges[0].size == 200
+    assert (plan.ranges[0].from_days, plan.ranges[0].to_days) == (57, 56)
+    assert plan.estimate_savings(2) == 6.0
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `abhealer.profiling` module."""
+
+import json
+
+from abhealer import profiling
+
+
+def test_spans_written(tmpdir):
+    path = tmpdir.join("trace.json")
+    profiling.start_tracing(str(path))
+    try:
+        with profiling.span("areca", lane="proj1", count=1):
+            pass
+        with profiling.span("render"):
+            pass
+    finally:
+        profiling.stop_tracing()
+
+    events = json.loads(path.read())["traceEvents"]
+    spans = dict((e["name"], e) for e in events if e["ph"] == "X")
+    assert set(spans.keys()) == set(["areca", "render"])
+    assert spans["areca"]["args"] == dict(count=1)
+
+    lanes = [e for e in events if e["ph"] == "M"]
+    assert lanes[0]["args"]["name"] == "proj1"
+    assert lanes[0]["tid"] == spans["areca"]["tid"]
+
+
+def test_disabled_is_noop():
+    assert not profiling.is_tracing()
+    assert profiling.span("x") is profiling.span("y")
+    profiling.add_span("x", 0.0, 1.0)
+    assert profiling.stop_tracing() is None
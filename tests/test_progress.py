@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `abhealer.progress` module."""
+
+from abhealer import progress as progress_module
+from abhealer.progress import ProgressBoard, ProjectProgress, format_eta
+from abhealer.runner import run_sync
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_feed_entries(tmpdir):
+    source_dir = tmpdir.mkdir("source")
+    source_dir.join("a.txt").write("x" * 10)
+    source_dir.join("b.txt").write("x" * 30)
+
+    progress = ProjectProgress(
+        "proj",
+        expected_entries=4,
+        source_dir=str(source_dir),
+        client_source_dir="/opt/source",
+    )
+    progress.feed("Archiving /opt/source/a.txt")
+    progress.feed("Archiving /opt/source/b.txt")
+    progress.feed("Unrelated output")
+    assert progress.entries == 2
+    assert progress.percent == 50.0
+
+    progress.finish()
+    assert progress.bytes_ == 40
+    assert progress.percent == 100.0
+
+
+def test_finish_async_waits_for_sizes(tmpdir):
+    source_dir = tmpdir.mkdir("source")
+    for i in range(progress_module.STAT_BATCH_SIZE + 10):
+        source_dir.join(str(i)).write("x")
+
+    reports = []
+    board = ProgressBoard(emit=reports.append)
+    progress = board.track(
+        "proj", source_dir=str(source_dir), client_source_dir="/opt/source"
+    )
+    for i in range(progress_module.STAT_BATCH_SIZE + 10):
+        progress.feed("/opt/source/%s" % i)
+
+    run_sync(progress.finish_async())
+    assert progress.bytes_ == progress_module.STAT_BATCH_SIZE + 10
+
+
+def test_feed_reported_percent():
+    progress = ProjectProgress("proj", client_source_dir="/opt/source")
+
+    progress.feed("Progress : 45 %")
+    assert progress.percent == 45.0
+
+    # Percents in file names are not progress
+    progress.feed("Archiving /opt/source/sales 75% off.txt")
+    assert progress.percent == 45.0
+    assert progress.entries == 1
+
+    progress.feed("progress: 62,5%")
+    assert progress.percent == 62.5
+
+
+def test_failed_is_not_complete():
+    board = ProgressBoard(emit=lambda x: None)
+    progress = board.track("proj", 10, client_source_dir="/opt/source")
+    for i in range(3):
+        progress.feed("/opt/source/%s" % i)
+
+    progress.finish(succeeded=False)
+    assert progress.percent == 30.0
+    assert progress.eta is None
+    assert progress.format().endswith("failed")
+    assert board.overall() == (30.0, 0)
+
+
+def test_eta(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(progress_module.time, "monotonic", clock)
+
+    progress = ProjectProgress(
+        "proj", expected_entries=100, client_source_dir="/opt/source"
+    )
+    assert progress.eta is None
+
+    for i in range(25):
+        progress.feed("/opt/source/%s" % i)
+    clock.now += 60
+
+    # A quarter in one minute, three more minutes to go
+    assert progress.percent == 25.0
+    assert progress.eta == 180.0
+    assert progress.files_rate == 25 / 60.0
+    assert format_eta(progress.eta) == "0:03:00"
+    assert format_eta(None) == "--:--:--"
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `abhealer.replicate` module."""
+
+import os
+import shutil
+
+import pytest
+
+from abhealer import listing, replicate
+from abhealer.replicate import ReplicationJournal, Replicator
+
+
+def _add_archive(proj_dir, name):
+    proj_dir.mkdir(name).join("data.zip").write(name * 1000)
+    proj_dir.mkdir(name + "_data").join("manifest").write(name)
+    listing.invalidate()
+
+
+def test_replicate(tmpdir):
+    repo = tmpdir.mkdir("repo")
+    repo.mkdir("areca_config_backup").join("proj.bcfg").write("<cfg/>")
+    proj_dir = repo.mkdir("proj")
+    proj_dir.join("history").write("")
+    _add_archive(proj_dir, "201801010000")
+    _add_archive(proj_dir, "201802010000")
+    dest = tmpdir.join("dest")
+
+    replicator = Replicator(str(repo), str(dest), jobs=2)
+    replicator.sync_config()
+    result = replicator.replicate_project(str(proj_dir))
+    assert result.copied == ["201801010000", "201802010000"]
+    assert result.bytes == 2 * 12000 + 2 * 12
+    assert dest.join("areca_config_backup", "proj.bcfg").read() == "<cfg/>"
+    assert dest.join("proj", "history").check(file=1)
+    assert dest.join("proj", "201802010000", "data.zip").read() == (
+        "201802010000" * 1000
+    )
+
+    # Only new archives are copied, merged ones are removed
+    _add_archive(proj_dir, "201803010000")
+    shutil.rmtree(str(proj_dir.join("201801010000")))
+    shutil.rmtree(str(proj_dir.join("201801010000_data")))
+    listing.invalidate()
+
+    replicator = Replicator(str(repo), str(dest), jobs=2)
+    result = replicator.replicate_project(str(proj_dir))
+    assert result.copied == ["201803010000"]
+    assert result.removed == ["201801010000"]
+    assert not dest.join("proj", "201801010000").check()
+    assert sorted(
+        p.basename for p in dest.join("proj").listdir() if p.isdir()
+    ) == [
+        "201802010000",
+        "201802010000_data",
+        "201803010000",
+        "201803010000_data",
+    ]
+
+
+def _make_repo(tmpdir, names):
+    repo = tmpdir.mkdir("repo")
+    repo.mkdir("areca_config_backup").join("proj.bcfg").write("<cfg/>")
+    proj_dir = repo.mkdir("proj")
+    proj_dir.join("history").write("")
+    for name in names:
+        _add_archive(proj_dir, name)
+
+    return repo, proj_dir
+
+
+def _archive_dirs(proj_dir):
+    return sorted(p.basename for p in proj_dir.listdir() if p.isdir())
+
+
+def test_incremental_run(tmpdir, monkeypatch):
+    repo, proj_dir = _make_repo(tmpdir, ["201801010000"])
+    dest = tmpdir.join("dest")
+    Replicator(str(repo), str(dest)).replicate_project(str(proj_dir))
+
+    _add_archive(proj_dir, "201802010000")
+    copied = []
+    copy_file = replicate.copy_file
+
+    def record_copy(src, dst):
+        copied.append(src)
+        return copy_file(src, dst)
+
+    monkeypatch.setattr(replicate, "copy_file", record_copy)
+    fsyncs = []
+    monkeypatch.setattr(os, "fsync", fsyncs.append)
+
+    result = Replicator(str(repo), str(dest)).replicate_project(str(proj_dir))
+    assert result.copied == ["201802010000"]
+    assert result.removed == []
+    assert copied
+    assert all("201802010000" in apath for apath in copied)
+    # The journal is synced once for the project
+    assert len(fsyncs) == 1
+
+    # Nothing left to do
+    result = Replicator(str(repo), str(dest)).replicate_project(str(proj_dir))
+    assert result.copied == []
+    assert _archive_dirs(dest.join("proj")) == _archive_dirs(proj_dir)
+
+
+def test_merged_archives_removed(tmpdir):
+    names = ["201801010000", "201802010000", "201803010000"]
+    repo, proj_dir = _make_repo(tmpdir, names)
+    dest = tmpdir.join("dest")
+    Replicator(str(repo), str(dest)).replicate_project(str(proj_dir))
+
+    # Areca merged the first two archives into the second one
+    for suffix in ("", "_data"):
+        shutil.rmtree(str(proj_dir.join("201801010000" + suffix)))
+    proj_dir.join("201802010000", "data.zip").write("merged")
+    proj_dir.join("201802010000_data", "manifest").write("merged manifest")
+    listing.invalidate()
+
+    replicator = Replicator(str(repo), str(dest))
+    result = replicator.replicate_project(str(proj_dir))
+    assert result.removed == ["201801010000"]
+    assert result.copied == ["201802010000"]
+    assert dest.join("proj", "201802010000", "data.zip").read() == "merged"
+    assert _archive_dirs(dest.join("proj")) == _archive_dirs(proj_dir)
+    assert sorted(replicator.journal.archives_of("proj")) == names[1:]
+
+
+def test_failed_verify(tmpdir, monkeypatch):
+    repo, proj_dir = _make_repo(tmpdir, ["201801010000"])
+    dest = tmpdir.join("dest")
+    monkeypatch.setattr(replicate, "files_equal", lambda src, dst: False)
+
+    replicator = Replicator(str(repo), str(dest))
+    with pytest.raises(OSError):
+        replicator.replicate_project(str(proj_dir))
+
+    # Nothing is in place or recorded, the next run copies it again
+    assert not dest.join("proj", "201801010000").check()
+    assert not dest.join("proj", "201801010000_data").check()
+    assert ReplicationJournal(str(dest)).archives_of("proj") == dict()
+
+    monkeypatch.undo()
+    result = Replicator(str(repo), str(dest)).replicate_project(str(proj_dir))
+    assert result.copied == ["201801010000"]
+    assert _archive_dirs(dest.join("proj")) == _archive_dirs(proj_dir)
+
+
+def test_cold_tiered_sources(tmpdir):
+    repo, proj_dir = _make_repo(tmpdir, ["201801010000", "201802010000"])
+    cold_dir = tmpdir.mkdir("cold")
+    for suffix in ("", "_data"):
+        apath = proj_dir.join("201801010000" + suffix)
+        cold_path = cold_dir.join(apath.basename)
+        apath.move(cold_path)
+        os.symlink(str(cold_path), str(apath))
+    listing.invalidate()
+
+    dest = tmpdir.join("dest")
+    result = Replicator(str(repo), str(dest)).replicate_project(str(proj_dir))
+    assert result.copied == ["201801010000", "201802010000"]
+
+    # Linked archives are copied as real directories
+    copy = dest.join("proj", "201801010000")
+    assert not os.path.islink(str(copy))
+    assert copy.join("data.zip").read() == "201801010000" * 1000
+    assert dest.join("proj", "201801010000_data", "manifest").check(file=1)
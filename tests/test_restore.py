@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `abhealer.restore` module."""
+
+import os
+import grp
+import pwd
+
+from abhealer.restore import (
+    RecoverPipeline,
+    parse_entries,
+    resolve_link_targets,
+)
+
+
+def test_pipeline(tmpdir):
+    owner = pwd.getpwuid(os.getuid()).pw_name
+    group = grp.getgrgid(os.getgid()).gr_name
+    client_dir = "/orig/proj"
+    source_dir = tmpdir.mkdir("recovered")
+
+    trace_infos = {
+        "dsub": ["dsub", "0", str(0o750), owner, group],
+        "dsub/ro": ["dsub/ro", "0", str(0o555), owner, group],
+        "ssub/link": [
+            "ssub/link",
+            "f" + client_dir + "/sub/ro",
+            "0",
+            str(0o777),
+            owner,
+            group,
+        ],
+        "ssub/missing": [
+            "ssub/missing",
+            "f" + client_dir + "/sub",
+            "0",
+            str(0o777),
+            owner,
+            group,
+        ],
+    }
+
+    pipeline = RecoverPipeline(trace_infos, str(source_dir), client_dir)
+    pipeline.start()
+
+    # Directories are writable while Areca extracts
+    ro_dir = source_dir.join("sub", "ro")
+    assert ro_dir.check(dir=1)
+    ro_dir.join("file").write("")
+
+    # Areca restores the link as it was
+    os.symlink(client_dir + "/sub/ro", str(source_dir.join("sub", "link")))
+
+    pipeline.finish()
+
+    assert os.readlink(str(source_dir.join("sub", "link"))) == "ro"
+    # Links Areca didn't extract are created
+    assert os.readlink(str(source_dir.join("sub", "missing"))) == "."
+    assert (ro_dir.stat().mode & 0o777) == 0o555
+    assert (source_dir.join("sub").stat().mode & 0o777) == 0o750
+
+
+def test_resolve_link_targets():
+    client_dir = "/orig/proj"
+    infos = {
+        "sa/b/up": ["a/b/up", "f/orig/proj/x/y/t", "0", "511", "u", "g"],
+        "sa/same": ["a/same", "f/orig/proj/a/t", "0", "511", "u", "g"],
+        "sroot": ["root", "f/orig/proj/", "0", "511", "u", "g"],
+        "sout": ["out", "f/orig/project2/t", "0", "511", "u", "g"],
+        "srel": ["rel", "f../t", "0", "511", "u", "g"],
+    }
+
+    _, links = parse_entries(infos)
+    targets = resolve_link_targets(links, client_dir)
+    assert targets == {
+        "a/b/up": "../../x/y/t",
+        "a/same": "t",
+        "root": ".",
+        "out": "/orig/project2/t",
+        "rel": "../t",
+    }
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `abhealer.runner` module."""
+
+import sys
+import time
+import threading
+
+from abhealer.runner import run_blocking, run_jobs, run_process, run_sync
+
+
+def test_run_process_streams_lines():
+    lines = []
+    cmd = [sys.executable, "-c", "print('a'); print('b'); exit(3)"]
+    result = run_sync(run_process(cmd, on_line=lines.append, echo=False))
+
+    assert lines == ["a", "b"]
+    assert result.returncode == 3
+    assert not result.timed_out
+
+
+def test_run_process_timeout():
+    cmd = [sys.executable, "-c", "import time; time.sleep(30)"]
+    result = run_sync(run_process(cmd, timeout=0.5, echo=False))
+
+    assert result.timed_out
+    assert result.returncode != 0
+    assert result.duration < 15
+
+
+def test_run_jobs_stop_on_error():
+    started = []
+
+    def make_job(ret):
+        async def job():
+            started.append(ret)
+            return ret
+
+        return job
+
+    rets = run_sync(run_jobs([make_job(0), make_job(2), make_job(0)], 1))
+    assert rets == [0, 2, None]
+    assert started == [0, 2]
+
+
+def test_run_blocking():
+    def blocking(value, delay=0.0):
+        time.sleep(delay)
+        return (value, threading.get_ident())
+
+    value, ident = run_sync(run_blocking(blocking, "a", delay=0.1))
+    assert value == "a"
+    assert ident != threading.get_ident()
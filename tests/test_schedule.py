@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `abhealer.schedule` module."""
+
+import datetime
+
+from abhealer import listing
+from abhealer.schedule import (
+    Schedule,
+    ScheduleItem,
+    get_staleness,
+    plan_window,
+    save_report,
+)
+
+
+def test_plan_window():
+    items = [
+        ScheduleItem("fresh", 3600, 100),
+        ScheduleItem("stale", 86400, 300),
+        ScheduleItem("new", None, None),
+        ScheduleItem("huge", 7200, 1000),
+        ScheduleItem("small", 1800, 50),
+    ]
+
+    schedule = plan_window(items, 500, workers=2)
+
+    # "new" is predicted with the median (200)
+    assert [(i.name, i.start) for i in schedule.scheduled] == [
+        ("new", 0.0),
+        ("stale", 0.0),
+        ("fresh", 200.0),
+        ("small", 300.0),
+    ]
+    assert [i.name for i in schedule.deferred] == ["huge"]
+
+
+def test_get_staleness(tmpdir):
+    proj_dir = tmpdir.mkdir("repo").mkdir("proj")
+    now = datetime.datetime(2018, 1, 3, tzinfo=datetime.timezone.utc)
+    assert get_staleness(proj_dir, now) is None
+    assert get_staleness(tmpdir.join("missing"), now) is None
+
+    for name in ["201801010000", "201801020000"]:
+        proj_dir.mkdir(name)
+        proj_dir.mkdir(name + "_data")
+    listing.invalidate()
+
+    assert get_staleness(proj_dir, now) == 86400.0
+
+
+def test_report_keeps_first_deferred(tmpdir):
+    repository = tmpdir.mkdir("repo")
+    schedule = Schedule(3600, 2)
+
+    first = save_report(repository, schedule, ["a"], ["b", "c"])
+    assert sorted(first["deferred"]) == ["b", "c"]
+
+    second = save_report(repository, schedule, ["b"], ["c", "d"])
+    assert second["finished"] == ["b"]
+    assert second["deferred"] == dict(
+        c=first["deferred"]["c"], d=second["time"]
+    )
@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `abhealer.tarstream` module."""
+
+import io
+import os
+import tarfile
+
+from abhealer.tarstream import write_tar, remove_staging
+
+
+def test_write_tar(tmpdir):
+    staging = tmpdir.mkdir("staging")
+    staging.mkdir("sub").join("file").write("data")
+    os.symlink("/orig/proj/sub/file", str(staging.join("link")))
+    trace_infos = {
+        "dsub": ["dsub", "0", str(0o555), "someone", "somegroup"],
+        "slink": ["slink", "f/orig/proj/sub/file", "0", "511", "a", "b"],
+    }
+
+    out = io.BytesIO()
+    stats = write_tar(out, str(staging), trace_infos, "/orig/proj", "proj")
+    assert (stats.files, stats.bytes) == (1, 4)
+
+    out.seek(0)
+    with tarfile.open(fileobj=out) as tar:
+        members = dict((m.name, m) for m in tar.getmembers())
+        assert tar.extractfile("proj/sub/file").read() == b"data"
+
+    assert set(members.keys()) == set(
+        ["proj", "proj/sub", "proj/sub/file", "proj/link"]
+    )
+    assert members["proj/sub"].mode == 0o555
+    assert members["proj/sub"].uname == "someone"
+    assert members["proj/link"].linkname == "sub/file"
+
+    os.chmod(str(staging.join("sub")), 0o555)
+    remove_staging(str(staging))
+    assert not staging.check()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `abhealer.throttle` module."""
+
+import os
+
+import click
+import pytest
+
+from abhealer import throttle
+from abhealer.throttle import Cgroup, Limits, Throttle, parse_size
+
+
+def test_parse_size():
+    assert parse_size(1024) == 1024
+    assert parse_size("512k") == 512 * 1024
+    assert parse_size("50M") == 50 * 1024**2
+    assert parse_size("1GB") == 1024**3
+
+    with pytest.raises(click.UsageError):
+        parse_size("fast")
+
+
+def test_limits():
+    limits = Limits(dict(nice=10, cpus="1.5", read_bps="50M"))
+    assert limits.nice == 10
+    assert limits.cpus == 1.5
+    assert limits.io == dict(read_bps=50 * 1024**2)
+    assert limits
+    assert not Limits()
+
+    with pytest.raises(click.UsageError):
+        Limits(dict(speed=1))
+
+
+def test_combine_split():
+    project = Limits(dict(nice=5, cpus=2, read_bps=100, write_iops=50))
+    total = Limits(dict(nice=10, cpus=3, read_bps=300, write_bps=90))
+
+    combined = project.combine(total.split(3))
+    assert combined.nice == 5
+    assert combined.cpus == 1.0
+    assert combined.io == dict(read_bps=100, write_bps=30, write_iops=50)
+
+    # Shares never drop to 0, that would mean "no limit"
+    assert Limits(dict(read_iops=2)).split(4).io == dict(read_iops=1)
+
+
+def test_fallback_warns(tmpdir, monkeypatch, capsys):
+    monkeypatch.setattr(throttle, "_get_current_cgroup", lambda: None)
+
+    limits = Limits(dict(cpus=1))
+    throttling = Throttle(Limits(dict(write_bps="10M")), jobs=2)
+    prefix, options, kwargs, cleanup = throttling.prepare(
+        "proj", limits, [str(tmpdir)], False
+    )
+    assert options == ""
+    assert kwargs == dict()
+    assert cleanup is None
+
+    err = capsys.readouterr().err
+    assert "total_limits are not enforced" in err
+    assert "CPU limits" in err and "proj" in err
+
+    # Without any limit nothing is worth a warning
+    throttling.prepare("other", Limits(), [str(tmpdir)], False)
+    assert capsys.readouterr().err == ""
+
+
+def _make_cgroup(tmpdir, monkeypatch, controllers="cpuset cpu io memory"):
+    root = tmpdir.mkdir("cgroup")
+    root.join("cgroup.procs").write("")
+    root.join("cgroup.subtree_control").write("")
+    root.join("cgroup.controllers").write(controllers)
+    monkeypatch.setattr(throttle, "_get_current_cgroup", lambda: str(root))
+    return root
+
+
+def test_cgroup_moves_self_to_leaf(tmpdir, monkeypatch):
+    root = _make_cgroup(tmpdir, monkeypatch)
+
+    parent = Cgroup.create("abhealer-1")
+    assert parent is not None
+
+    # Controllers are enabled only once we left the group
+    leaf = root.join(throttle.SELF_CGROUP)
+    assert leaf.join("cgroup.procs").read() == str(os.getpid())
+    assert root.join("cgroup.subtree_control").read() == "+io +cpu"
+
+    group = Cgroup.create("my.proj/1", parent)
+    assert group.path == os.path.join(str(root), "abhealer-1", "my_proj_1")
+    assert group.apply(Limits(dict(cpus=0.5)), [])
+    assert root.join("abhealer-1", "my_proj_1", "cpu.max").read() == (
+        "50000 100000"
+    )
+
+
+def test_cgroup_not_delegated(tmpdir, monkeypatch):
+    # Not a cgroup directory
+    monkeypatch.setattr(throttle, "_get_current_cgroup", lambda: str(tmpdir))
+    assert Cgroup.create("abhealer-1") is None
+
+
+def test_cgroup_without_controllers(tmpdir, monkeypatch):
+    root = _make_cgroup(tmpdir, monkeypatch, controllers="memory pids")
+
+    assert Cgroup.create("abhealer-1") is None
+    assert not root.join(throttle.SELF_CGROUP).check()
+
+
+def test_cgroup_refused_moves_back(tmpdir, monkeypatch):
+    root = _make_cgroup(tmpdir, monkeypatch)
+    monkeypatch.setattr(throttle, "_is_delegated", lambda x: True)
+
+    # The kernel refuses controllers, e.g. another process is in the group
+    root.join("cgroup.subtree_control").remove()
+    root.mkdir("cgroup.subtree_control")
+
+    assert Cgroup.create("abhealer-1") is None
+    assert root.join("cgroup.procs").read() == str(os.getpid())
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `abhealer.tiering` module."""
+
+import os
+import datetime
+
+from abhealer import listing
+from abhealer.__main__ import clear_dirs, find_data_dirs
+from abhealer.tiering import (
+    TIER_SUFFIX,
+    get_repository_id,
+    plan_project,
+    remove_archive_dir,
+    tier_project,
+)
+
+NOW = datetime.datetime(2019, 1, 2)
+
+
+def _make_project(proj_dir):
+    for name in ["201701010000", "201801010000", "201901010000"]:
+        proj_dir.mkdir(name).join("file").write(name)
+        proj_dir.mkdir(name + "_data")
+    listing.invalidate()
+
+
+def test_tier_project(tmpdir):
+    repository = tmpdir.mkdir("repo")
+    proj_dir = repository.mkdir("proj")
+    cold_dir = tmpdir.mkdir("cold")
+    _make_project(proj_dir)
+
+    older_than = datetime.timedelta(days=180)
+    result = tier_project(str(proj_dir), str(cold_dir), older_than, now=NOW)
+
+    assert result.moved == ["201701010000", "201801010000"]
+    moved = proj_dir.join("201801010000")
+    assert os.path.islink(str(moved))
+    assert moved.join("file").read() == "201801010000"
+    assert cold_dir.join(
+        get_repository_id(repository), "proj", "201801010000_data"
+    ).check(dir=1)
+    assert not os.path.islink(str(proj_dir.join("201901010000")))
+
+    # Linked archives are still archives, not damaged ones
+    clear_dirs(proj_dir)
+    assert len(find_data_dirs(proj_dir)) == 3
+
+    # An interrupted replacement is rolled back before cleaning
+    data_dir = proj_dir.join("201901010000_data")
+    data_dir.rename(str(data_dir) + TIER_SUFFIX)
+    listing.invalidate()
+    clear_dirs(proj_dir)
+    assert data_dir.check(dir=1)
+    assert proj_dir.join("201901010000").check(dir=1)
+
+    # Cold copies without links are pruned
+    os.unlink(str(proj_dir.join("201701010000")))
+    os.unlink(str(proj_dir.join("201701010000_data")))
+    listing.invalidate()
+    result = tier_project(str(proj_dir), str(cold_dir), older_than, now=NOW)
+    assert result.moved == []
+    assert result.pruned == ["201701010000", "201701010000_data"]
+
+
+def test_shared_cold_dir(tmpdir):
+    cold_dir = tmpdir.mkdir("cold")
+    older_than = datetime.timedelta(days=180)
+    first = tmpdir.mkdir("first").mkdir("proj")
+    second = tmpdir.mkdir("second").mkdir("proj")
+    _make_project(first)
+    _make_project(second)
+
+    tier_project(str(first), str(cold_dir), older_than, now=NOW)
+
+    # Cold copies of the first repository are not the second one's
+    result = tier_project(str(second), str(cold_dir), older_than, now=NOW)
+    assert result.pruned == []
+    assert first.join("201701010000", "file").read() == "201701010000"
+
+    # Removing a link of the first repository from the second one keeps
+    # the cold copy
+    link = second.join("201801010000")
+    link.remove()
+    os.symlink(os.path.realpath(str(first.join("201801010000"))), str(link))
+    remove_archive_dir(link)
+    assert not os.path.lexists(str(link))
+    assert first.join("201801010000", "file").check(file=1)
+
+    remove_archive_dir(first.join("201801010000"))
+    assert not cold_dir.join(
+        get_repository_id(first.dirname), "proj", "201801010000"
+    ).check()
+
+
+def test_merge_mounts_cold_roots(tmpdir, monkeypatch):
+    from abhealer import environment
+    from abhealer.arecabackup import DockerizedArecaBackup
+
+    monkeypatch.setattr(environment, "is_docker_available", lambda: True)
+    proj_dir = tmpdir.mkdir("repo").mkdir("proj")
+    cold_dir = tmpdir.mkdir("cold")
+    _make_project(proj_dir)
+    tier_project(
+        str(proj_dir), str(cold_dir), datetime.timedelta(days=180), now=NOW
+    )
+
+    cmd = DockerizedArecaBackup().gen_merge_cmd(
+        tmpdir.join("proj.bcfg"), proj_dir, 0, 30
+    )
+    cold_root = os.path.dirname(
+        os.path.realpath(str(proj_dir.join("201701010000")))
+    )
+    assert " -v %s:%s " % (cold_root, cold_root) in cmd
+
+
+def test_plan_project_local_time(tmpdir):
+    proj_dir = tmpdir.mkdir("proj")
+    for name in ["201901011200", "201901011300"]:
+        proj_dir.mkdir(name)
+        proj_dir.mkdir(name + "_data")
+    listing.invalidate()
+
+    # Names are local times, compared without any timezone conversion
+    now = datetime.datetime(2019, 1, 1, 12, 30)
+    older_than = datetime.timedelta(minutes=20)
+    plan = plan_project(str(proj_dir), older_than, now=now)
+    assert plan == [listing.folder_to_int("201901011200")]
+    older_than = datetime.timedelta(minutes=40)
+    assert plan_project(str(proj_dir), older_than, now=now) == []
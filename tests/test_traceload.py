@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `abhealer.traceload` module."""
+
+import gzip
+import zipfile
+
+from abhealer import traceload
+
+
+def _write_trace(data_dir, lines):
+    trace = "#trace\n\n" + "".join("%s\n" % x for x in lines)
+    with zipfile.ZipFile(str(data_dir.join("trace")), "w") as f:
+        f.writestr("trace", gzip.compress(trace.encode()))
+
+
+def test_parallel_matches_serial(tmpdir):
+    data_dirs = []
+    for i in range(traceload.MIN_PARALLEL + 3):
+        data_dir = tmpdir.mkdir("%s_data" % i)
+        _write_trace(data_dir, ["dsrc;0;493;u;g", "fsrc/%s;%s" % (i, i)])
+        data_dirs.append(str(data_dir))
+
+    # Newer archives override older ones
+    _write_trace(tmpdir.join("0_data"), ["dsrc;0;448;u;g"])
+    _write_trace(tmpdir.join("10_data"), ["dsrc;0;511;u;g"])
+
+    serial = traceload.load_trace_infos(data_dirs, jobs=1)
+    assert serial == traceload.load_trace_infos(data_dirs, jobs=2)
+    assert serial["dsrc"] == ["dsrc", "0", "511", "u", "g"]
+    assert serial["fsrc/1"] == ["fsrc/1", "1"]
+    assert "fsrc/0" not in serial
+
+    keys = list(traceload.iter_trace_keys(data_dirs, jobs=2))
+    assert keys == list(traceload.iter_trace_keys(data_dirs, jobs=1))
+    assert keys[1] == [("src", "d"), ("src/1", "f")]
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `abhealer.treecheck` module."""
+
+import os
+
+from abhealer.treecheck import check_tree
+
+
+def test_check_tree(tmpdir):
+    root = tmpdir.mkdir("recovered")
+    sub = root.mkdir("sub")
+    sub.join("ok").write("1234")
+    sub.join("short").write("12")
+    sub.join("extra").write("")
+    root.join(".areca-empty").write("")
+    os.symlink("sub/ok", str(root.join("link")))
+    os.chmod(str(sub), 0o750)
+
+    trace_infos = {
+        "dsub": ["dsub", "0", str(0o750), "u", "g"],
+        "fsub/ok": ["fsub/ok", "4-0"],
+        "fsub/short": ["fsub/short", "4-0"],
+        "fsub/gone": ["fsub/gone", "1-0"],
+        "slink": ["slink", "f/orig/proj/sub/ok", "0", "511", "u", "g"],
+    }
+
+    mismatches = dict(
+        (m.rel_path, m.what)
+        for m in check_tree(
+            str(root), trace_infos, "/orig/proj", jobs=2, owners=False
+        )
+    )
+    assert mismatches == {
+        "sub/short": "size",
+        "sub/extra": "not in the trace",
+        "sub/gone": "missing file",
+    }
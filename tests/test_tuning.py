@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `abhealer.tuning` module."""
+
+import os
+
+from abhealer import listing
+from abhealer.config import get_project_template, merge_medium_options
+from abhealer.tuning import (
+    ProbeResult,
+    choose_settings,
+    load_tuning,
+    probe_file,
+    save_tuning,
+    tune_projects,
+)
+
+
+def _probe(tmpdir, name, data):
+    apath = tmpdir.join(name)
+    apath.write_binary(data)
+    probe = ProbeResult()
+    probe.add(len(data), probe_file(str(apath), len(data)))
+    return probe
+
+
+def test_choose_settings(tmpdir):
+    settings = choose_settings(_probe(tmpdir, "media", os.urandom(100000)), [])
+    assert settings["file_compression"] is False
+    assert settings["transaction_size"] == 51200
+
+    settings = choose_settings(
+        _probe(tmpdir, "text", b"hello world " * 10000),
+        [1024 * 1024 * 1024 * 10],
+    )
+    assert settings["file_compression"] is True
+    assert settings["zip_level"] == 1
+    assert settings["transaction_size"] == 1048576
+
+
+def test_medium_options_rendered():
+    tuned = dict(file_compression=False, zip_level=6, ratio=0.99)
+    merged = merge_medium_options(dict(zip_level=3), dict(), tuned)
+    assert merged == dict(
+        file_compression=False, zip_level=3, transaction_size=51200
+    )
+
+    content = get_project_template().render(merged)
+    assert 'file_compression="false"' in content
+    assert 'zip_level="3"' in content
+
+
+def test_tune_backup_recover(tmpdir):
+    repository = tmpdir.mkdir("repo")
+    src_dir = tmpdir.mkdir("src")
+    src_dir.join("media").write_binary(os.urandom(100000))
+    sources = [("proj", str(src_dir))]
+
+    # The first tuning chooses the format
+    for name, settings, _ in tune_projects(repository, sources, jobs=1):
+        save_tuning(repository, {name: settings})
+    backup_options = merge_medium_options(
+        dict(), dict(), load_tuning(repository)["proj"]
+    )
+    assert backup_options["file_compression"] is False
+
+    # Backed up, then the data becomes compressible
+    repository.mkdir("proj").mkdir("201901010000_data")
+    listing.invalidate()
+    src_dir.join("media").write_binary(b"hello world " * 10000)
+    for name, settings, _ in tune_projects(repository, sources, jobs=1):
+        save_tuning(repository, {name: settings})
+
+    # Recovered with the format the archive was written with
+    recover_options = merge_medium_options(
+        dict(), dict(), load_tuning(repository)["proj"]
+    )
+    assert recover_options["file_compression"] is False
+    assert recover_options["zip_level"] == backup_options["zip_level"]
+
+    # A new project has no format to keep
+    format_ = dict(file_compression=False, zip_level=9)
+    settings = choose_settings(_probe(tmpdir, "text", b"a" * 10000), [])
+    assert settings["file_compression"] is True
+    settings = choose_settings(
+        _probe(tmpdir, "text", b"a" * 10000), [], format_
+    )
+    assert settings["file_compression"] is False
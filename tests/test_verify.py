@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `abhealer.verify` module."""
+
+import gzip
+import zipfile
+
+from abhealer.arecabackup import Repository
+from abhealer.verify import VerifyState, verify_archive, verify_repository
+
+MANIFEST = '<manifest><property key="Stored files" value="%s"/></manifest>'
+
+
+def _write_gzip_zip(apath, name, content):
+    with zipfile.ZipFile(str(apath), "w") as f:
+        f.writestr(name, gzip.compress(content))
+
+
+def _make_archive(tmpdir, stored_files="2"):
+    archive_dir = tmpdir.mkdir("201711032056")
+    with zipfile.ZipFile(str(archive_dir.join("a.txt")), "w") as f:
+        f.writestr("a.txt", b"a")
+    with zipfile.ZipFile(str(archive_dir.join("b.zip")), "w") as f:
+        f.writestr("b", b"0123456789")
+
+    data_dir = tmpdir.mkdir("201711032056_data")
+    _write_gzip_zip(data_dir.join("trace"), "trace", b"fa.txt;1\n")
+    _write_gzip_zip(
+        data_dir.join("manifest"),
+        "manifest",
+        (MANIFEST % stored_files).encode(),
+    )
+
+    return archive_dir, data_dir
+
+
+def test_good_archive(tmpdir):
+    archive_dir, data_dir = _make_archive(tmpdir)
+
+    result = verify_archive(str(archive_dir), str(data_dir), True)
+    assert result["errors"] == []
+    assert result["stored_files"] == 2
+    assert result["found_files"] == 2
+
+
+def test_bad_crc(tmpdir):
+    archive_dir, data_dir = _make_archive(tmpdir)
+    apath = archive_dir.join("b.zip")
+    apath.write_binary(
+        apath.read_binary().replace(b"0123456789", b"0123456780")
+    )
+
+    result = verify_archive(str(archive_dir), str(data_dir), True)
+    assert result["errors"] == ["Bad CRC : b.zip"]
+
+
+def test_stored_files_mismatch(tmpdir):
+    archive_dir, data_dir = _make_archive(tmpdir, stored_files="3")
+
+    result = verify_archive(str(archive_dir), str(data_dir), True)
+    assert result["errors"] == ["Manifest stored 3 files but found 2"]
+
+
+def test_invalid_stored_files(tmpdir):
+    archive_dir, data_dir = _make_archive(tmpdir, stored_files="many")
+
+    result = verify_archive(str(archive_dir), str(data_dir), True)
+    assert len(result["errors"]) == 1
+    assert result["errors"][0].startswith("Broken manifest")
+    assert result["stored_files"] is None
+
+
+def test_user_zip_not_checked(tmpdir):
+    archive_dir, data_dir = _make_archive(tmpdir)
+    apath = archive_dir.join("b.zip")
+    apath.write_binary(
+        apath.read_binary().replace(b"0123456789", b"0123456780")
+    )
+
+    # Without compression the zip is a file the user backed up
+    result = verify_archive(str(archive_dir), str(data_dir), False)
+    assert result["errors"] == []
+
+    # With compression every stored file must be a zip
+    archive_dir.join("plain").write("plain")
+    result = verify_archive(str(archive_dir), str(data_dir), True)
+    assert "Bad CRC : b.zip" in result["errors"]
+    assert any(e.startswith("Unreadable plain") for e in result["errors"])
+
+
+def test_verify_repository(tmpdir):
+    repo = tmpdir.mkdir("repo")
+    repo.mkdir("areca_config_backup").join("proj.bcfg").write(
+        '<target><medium file_compression="true"/></target>'
+    )
+    proj_dir = repo.mkdir("proj")
+    proj_dir.join("history").write("")
+    names = ["2017110320%02d" % i for i in range(7)]
+    for name in names:
+        archive_dir = proj_dir.mkdir(name)
+        with zipfile.ZipFile(str(archive_dir.join("a")), "w") as f:
+            f.writestr("a", b"a")
+        data_dir = proj_dir.mkdir(name + "_data")
+        _write_gzip_zip(data_dir.join("trace"), "trace", b"fa;1\n")
+        _write_gzip_zip(
+            data_dir.join("manifest"), "manifest", (MANIFEST % 1).encode()
+        )
+
+    state = VerifyState(tmpdir.join("state.json"))
+    results = dict(verify_repository(Repository(str(repo)), state, jobs=1))
+    assert sorted(results) == ["proj/%s" % n for n in names]
+    assert all(not r["errors"] for r in results.values())
+
+    # Verified archives are skipped next time
+    state = VerifyState(tmpdir.join("state.json"))
+    assert list(verify_repository(Repository(str(repo)), state, jobs=1)) == []
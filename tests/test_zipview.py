@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `abhealer.zipview` module."""
+
+import gzip
+import hashlib
+import zipfile
+
+import pytest
+
+from abhealer.zipview import ZipView, ZipViewError, hash_file, read_gzip_member
+
+
+@pytest.mark.parametrize(
+    "compression", [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED]
+)
+def test_read_gzip_member(tmpdir, compression):
+    content = b"#trace\ndsub;0;493;root;root\n" * 1000
+    apath = str(tmpdir.join("trace"))
+    with zipfile.ZipFile(apath, "w", compression) as f:
+        f.writestr("trace", gzip.compress(content))
+
+    assert read_gzip_member(apath, "trace") == content
+
+    with ZipView(apath) as view:
+        assert view.testzip() is None
+        assert view.check("trace")
+
+
+def test_testzip_bad_crc(tmpdir):
+    apath = tmpdir.join("file")
+    with zipfile.ZipFile(str(apath), "w") as f:
+        f.writestr("file", b"0123456789")
+
+    data = apath.read_binary().replace(b"0123456789", b"0123456780")
+    apath.write_binary(data)
+
+    with ZipView(apath) as view:
+        assert view.testzip() == "file"
+
+
+def test_encrypted_member(tmpdir):
+    apath = str(tmpdir.join("file"))
+    with zipfile.ZipFile(apath, "w") as f:
+        f.writestr("file", b"0123456789")
+
+    with ZipView(apath) as view:
+        # zipfile can't write encrypted members
+        view.getinfo("file").flag_bits |= 0x1
+
+        with pytest.raises(ZipViewError):
+            view.raw_view("file")
+
+        # Callers catch broken zips already
+        with pytest.raises(zipfile.BadZipfile):
+            view.testzip()
+
+
+def test_hash_file(tmpdir):
+    apath = tmpdir.join("data")
+    apath.write_binary(b"abc" * 100000)
+
+    digest = hashlib.sha256()
+    hash_file(apath, digest)
+    assert digest.digest() == hashlib.sha256(b"abc" * 100000).digest()
+
+
+def test_not_a_zip(tmpdir):
+    for content in (b"", b"short", b"x" * 1000):
+        apath = tmpdir.join("file")
+        apath.write_binary(content)
+        with pytest.raises(zipfile.BadZipfile):
+            ZipView(str(apath))